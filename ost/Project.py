@@ -3,6 +3,7 @@
 # import standard libs
 import os
 import sys
+import socket
 import importlib
 import json
 import glob
@@ -16,13 +17,19 @@ from shapely.wkt import loads
 
 from ost.helpers import vector as vec, raster as ras
 from ost.s1 import search, refine, download, burst, grd_batch
-from ost.helpers import scihub, helpers as h
+from ost.helpers import scihub, helpers as h, metrics, trace, snap_engine
+from ost.helpers import cache, dem, orbits, runner, resources
+from ost.helpers.state import TaskStore, DONE, FAILED
+from ost.helpers.locks import FileLock
 
 # set logging
 logging.basicConfig(stream=sys.stdout,
                     format='%(levelname)s:%(message)s',
                     level=logging.INFO)
 
+# the attempts of a processing task in the task store before giving up
+MAX_ATTEMPTS = 5
+
 
 class Generic():
 
@@ -83,6 +90,144 @@ class Generic():
         self._create_processing_dir(self.processing_dir)
         self._create_temp_dir(self.temp_dir)
 
+        # the resource usage of all external commands
+        self.metrics_file = opj(self.project_dir, 'metrics.jsonl')
+        metrics.activate(self.metrics_file)
+
+    def processing_metrics(self, key='stage'):
+        '''Summarises the resource usage of the processing
+
+        Args:
+            key (str): the tag to group by (e.g. stage, operator or host)
+
+        Returns:
+            dict: calls, wall and cpu times, peak memory and i/o per group,
+                  sorted by the total wall time
+        '''
+
+        metrics_files = glob.glob(opj(self.project_dir, 'metrics*.jsonl'))
+        if not metrics_files:
+            print(' INFO: No metrics have been recorded yet.')
+            return {}
+
+        return metrics.summary(metrics_files, key)
+
+    def enable_tracing(self, trace_file=None):
+        '''Writes a timeline of all following processing steps
+
+        Search, downloads, every external command and all scheduled tasks
+        are written as spans to a trace file that can be opened in
+        https://ui.perfetto.dev or chrome://tracing.
+
+        Args:
+            trace_file (str): path to the trace file
+                              (default: trace.json in the project directory)
+        '''
+
+        self.trace_file = trace_file or opj(self.project_dir, 'trace.json')
+        trace.activate(self.trace_file)
+        print(' INFO: Writing the processing timeline to {}.'.format(
+            self.trace_file))
+
+    def enable_cache(self, cache_dir=None, max_size=cache.DEFAULT_SIZE):
+        '''Caches the intermediate products of all following processing
+
+        The imported, speckle filtered and calibrated products as well as
+        the Layover/Shadow masks are kept in a cache outside the processing
+        directory. When the ARD parameters change, a re-run with
+        overwrite=True then only re-runs the stages affected by the change
+        (e.g. only terrain correction for a new resolution).
+
+        Args:
+            cache_dir (str): the directory of the cache
+                             (default: cache in the project directory)
+            max_size (float): the maximum size of the cache in GB, above
+                              which the least recently used products are
+                              removed
+        '''
+
+        self.cache_dir = cache_dir or opj(self.project_dir, 'cache')
+        cache.activate(self.cache_dir, max_size)
+        print(' INFO: Caching intermediate products in {}.'.format(
+            self.cache_dir))
+
+    def set_timeouts(self, timeouts):
+        '''Limits the run time of the external commands of each stage
+
+        Commands running longer than the timeout of their stage are killed
+        and fail, so that a hanging gpt call does not block a worker.
+
+        Args:
+            timeouts (dict): seconds per stage (e.g. dict(Import=1800)),
+                             with 'default' for all other stages
+        '''
+
+        runner.set_timeouts(timeouts)
+        print(' INFO: Timeouts of the processing stages set to {}.'.format(
+            timeouts))
+
+    def start_snap_engine(self, max_jobs=None, heap=None):
+        '''Keeps SNAP loaded for all following gpt calls
+
+        Instead of starting a new JVM for every processing step, all gpt
+        calls of the project (including those of the worker processes) are
+        executed by a single long-lived SNAP process. This needs SNAP's
+        Python bridge (esa_snappy or snappy) to be configured for the
+        Python interpreter of OST. If it is not, gpt is used as before.
+
+        By default, the engine is sized for the concurrent jobs of the
+        resource budget (see ost.helpers.resources), with the heap of all
+        jobs together. Since the jobs share the engine's JVM, the thread
+        count (-q), tile cache (-c) and cache clearing (-x) of a gpt call
+        act on the JAI state of the whole engine.
+
+        Args:
+            max_jobs (int): the number of gpt calls executed at once
+                            (default: the number of budgeted jobs)
+            heap (int): the maximum JVM heap in MB for all jobs
+                        (default: the summed heap of the budgeted jobs)
+
+        Returns:
+            bool: True if the engine is running
+        '''
+
+        if max_jobs is None or heap is None:
+            allocation = resources.ResourceManager(max_jobs).allocation(
+                max_jobs)
+            max_jobs = allocation['workers']
+            heap = heap or allocation['heap'] * max_jobs
+
+        self.snap_engine = snap_engine.start(max_jobs=max_jobs, heap=heap)
+        return self.snap_engine is not None
+
+    def stop_snap_engine(self):
+        '''Shuts down the SNAP engine started by start_snap_engine'''
+
+        snap_engine.stop()
+        if getattr(self, 'snap_engine', None) is not None:
+            self.snap_engine.wait()
+            self.snap_engine = None
+
+    def processing_timeline(self, outfile=None):
+        '''Combines the trace files of all workers into one timeline
+
+        Args:
+            outfile (str): path of the combined trace file
+                           (default: timeline.json in the project directory)
+
+        Returns:
+            str: path of the combined trace file
+        '''
+
+        trace_files = glob.glob(opj(self.project_dir, 'trace*.json'))
+        if not trace_files:
+            print(' INFO: No timeline has been recorded yet.')
+            return None
+
+        outfile = outfile or opj(self.project_dir, 'timeline.json')
+        trace.merge(trace_files, outfile)
+        return outfile
+
     def _create_project_dir(self, if_not_empty=True):
         '''Creates the high-lvel project directory
 
@@ -276,7 +421,9 @@ class Sentinel1(Generic):
                exclude_marginal=True,
                full_aoi_crossing=True,
                mosaic_refine=True,
-               area_reduce=0.05):
+               area_reduce=0.05,
+               concurrent=None,
+               mosaic_optimise=False):
 
         self.refined_inventory_dict, self.coverages = refine.search_refinement(
                                        self.aoi,
@@ -285,7 +432,9 @@ class Sentinel1(Generic):
                                        exclude_marginal=exclude_marginal,
                                        full_aoi_crossing=full_aoi_crossing,
                                        mosaic_refine=mosaic_refine,
-                                       area_reduce=area_reduce)
+                                       area_reduce=area_reduce,
+                                       concurrent=concurrent,
+                                       mosaic_optimise=mosaic_optimise)
 
         # summing up information
         print('--------------------------------------------')
@@ -329,6 +478,142 @@ class Sentinel1(Generic):
         else:
             vec.plot_inventory(self.aoi, inventory_df, transparency)
 
+    def create_dem(self, dem_file=None, max_workers=4):
+        '''Builds a single DEM for all processing steps of the project
+
+        The DEM tiles covering all products of the inventory are gathered
+        once (SRTM 1Sec, and the Copernicus DEM outside of the SRTM
+        coverage) and written into a tiled and compressed GeoTIFF, that
+        is set as External DEM for all processing steps.
+        An existing DEM file is re-used.
+
+        Args:
+            dem_file (str): path to the DEM
+                            (default: dem/dem.tif in the project directory)
+            max_workers (int): the number of tiles downloaded at once
+
+        Returns:
+            str: the path to the DEM (None if it could not be created)
+        '''
+
+        dem_file = dem_file or opj(self.project_dir, 'dem', 'dem.tif')
+
+        if not os.path.isfile(dem_file):
+
+            # the products extend beyond the AOI
+            footprints = getattr(self, 'burst_inventory', None)
+            if footprints is None:
+                footprints = self.inventory
+            if footprints is not None and len(footprints):
+                minx, miny, maxx, maxy = footprints.total_bounds
+            else:
+                minx, miny, maxx, maxy = loads(self.aoi).bounds
+
+            # a margin for the terrain correction at the edges
+            bounds = (minx - 0.1, miny - 0.1, maxx + 0.1, maxy + 0.1)
+            if dem.create_dem(bounds, dem_file,
+                              max_workers=max_workers) is None:
+                return None
+
+        self.set_external_dem(dem_file)
+        return dem_file
+
+    def prefetch_orbits(self, inventory_df=None, orbit_dir=None,
+                        max_workers=4):
+        '''Downloads the orbit files of all products before the processing
+
+        The precise (or, for recent products, restituted) orbit files are
+        stored in SNAP's auxdata directory, so that Apply-Orbit-File finds
+        them without looking them up on the orbit server in every job.
+
+        Args:
+            inventory_df (GeoDataFrame): the products to process
+                         (default: the burst inventory or the inventory)
+            orbit_dir (str): the Sentinel-1 orbit directory of SNAP's
+                             auxdata (default: the one of the user)
+            max_workers (int): the number of orbit files downloaded at once
+
+        Returns:
+            dict: the orbit file per product (None if not available)
+        '''
+
+        if inventory_df is None:
+            inventory_df = getattr(self, 'burst_inventory', None)
+        if inventory_df is None:
+            inventory_df = self.inventory
+        if inventory_df is None:
+            return {}
+
+        column = 'SceneID' if 'SceneID' in inventory_df.columns else \
+            'identifier'
+        return orbits.prefetch(inventory_df[column].unique(),
+                               orbit_dir or orbits.ORBIT_DIR, max_workers)
+
+    def _check_dem_coverage(self):
+        '''Switches to a project DEM if the AOI is outside of SRTM'''
+
+        _, miny, _, maxy = loads(self.aoi).bounds
+        self.center_lat = loads(self.aoi).centroid.y
+
+        if (self.ard_parameters['single ARD']['dem']['dem name'] ==
+                'SRTM 1Sec HGT' and
+                (maxy > dem.SRTM_NORTH or miny < dem.SRTM_SOUTH)):
+            print(' INFO: Scene is outside SRTM coverage. Will use the'
+                  ' Copernicus 30m DEM instead.')
+            self.create_dem()
+
+    def _task_store(self, worker=False):
+        '''Returns the task store and, in worker mode, the lock directory
+
+        In worker mode, several machines process the project on a shared
+        processing directory. Since SQLite is not safe on network file
+        systems, every machine keeps its own task store.
+        '''
+
+        if not worker:
+            return TaskStore(opj(self.processing_dir, '.ost_tasks.sqlite')), None
+
+        # appending to one file is not safe on network file systems either
+        metrics.activate(opj(self.project_dir, 'metrics.{}.jsonl'.format(
+            socket.gethostname())))
+        if trace.enabled():
+            root, ext = os.path.splitext(os.environ[trace.TRACE_ENV])
+            trace.activate('{}.{}{}'.format(root, socket.gethostname(), ext))
+
+        return (TaskStore(opj(self.processing_dir, '.ost_tasks.{}.sqlite'
+                              .format(socket.gethostname()))),
+                opj(self.processing_dir, '.locks'))
+
+    def _mosaic_lock(self, lock_dir):
+        '''Claims the mosaicking in worker mode
+
+        Returns:
+            the FileLock if this worker creates the mosaics (None if not
+            in worker mode), False if another worker creates them
+        '''
+
+        if not lock_dir:
+            return None
+
+        lock = FileLock(opj(lock_dir, 'mosaic.lock'))
+        if not lock.acquire():
+            print(' INFO: The mosaics are created by another worker.')
+            return False
+
+        return lock
+
+    def _report_tasks(self, store, stage, nr_of_tasks):
+        '''Prints the progress of a processing stage from the task store'''
+
+        summary = store.summary(stage)
+        print(' INFO: {} of {} {} tasks done, {} failed.'.format(
+            summary.get(DONE, 0), nr_of_tasks, stage, summary.get(FAILED, 0)))
+
+        if summary.get(FAILED, 0):
+            print(' INFO: Failed tasks are not retried after {} attempts.'
+                  ' Use TaskStore.reset() on {} to retry them.'.format(
+                      MAX_ATTEMPTS, store.db_file))
+
 
 class Sentinel1_SLCBatch(Sentinel1):
     ''' A Sentinel-1 specific subclass of the Generic OST class
@@ -480,7 +765,23 @@ class Sentinel1_SLCBatch(Sentinel1):
         self.ard_parameters['single ARD']['dem'] = dem_dict
 
     def bursts_to_ard(self, timeseries=False, timescan=False, mosaic=False,
-                     overwrite=False, exec_file=None, cut_to_aoi=False):
+                     overwrite=False, exec_file=None, cut_to_aoi=False,
+                     max_workers=1, worker=False, prefetch_orbits=False):
+        '''Processes all bursts of the burst inventory
+
+        With worker=True, the same call can be run on several machines
+        sharing the processing directory. Every machine then claims single
+        bursts (and time-series, timescans) through lock files, so that
+        each one is processed by only one of them.
+
+        With prefetch_orbits=True, the orbit files of all bursts are
+        downloaded before the processing (see prefetch_orbits).
+        '''
+
+        # SRTM does not cover high latitudes
+        self._check_dem_coverage()
+        if prefetch_orbits:
+            self.prefetch_orbits()
 
         # in case ard parameters have been updated, write them to json file
         self.update_ard_parameters()
@@ -489,40 +790,31 @@ class Sentinel1_SLCBatch(Sentinel1):
             print(' INFO: Deleting processing folder to start from scratch')
             h.remove_folder_content(self.processing_dir)
 
-        # set resolution in degree
-        self.center_lat = loads(self.aoi).centroid.y
-        if float(self.center_lat) > 59 or float(self.center_lat) < -59:
-            print(' INFO: Scene is outside SRTM coverage. Will use 30m ASTER'
-                  ' DEM instead.')
-            self.ard_parameters['single ARD']['dem'] = 'ASTER 1sec GDEM'
-
         # set resolution to degree
         # self.ard_parameters['resolution'] = h.resolution_in_degree(
         #    self.center_lat, self.ard_parameters['resolution'])
 
-        nr_of_processed = len(
-            glob.glob(opj(self.processing_dir, '*', '*', '.processed')))
-
-        # check and retry function
-        i = 0
-        while len(self.burst_inventory) > nr_of_processed:
-
-            burst.burst_to_ard_batch(self.burst_inventory,
-                                     self.download_dir,
-                                     self.processing_dir,
-                                     self.temp_dir,
-                                     self.proc_file,
-                                     self.data_mount, 
-                                     exec_file)
+        if exec_file:
+            self._export_burst_tasks(timeseries, timescan, mosaic, exec_file,
+                                     cut_to_aoi)
+            return
 
-            nr_of_processed = len(
-                glob.glob(opj(self.processing_dir, '*', '*', '.processed')))
+        # the state of the single tasks, failed ones are retried up to
+        # MAX_ATTEMPTS times
+        store, lock_dir = self._task_store(worker)
 
-            i += 1
+        burst.burst_to_ard_batch(self.burst_inventory,
+                                 self.download_dir,
+                                 self.processing_dir,
+                                 self.temp_dir,
+                                 self.proc_file,
+                                 self.data_mount,
+                                 max_workers=max_workers,
+                                 store=store,
+                                 max_attempts=MAX_ATTEMPTS,
+                                 lock_dir=lock_dir)
 
-            # not more than 5 trys
-            if i == 5:
-                break
+        self._report_tasks(store, 'ard', len(self.burst_inventory))
 
         # do we delete the downloads here?
         if timeseries or timescan:
@@ -530,19 +822,29 @@ class Sentinel1_SLCBatch(Sentinel1):
                                            self.processing_dir,
                                            self.temp_dir,
                                            self.proc_file,
-                                           exec_file)
+                                           store=store,
+                                           max_attempts=MAX_ATTEMPTS,
+                                           lock_dir=lock_dir)
 
             # do we deleete the single ARDs here?
             if timescan:
                 burst.timeseries_to_timescan(self.burst_inventory,
                                              self.processing_dir,
                                              self.temp_dir,
-                                             self.proc_file)
+                                             self.proc_file,
+                                             store=store,
+                                             max_attempts=MAX_ATTEMPTS,
+                                             lock_dir=lock_dir)
 
 
         if cut_to_aoi:
             cut_to_aoi = self.aoi
-            
+
+        # in worker mode, only one worker creates the mosaics
+        mosaic_lock = self._mosaic_lock(lock_dir) if mosaic else None
+        if mosaic_lock is False:
+            mosaic = False
+
         if mosaic and timeseries:
             burst.mosaic_timeseries(self.burst_inventory,
                                   self.processing_dir,
@@ -558,6 +860,62 @@ class Sentinel1_SLCBatch(Sentinel1):
                                   cut_to_aoi
             )
 
+        if mosaic_lock:
+            mosaic_lock.release()
+
+    def _export_burst_tasks(self, timeseries, timescan, mosaic, exec_file,
+                            cut_to_aoi=False):
+        '''Writes all burst processing stages to a task manifest
+
+        Instead of processing (and retrying) every stage, the tasks are
+        added to the manifest in exec_file, together with a GNU parallel
+        and a SLURM script to run them (see ost.helpers.manifest).
+        '''
+
+        # start with a fresh manifest
+        if os.path.isfile(exec_file):
+            os.remove(exec_file)
+
+        burst.burst_to_ard_batch(self.burst_inventory,
+                                 self.download_dir,
+                                 self.processing_dir,
+                                 self.temp_dir,
+                                 self.proc_file,
+                                 self.data_mount,
+                                 exec_file)
+
+        if timeseries or timescan:
+            burst.burst_ards_to_timeseries(self.burst_inventory,
+                                           self.processing_dir,
+                                           self.temp_dir,
+                                           self.proc_file,
+                                           exec_file)
+
+            if timescan:
+                burst.timeseries_to_timescan(self.burst_inventory,
+                                             self.processing_dir,
+                                             self.temp_dir,
+                                             self.proc_file,
+                                             exec_file)
+
+        if cut_to_aoi:
+            cut_to_aoi = self.aoi
+
+        if mosaic and timeseries:
+            burst.mosaic_timeseries(self.burst_inventory,
+                                    self.processing_dir,
+                                    self.temp_dir,
+                                    cut_to_aoi,
+                                    exec_file)
+
+        if mosaic and timescan:
+            burst.mosaic_timescan(self.burst_inventory,
+                                  self.processing_dir,
+                                  self.temp_dir,
+                                  self.proc_file,
+                                  cut_to_aoi,
+                                  exec_file)
+
     def create_timeseries_animation(timeseries_dir, product_list, outfile, 
                                     shrink_factor=1, duration=1, 
                                     add_dates=False):
@@ -644,9 +1002,78 @@ class Sentinel1_GRDBatch(Sentinel1):
                          'image resampling': img_res})
         self.ard_parameters['single ARD']['dem'] = dem_dict
         
+    def _export_grd_tasks(self, inventory_df, subset, timeseries, timescan,
+                          mosaic, exec_file, cut_to_aoi=False):
+        '''Writes all GRD processing stages to a task manifest
+
+        Instead of processing (and retrying) every stage, the tasks are
+        added to the manifest in exec_file, together with a GNU parallel
+        and a SLURM script to run them (see ost.helpers.manifest).
+        '''
+
+        # start with a fresh manifest
+        if os.path.isfile(exec_file):
+            os.remove(exec_file)
+
+        grd_batch.grd_to_ard_batch(inventory_df,
+                                   self.download_dir,
+                                   self.processing_dir,
+                                   self.temp_dir,
+                                   self.proc_file,
+                                   subset,
+                                   self.data_mount,
+                                   exec_file)
+
+        if timeseries or timescan:
+            grd_batch.ards_to_timeseries(inventory_df,
+                                         self.processing_dir,
+                                         self.temp_dir,
+                                         self.proc_file,
+                                         exec_file)
+
+        if timescan:
+            grd_batch.timeseries_to_timescan(inventory_df,
+                                             self.processing_dir,
+                                             self.proc_file,
+                                             exec_file)
+
+        if cut_to_aoi:
+            cut_to_aoi = self.aoi
+
+        if mosaic and timeseries and not subset:
+            grd_batch.mosaic_timeseries(inventory_df,
+                                        self.processing_dir,
+                                        self.temp_dir,
+                                        cut_to_aoi,
+                                        exec_file)
+
+        if mosaic and timescan and not subset:
+            grd_batch.mosaic_timescan(inventory_df,
+                                      self.processing_dir,
+                                      self.temp_dir,
+                                      self.proc_file,
+                                      cut_to_aoi,
+                                      exec_file)
+
     def grds_to_ard(self, inventory_df=None, subset=None, timeseries=False, 
                    timescan=False, mosaic=False, overwrite=False, 
-                   exec_file=None, cut_to_aoi=False):
+                   exec_file=None, cut_to_aoi=False, max_workers=1,
+                   worker=False, prefetch_orbits=False):
+        '''Processes all acquisitions of the inventory
+
+        With worker=True, the same call can be run on several machines
+        sharing the processing directory. Every machine then claims single
+        acquisitions (and time-series, timescans) through lock files, so
+        that each one is processed by only one of them.
+
+        With prefetch_orbits=True, the orbit files of all acquisitions are
+        downloaded before the processing (see prefetch_orbits).
+        '''
+
+        # SRTM does not cover high latitudes
+        self._check_dem_coverage()
+        if prefetch_orbits:
+            self.prefetch_orbits(inventory_df)
 
         self.update_ard_parameters()
         
@@ -654,13 +1081,6 @@ class Sentinel1_GRDBatch(Sentinel1):
             print(' INFO: Deleting processing folder to start from scratch')
             h.remove_folder_content(self.processing_dir)
 
-        # set resolution in degree
-#        self.center_lat = loads(self.aoi).centroid.y
-#        if float(self.center_lat) > 59 or float(self.center_lat) < -59:
-#            print(' INFO: Scene is outside SRTM coverage. Will use 30m ASTER'
-#                  ' DEM instead.')
-#            self.ard_parameters['dem'] = 'ASTER 1sec GDEM'
-
         if subset:
             if subset.split('.')[-1] == '.shp':
                 subset = str(vec.shp_to_wkt(subset, buffer=0.1, envelope=True))
@@ -671,107 +1091,67 @@ class Sentinel1_GRDBatch(Sentinel1):
                       ' Should be either path to a shapefile or a WKT Polygon.')
                 sys.exit()
 
-        # check number of already prcessed acquisitions
-        nr_of_processed = len(
-            glob.glob(opj(self.processing_dir, '*', '20*', '.processed'))
-        )
+        if exec_file:
+            self._export_grd_tasks(inventory_df, subset, timeseries, timescan,
+                                   mosaic, exec_file, cut_to_aoi)
+            return
 
         # number of acquisitions to process
         nr_of_acq = len(
             inventory_df.groupby(['relativeorbit', 'acquisitiondate'])
         )
 
-        # check and retry function
-        i = 0
-        while nr_of_acq > nr_of_processed:
+        # the state of the single tasks, failed ones are retried up to
+        # MAX_ATTEMPTS times
+        store, lock_dir = self._task_store(worker)
+
+        # the grd to ard batch routine
+        grd_batch.grd_to_ard_batch(
+                              inventory_df,
+                              self.download_dir,
+                              self.processing_dir,
+                              self.temp_dir,
+                              self.proc_file,
+                              subset,
+                              self.data_mount,
+                              max_workers=max_workers,
+                              store=store,
+                              max_attempts=MAX_ATTEMPTS,
+                              lock_dir=lock_dir)
+
+        self._report_tasks(store, 'ard', nr_of_acq)
 
-            # the grd to ard batch routine
-            grd_batch.grd_to_ard_batch(
-                                  inventory_df,
-                                  self.download_dir,
-                                  self.processing_dir,
-                                  self.temp_dir,
-                                  self.proc_file,
-                                  subset,
-                                  self.data_mount,
-                                  exec_file)
-            
-            # reset number of already processed acquisitions
-            nr_of_processed = len(
-                glob.glob(opj(self.processing_dir, '*', '20*', '.processed')))
-            i += 1
-            
-            # not more than 5 trys
-            if i == 5:
-                break
-        
         # time-series part
         if timeseries or timescan:
-            
-            nr_of_processed = len(
-                    glob.glob(opj(self.processing_dir, '*', 
-                                  'Timeseries', '.*processed')))
-            
-            nr_of_polar = len(
-                inventory_df.polarisationmode.unique()[0].split(' '))
-            nr_of_tracks = len(inventory_df.relativeorbit.unique())
-            nr_of_ts = nr_of_polar * nr_of_tracks
-            
-            
-            # check and retry function
-            i = 0
-            while nr_of_ts > nr_of_processed:
-                
-                grd_batch.ards_to_timeseries(inventory_df, 
-                                    self.processing_dir, 
-                                    self.temp_dir, 
-                                    self.proc_file, 
-                                    exec_file)
-                
-                nr_of_processed = len(
-                    glob.glob(opj(self.processing_dir, '*',
-                                  'Timeseries', '.*processed')))
-                i += 1
-            
-                # not more than 5 trys
-                if i == 5:
-                    break
-            
+
+            grd_batch.ards_to_timeseries(inventory_df,
+                                         self.processing_dir,
+                                         self.temp_dir,
+                                         self.proc_file,
+                                         None,
+                                         store=store,
+                                         max_attempts=MAX_ATTEMPTS,
+                                         lock_dir=lock_dir)
+
         if timescan:
-            
-            # number of already processed timescans
-            nr_of_processed = len(glob.glob(opj(
-                self.processing_dir, '*', 'Timescan', '.*processed')))
-            
-            # number of expected timescans
-            nr_of_polar = len(
-                inventory_df.polarisationmode.unique()[0].split(' '))
-            nr_of_tracks = len(inventory_df.relativeorbit.unique())
-            nr_of_ts = nr_of_polar * nr_of_tracks
-            
-            i = 0
-            while nr_of_ts > nr_of_processed:
-                 
-                 grd_batch.timeseries_to_timescan(
-                         inventory_df,
-                         self.processing_dir,
-                         self.proc_file)
-                 
-                 nr_of_processed = len(glob.glob(opj(
-                    self.processing_dir, '*', 'Timescan', '.*processed')))
-                 
-                 i += 1
-        
-                # not more than 5 trys
-                 if i == 5:
-                     break
-                
-            if i < 5 and exec_file:
-                print(' create vrt command')                
-                
+
+            grd_batch.timeseries_to_timescan(inventory_df,
+                                             self.processing_dir,
+                                             self.proc_file,
+                                             store=store,
+                                             max_attempts=MAX_ATTEMPTS,
+                                             lock_dir=lock_dir)
+
         if cut_to_aoi:
             cut_to_aoi = self.aoi
-            
+
+        # in worker mode, only one worker creates the mosaics
+        mosaic_lock = None
+        if mosaic and not subset:
+            mosaic_lock = self._mosaic_lock(lock_dir)
+            if mosaic_lock is False:
+                mosaic = False
+
         if mosaic and timeseries and not subset:
             grd_batch.mosaic_timeseries(
                     inventory_df,
@@ -788,3 +1168,6 @@ class Sentinel1_GRDBatch(Sentinel1):
                                   self.proc_file,
                                   cut_to_aoi
             )
+
+        if mosaic_lock:
+            mosaic_lock.release()
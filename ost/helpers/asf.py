@@ -10,7 +10,7 @@ import requests
 import tqdm
 import multiprocessing
 
-from ost.helpers import helpers as h
+from ost.helpers import helpers as h, trace
 from ost import Sentinel1_Scene as S1Scene
 
 
@@ -67,6 +67,8 @@ def check_connection(uname, pword):
     return response.status_code
 
 
+@trace.traced('download', 'download',
+              label=lambda argument_list: os.path.basename(argument_list[1]))
 def s1_download(argument_list):
     """
     This function will download S1 products from ASF mirror.
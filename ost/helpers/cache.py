@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+'''
+This module caches intermediate products of the processing chains.
+
+Every cached product (e.g. the imported, border noise corrected and
+calibrated frames of an acquisition) is stored under a key that is a hash
+of its inputs, the SNAP graphs used and the processing parameters that
+affect it. The key of a later stage includes the key of the stage before,
+so that changing a late-stage parameter such as the resolution or the dB
+conversion only re-runs the stages that actually depend on it.
+
+If the OST_CACHE_DIR environment variable is set, the cache is used by
+all processes. Its size is bounded by OST_CACHE_SIZE (in GB) by removing
+the least recently used products. Products are copied into and out of the
+cache, since some processing steps (border noise removal, dB conversion)
+modify their input in place.
+
+Example:
+    key = cache.stage_key('import', [cache.fingerprint(scene)],
+                          dict(polarisation='VV,VH'))
+    if not cache.fetch(key, outfile):
+        ...  # process outfile
+        cache.store(key, outfile)
+'''
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+
+CACHE_ENV = 'OST_CACHE_DIR'
+SIZE_ENV = 'OST_CACHE_SIZE'
+
+# the default maximum size in GB
+DEFAULT_SIZE = 50
+
+
+def activate(cache_dir, max_size=DEFAULT_SIZE):
+    '''Sets the cache for this and all child processes
+
+    Args:
+        cache_dir (str): the directory of the cached products
+        max_size (float): the maximum size of the cache in GB
+    '''
+
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ[CACHE_ENV] = os.path.abspath(cache_dir)
+    os.environ[SIZE_ENV] = str(max_size)
+
+
+def deactivate():
+    '''Stops the use of the cache'''
+
+    os.environ.pop(CACHE_ENV, None)
+    os.environ.pop(SIZE_ENV, None)
+
+
+def enabled():
+    return bool(os.environ.get(CACHE_ENV))
+
+
+def fingerprint(file):
+    '''Identifies an input file by its name, size and modification time
+
+    Hashing the content of a several GB large scene would take longer
+    than some of the processing steps.
+
+    Args:
+        file (str): path to the file
+
+    Returns:
+        str: the fingerprint of the file
+    '''
+
+    stat = os.stat(file)
+    return '{}:{}:{}'.format(os.path.basename(str(file)), stat.st_size,
+                             stat.st_mtime_ns)
+
+
+def stage_key(stage, inputs, parameters=None, graphs=None):
+    '''Returns the key of a processing stage
+
+    Args:
+        stage (str): the name of the stage, e.g. calibration
+        inputs (list): fingerprints of the input files or keys of the
+                       stages before
+        parameters (dict): the processing parameters of the stage
+        graphs (list): paths to the SNAP graphs used by the stage
+
+    Returns:
+        str: the hex digest identifying the output of the stage
+    '''
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps(dict(stage=stage, inputs=list(inputs),
+                                  parameters=parameters or {}),
+                             sort_keys=True, default=str).encode())
+
+    for graph in graphs or []:
+        with open(graph, 'rb') as file:
+            digest.update(file.read())
+
+    return digest.hexdigest()
+
+
+def copy_dimap(infile_prefix, outfile_prefix):
+    '''Copies a BEAM-Dimap product to another name
+
+    The references to the data folder within the .dim file are renamed
+    accordingly. The copy is written under a temporary name first, so that
+    a partial copy is never visible as a product.
+
+    Args:
+        infile_prefix (str): the product path without the .dim extension
+        outfile_prefix (str): the path of the copy without the .dim extension
+    '''
+
+    in_name = os.path.basename(str(infile_prefix))
+    out_name = os.path.basename(str(outfile_prefix))
+    tmp_prefix = '{}.{}.part'.format(outfile_prefix, os.getpid())
+
+    shutil.copytree('{}.data'.format(infile_prefix),
+                    '{}.data'.format(tmp_prefix))
+
+    with open('{}.dim'.format(infile_prefix), 'r',
+              encoding='ISO-8859-1') as file:
+        dim = file.read()
+    with open('{}.dim'.format(tmp_prefix), 'w',
+              encoding='ISO-8859-1') as file:
+        file.write(dim.replace('{}.data/'.format(in_name),
+                               '{}.data/'.format(out_name)))
+
+    # replace an existing product
+    if os.path.isdir('{}.data'.format(outfile_prefix)):
+        shutil.rmtree('{}.data'.format(outfile_prefix))
+    os.rename('{}.data'.format(tmp_prefix), '{}.data'.format(outfile_prefix))
+    os.replace('{}.dim'.format(tmp_prefix), '{}.dim'.format(outfile_prefix))
+
+
+def fetch(key, outfile_prefix):
+    '''Copies a cached product to the processing directory
+
+    Args:
+        key (str): the key of the stage (see stage_key)
+        outfile_prefix (str): the output path without the .dim extension
+
+    Returns:
+        bool: True if the product was cached and copied
+    '''
+
+    if not enabled():
+        return False
+
+    entry = _entry(key)
+    if not os.path.isfile('{}.dim'.format(entry)):
+        return False
+
+    try:
+        copy_dimap(entry, outfile_prefix)
+    except OSError:
+        # e.g. removed by another process in the meantime
+        return False
+
+    # mark the product as recently used
+    os.utime('{}.dim'.format(entry))
+    print(' INFO: Using cached product for {}.'.format(
+        os.path.basename(str(outfile_prefix))))
+    return True
+
+
+def store(key, infile_prefix):
+    '''Copies a product into the cache
+
+    Args:
+        key (str): the key of the stage (see stage_key)
+        infile_prefix (str): the product path without the .dim extension
+    '''
+
+    if not enabled():
+        return
+
+    entry = _entry(key)
+    try:
+        copy_dimap(infile_prefix, entry)
+    except OSError as error:
+        print(' INFO: Could not cache {} ({}).'.format(
+            os.path.basename(str(infile_prefix)), error))
+        return
+
+    evict(float(os.environ.get(SIZE_ENV, DEFAULT_SIZE)))
+
+
+def _entry(key):
+    '''Returns the path of a cached product without the .dim extension'''
+    return os.path.join(os.environ[CACHE_ENV], key)
+
+
+def _size(entry):
+    '''Returns the size of a cached product in bytes'''
+
+    size = os.path.getsize('{}.dim'.format(entry))
+    for root, _, files in os.walk('{}.data'.format(entry)):
+        size += sum(os.path.getsize(os.path.join(root, file))
+                    for file in files)
+
+    return size
+
+
+def evict(max_size):
+    '''Removes the least recently used products above the maximum size
+
+    Args:
+        max_size (float): the maximum size of the cache in GB
+    '''
+
+    if not enabled():
+        return
+
+    entries = []
+    for dim_file in glob.glob(os.path.join(os.environ[CACHE_ENV], '*.dim')):
+        # skip copies in progress
+        if dim_file.endswith('.part.dim'):
+            continue
+        try:
+            entries.append((os.path.getmtime(dim_file), dim_file[:-4],
+                            _size(dim_file[:-4])))
+        except OSError:
+            continue
+
+    total = sum(size for _, _, size in entries)
+    for _, entry, size in sorted(entries):
+        if total <= max_size * 1024 ** 3:
+            break
+
+        # the .dim first, so that the product is no longer found
+        try:
+            os.remove('{}.dim'.format(entry))
+        except OSError:
+            continue
+        shutil.rmtree('{}.data'.format(entry), ignore_errors=True)
+        total -= size
+
+
+def track_product(out_dir, stage, parameters=None):
+    '''Returns the path of a product shared by all acquisitions of a track
+
+    The ARD products of OST are written to {processing_dir}/{track}/{date}
+    (GRD) or {processing_dir}/{burst_id}/{date} (bursts). Products that only
+    depend on the acquisition geometry, such as the Layover/Shadow mask,
+    are shared within a hidden folder of the track (or burst) directory,
+    where they are not picked up as ARD products of a date.
+
+    Args:
+        out_dir (str): the output directory of an acquisition
+        stage (str): the name of the product, e.g. ls_mask
+        parameters (dict): the processing parameters of the product
+
+    Returns:
+        str: the path of the product without the .dim extension
+    '''
+
+    track_dir = os.path.dirname(os.path.abspath(str(out_dir)))
+    key = stage_key(stage, [os.path.basename(track_dir)], parameters)
+    return os.path.join(track_dir, '.shared', '{}.{}'.format(stage, key[:16]))
+
+
+def fetch_shared(prefix, outfile_prefix):
+    '''Copies a shared product of a track (see track_product)
+
+    Args:
+        prefix (str): the path of the shared product (None if not shared)
+        outfile_prefix (str): the output path without the .dim extension
+
+    Returns:
+        bool: True if the product exists and was copied
+    '''
+
+    if prefix is None or not os.path.isfile('{}.dim'.format(prefix)):
+        return False
+
+    try:
+        copy_dimap(prefix, outfile_prefix)
+    except OSError:
+        return False
+
+    print(' INFO: Using the {} of the track.'.format(
+        os.path.basename(prefix).split('.')[0]))
+    return True
+
+
+def store_shared(prefix, infile_prefix):
+    '''Shares a product with all acquisitions of a track, if not done yet
+
+    Args:
+        prefix (str): the path of the shared product (None if not shared)
+        infile_prefix (str): the product path without the .dim extension
+    '''
+
+    if prefix is None or os.path.isfile('{}.dim'.format(prefix)):
+        return
+
+    os.makedirs(os.path.dirname(prefix), exist_ok=True)
+    copy_dimap(infile_prefix, prefix)
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+'''
+This module builds a single DEM for all processing steps of a project.
+
+Without an external DEM, every terrain flattening, layover/shadow mask
+and terrain correction call lets SNAP look up (and if needed download)
+the tiles of its auto-download DEM on its own. create_dem() instead
+gathers the 1x1 degree tiles covering the project once, and writes them
+into one tiled, compressed GeoTIFF with overviews, that is then handed
+to all graphs as External DEM (see Project.set_external_dem).
+
+Tiles are taken from the SRTM 1Sec tiles that SNAP itself downloads
+(step.esa.int). Outside of the SRTM coverage (above 60 degrees North and
+below 56 degrees South), or where a SRTM tile is missing, the Copernicus
+GLO-30 DEM (AWS open data) is used instead. Tiles that exist in neither
+(i.e. sea) are left as no data.
+
+Note:
+    SRTM heights refer to the EGM96 geoid, the Copernicus DEM to EGM2008.
+    Both are converted to ellipsoidal heights with EGM96 by SNAP, the
+    difference of the two geoids being well below the DEM accuracy.
+'''
+
+import os
+import math
+import zipfile
+from os.path import join as opj
+from concurrent.futures import ThreadPoolExecutor
+
+import gdal
+import requests
+
+SRTM_URL = 'http://step.esa.int/auxdata/dem/SRTMGL1/{}.SRTMGL1.hgt.zip'
+COPERNICUS_URL = ('https://copernicus-dem-30m.s3.amazonaws.com/'
+                  'Copernicus_DSM_COG_10_{0}_DEM/Copernicus_DSM_COG_10_{0}'
+                  '_DEM.tif')
+
+# the latitude range of SRTM
+SRTM_NORTH, SRTM_SOUTH = 60, -56
+
+DEM_NODATA = -32768.0
+
+
+def tiles(bounds):
+    '''Returns the lower left corners of all 1x1 degree tiles of an extent
+
+    Args:
+        bounds (tuple): minx, miny, maxx, maxy in degrees
+
+    Returns:
+        list: (lat, lon) of the tiles
+    '''
+
+    minx, miny, maxx, maxy = bounds
+    return [(lat, lon)
+            for lat in range(math.floor(miny), math.ceil(maxy))
+            for lon in range(math.floor(minx), math.ceil(maxx))]
+
+
+def _srtm_name(lat, lon):
+    return '{}{:02d}{}{:03d}'.format('N' if lat >= 0 else 'S', abs(lat),
+                                    'E' if lon >= 0 else 'W', abs(lon))
+
+
+def _copernicus_name(lat, lon):
+    return '{}{:02d}_00_{}{:03d}_00'.format('N' if lat >= 0 else 'S',
+                                            abs(lat),
+                                            'E' if lon >= 0 else 'W',
+                                            abs(lon))
+
+
+def _download(url, outfile):
+    '''Downloads a file, returns False if it does not exist'''
+
+    response = requests.get(url, stream=True, timeout=120)
+    if response.status_code == 404 or (response.status_code == 403
+                                       and 'amazonaws' in url):
+        return False
+    response.raise_for_status()
+
+    with open('{}.part'.format(outfile), 'wb') as file:
+        for chunk in response.iter_content(chunk_size=1024 * 1024):
+            file.write(chunk)
+    os.replace('{}.part'.format(outfile), outfile)
+    return True
+
+
+def _sources(lat, lon, tile_dir):
+    '''Returns url, local file and GDAL path of the sources of a tile'''
+
+    sources = []
+    if SRTM_SOUTH <= lat < SRTM_NORTH:
+        name = _srtm_name(lat, lon)
+        sources.append((SRTM_URL.format(name),
+                        opj(tile_dir, '{}.SRTMGL1.hgt.zip'.format(name)),
+                        '/vsizip/{{}}/{}.hgt'.format(name)))
+
+    name = _copernicus_name(lat, lon)
+    sources.append((COPERNICUS_URL.format(name),
+                    opj(tile_dir, 'Copernicus_DSM_{}.tif'.format(name)),
+                    '{}'))
+
+    return sources
+
+
+def download_tile(lat, lon, tile_dir):
+    '''Downloads a single DEM tile, if not already done
+
+    Args:
+        lat (int): the latitude of the lower left corner
+        lon (int): the longitude of the lower left corner
+        tile_dir (str): the directory of the downloaded tiles
+
+    Returns:
+        str: a GDAL readable path to the tile (None if there is no tile)
+    '''
+
+    for url, outfile, gdal_path in _sources(lat, lon, tile_dir):
+
+        # a marker for tiles that do not exist (i.e. sea)
+        missing = '{}.missing'.format(outfile)
+        if os.path.isfile(missing):
+            continue
+
+        if not os.path.isfile(outfile):
+            if not _download(url, outfile):
+                open(missing, 'w').close()
+                continue
+
+        if outfile.endswith('.zip') and not zipfile.is_zipfile(outfile):
+            os.remove(outfile)
+            continue
+
+        return gdal_path.format(outfile)
+
+    return None
+
+
+def _is_missing(lat, lon, tile_dir):
+    '''Checks if a tile is known to exist in none of the sources'''
+
+    return all(os.path.isfile('{}.missing'.format(outfile))
+               for _, outfile, _ in _sources(lat, lon, tile_dir))
+
+
+def _float_tile(lat, lon, tile_dir):
+    '''Downloads a tile and converts it to Float32 with the DEM's no data
+
+    SRTM tiles are Int16 and Copernicus tiles Float32, and gdalbuildvrt
+    skips sources whose data type differs from the first one.
+
+    Returns:
+        str: the path to the converted tile (None if there is no tile)
+    '''
+
+    outfile = opj(tile_dir, '{}.float32.tif'.format(_srtm_name(lat, lon)))
+    if os.path.isfile(outfile):
+        return outfile
+
+    tile = download_tile(lat, lon, tile_dir)
+    if tile is None:
+        return None
+
+    gdal.Translate('{}.part'.format(outfile), tile,
+                   options=gdal.TranslateOptions(
+                       format='GTiff', outputType=gdal.GDT_Float32,
+                       noData=DEM_NODATA,
+                       creationOptions=['TILED=YES', 'COMPRESS=DEFLATE',
+                                        'PREDICTOR=3']))
+    os.replace('{}.part'.format(outfile), outfile)
+    return outfile
+
+
+def create_dem(bounds, outfile, tile_dir=None, max_workers=4):
+    '''Builds a single DEM for an extent
+
+    Args:
+        bounds (tuple): minx, miny, maxx, maxy in degrees
+        outfile (str): path to the output GeoTIFF
+        tile_dir (str): the directory of the downloaded tiles
+                        (default: tiles next to the outfile)
+        max_workers (int): the number of tiles downloaded at once
+
+    Returns:
+        str: the path to the DEM (None if no tile was found)
+    '''
+
+    tile_dir = tile_dir or opj(os.path.dirname(os.path.abspath(outfile)),
+                               'tiles')
+    os.makedirs(tile_dir, exist_ok=True)
+
+    tile_list = tiles(bounds)
+    print(' INFO: Gathering {} DEM tiles.'.format(len(tile_list)))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(
+            lambda tile: _float_tile(tile[0], tile[1], tile_dir), tile_list))
+
+    # every tile has to be there or known to not exist, no holes otherwise
+    incomplete = [tile for tile, file in zip(tile_list, results)
+                  if file is None and not _is_missing(*tile, tile_dir)]
+    if incomplete:
+        print(' ERROR: Could not get the DEM tiles {}.'.format(incomplete))
+        return None
+
+    files = [file for file in results if file]
+    if not files:
+        print(' ERROR: No DEM tiles found for the extent {}.'.format(bounds))
+        return None
+
+    # mosaic, cut to the extent and convert to a tiled and compressed tif
+    print(' INFO: Creating the DEM {}.'.format(outfile))
+    vrt = '{}.vrt'.format(outfile[:-4])
+    gdal.BuildVRT(vrt, files, options=gdal.BuildVRTOptions(
+        outputBounds=bounds, VRTNodata=DEM_NODATA, resolution='highest'))
+
+    gdal.Translate(outfile, vrt, options=gdal.TranslateOptions(
+        format='GTiff', outputType=gdal.GDT_Float32, noData=DEM_NODATA,
+        creationOptions=['TILED=YES', 'COMPRESS=DEFLATE', 'PREDICTOR=3',
+                         'BIGTIFF=IF_SAFER']))
+    os.remove(vrt)
+
+    dem = gdal.Open(outfile, gdal.GA_Update)
+    dem.BuildOverviews('AVERAGE', [2, 4, 8, 16])
+    dem = None
+
+    return outfile
@@ -20,6 +20,8 @@ import zipfile
 
 import gdal
 
+from ost.helpers import resources, metrics, trace, snap_engine, runner
+
 # script infos
 __author__ = 'Andreas Vollrath'
 __copyright__ = 'phi-lab, European Space Agency'
@@ -158,12 +160,26 @@ def remove_folder_content(folder):
             shutil.rmtree(os.path.join(root, d))
 
 
-def run_command(command, logfile, elapsed=True):
+def run_command(command, logfile, elapsed=True, tags=None):
     ''' A helper function to execute a command line command
 
+    For SNAP's gpt, the threads, tile cache and heap are set according to
+    the active resource budget (see ost.helpers.resources), and the peak
+    memory of the call is reported back to it. If a metrics file is set,
+    the resource usage of the call is recorded (see ost.helpers.metrics),
+    and if tracing is active, the call is written as a span of the
+    timeline (see ost.helpers.trace). If a SNAP engine is running, gpt
+    calls are executed by it instead of a new JVM (see
+    ost.helpers.snap_engine), which aborts them on timeout or
+    cancellation. Otherwise, the command is supervised by
+    ost.helpers.runner, which streams its output into the logfile and kills
+    it on timeout, cancellation or fatal errors.
+
     Args:
         command (str): the command to execute
         logfile (str): path to the logfile in case of errors
+        tags (dict): stage, product etc. of the metrics record (derived
+                     from the logfile's name if not given)
 
     '''
 
@@ -171,20 +187,57 @@ def run_command(command, logfile, elapsed=True):
 
     if os.name == 'nt':
         process = subprocess.run(command, stderr=subprocess.PIPE)
+        return_code = process.returncode
+        stderr = process.stderr
+        metrics.record(shlex.split(command), logfile, time.time() - currtime,
+                       return_code=return_code, tags=tags)
     else:
-        process = subprocess.run(shlex.split(command), stderr=subprocess.PIPE)
-
-    return_code = process.returncode
-
-    if return_code != 0:
+        args, env = resources.gpt_arguments(shlex.split(command))
+
+        # None if no SNAP engine is running, the engine's heap is shared
+        # by all jobs, so the heap option of env does not apply
+        result = None
+        if os.path.basename(args[0]).startswith('gpt'):
+            result = snap_engine.run(
+                args, logfile,
+                timeout=runner.timeout(runner.command_stage(args, logfile,
+                                                            tags)),
+                cancelled=runner.cancelled)
+
+        if result is not None:
+            # the engine already wrote its error to the logfile
+            return_code, maxrss = result
+            stderr = None
+            if maxrss is not None:
+                resources.record_peak(maxrss)
+            metrics.record(args, logfile, time.time() - currtime,
+                           return_code=return_code,
+                           tags=dict(tags or {}, engine=True))
+        else:
+            # streams the output into the logfile, kills the command on
+            # timeout, cancellation or fatal errors
+            return_code, rusage, io = runner.run(args, logfile, env, tags)
+            stderr = None
+
+            resources.record_peak(rusage.ru_maxrss)
+            metrics.record(args, logfile, time.time() - currtime, rusage, io,
+                           return_code, tags)
+
+    if trace.enabled():
+        info = metrics.command_tags(shlex.split(command), logfile, tags)
+        trace.complete(info.get('stage') or info['executable'],
+                       info['executable'], currtime, time.time() - currtime,
+                       product=info.get('product'), return_code=return_code)
+
+    if return_code != 0 and stderr is not None:
         with open(str(logfile), 'w') as file:
-            for line in process.stderr.decode().splitlines():
+            for line in stderr.decode(errors='replace').splitlines():
                 file.write('{}\n'.format(line))
 
     if elapsed:
         timer(currtime)
         
-    return process.returncode
+    return return_code
 
 
 def delete_dimap(dimap_prefix):
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''
+This module provides lock files to share work between several machines.
+
+All machines (workers) process the same project on a shared file system
+(e.g. NFS or Lustre). Before a worker starts an acquisition or a burst, it
+claims it by creating a lock file with O_CREAT | O_EXCL, which succeeds for
+exactly one worker. While the work is in progress, the modification time
+of the lock file is refreshed by a heartbeat thread. A lock whose heartbeat
+stopped for longer than stale_after seconds (e.g. because its machine
+crashed) is considered stale and taken over by another worker.
+'''
+
+import os
+import json
+import time
+import socket
+import threading
+
+
+def _pid_alive(pid):
+    '''Checks if a process of the local machine is still running'''
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+
+    return True
+
+
+class FileLock():
+    '''An atomic lock file with heartbeat and stale lock recovery
+
+    Args:
+        path (str): path to the lock file
+        stale_after (int): seconds without heartbeat after which the lock
+                           is considered stale
+        heartbeat (int): seconds between the refreshs of the lock file
+                         (default: a quarter of stale_after)
+
+    Example:
+        lock = FileLock('/shared/processing/.locks/ard.117.20180101.lock')
+        if lock.acquire():
+            try:
+                ...  # process
+            finally:
+                lock.release()
+    '''
+
+    def __init__(self, path, stale_after=600, heartbeat=None):
+
+        self.path = path
+        self.stale_after = stale_after
+        self.heartbeat = heartbeat or max(1, stale_after / 4)
+        self.owner = dict(host=socket.gethostname(), pid=os.getpid(),
+                          token='{}.{}.{}'.format(socket.gethostname(),
+                                                  os.getpid(), id(self)))
+        self._stop = None
+        self._thread = None
+
+    def _read(self, path=None):
+        '''Returns the owner information of a lock file (None if unreadable)'''
+
+        try:
+            with open(path or self.path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _create(self):
+        '''Creates the lock file, which fails if it already exists'''
+
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                         0o644)
+        except FileExistsError:
+            return False
+
+        with os.fdopen(fd, 'w') as file:
+            json.dump(dict(self.owner, created=time.time()), file)
+
+        return True
+
+    def _is_stale(self):
+        '''Checks if the existing lock file has been abandoned'''
+
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return True
+
+        if age > self.stale_after:
+            return True
+
+        # locks of dead processes on this machine need not to age
+        owner = self._read()
+        if owner and owner.get('host') == self.owner['host']:
+            return not _pid_alive(owner.get('pid', -1))
+
+        return False
+
+    def _break(self):
+        '''Removes a stale lock file
+
+        The lock file is first renamed, which succeeds for only one of
+        several workers trying to break it at the same time. If the renamed
+        lock turns out to be alive (i.e. another worker just replaced the
+        stale lock), it is put back.
+        '''
+
+        stale = self._read()
+        broken = '{}.stale.{}'.format(self.path, self.owner['token'])
+
+        try:
+            os.rename(self.path, broken)
+        except FileNotFoundError:
+            return
+
+        if self._read(broken) != stale:
+            try:
+                os.link(broken, self.path)
+            except FileExistsError:
+                pass
+
+        os.remove(broken)
+
+    def acquire(self):
+        '''Tries to claim the lock without blocking
+
+        Returns:
+            bool: True if the lock is now held by this process
+        '''
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        if not self._create():
+            if not self._is_stale():
+                return False
+
+            owner = self._read() or {}
+            print(' INFO: Taking over stale lock {} of {}.'.format(
+                os.path.basename(self.path), owner.get('host', 'unknown')))
+            self._break()
+
+            if not self._create():
+                return False
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, daemon=True)
+        self._thread.start()
+
+        return True
+
+    def _beat(self):
+        '''Refreshes the modification time of the lock file'''
+
+        while not self._stop.wait(self.heartbeat):
+            try:
+                os.utime(self.path, None)
+            except OSError:
+                pass
+
+    def held(self):
+        '''Checks if the lock file still belongs to this process'''
+
+        owner = self._read()
+        return bool(owner) and owner.get('token') == self.owner['token']
+
+    def release(self):
+        '''Stops the heartbeat and removes the lock file'''
+
+        if self._stop is not None:
+            self._stop.set()
+            self._thread.join()
+            self._stop, self._thread = None, None
+
+        if self.held():
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
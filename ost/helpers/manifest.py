@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+'''
+This module handles the export of OST batch processing for cluster execution.
+
+Instead of processing, the batch routines add their tasks to a manifest,
+a JSON lines file with one task per line:
+
+    {"id": "ard.117.20180101", "stage": "ard",
+     "function": "ost.s1.grd_batch:_grd_to_ard_job",
+     "kwargs": {...}, "depends": []}
+
+The tasks are written in dependency order, and the stages (ard, timeseries,
+timescan, mosaic, ...) only depend on earlier stages. Next to the manifest,
+a GNU parallel and a SLURM script are generated that run each stage once
+the previous one has finished. A single task is executed by
+
+    python -m ost.helpers.manifest /path/to/manifest TASK_ID
+
+or, e.g. inside a SLURM array job, by stage and index:
+
+    python -m ost.helpers.manifest /path/to/manifest --stage ard \
+        --index $SLURM_ARRAY_TASK_ID
+'''
+
+import os
+import sys
+import json
+import shlex
+import importlib
+
+
+def _to_builtin(value):
+    '''Converts numpy scalars and paths for the json export'''
+
+    if hasattr(value, 'item'):
+        return value.item()
+    if hasattr(value, '__fspath__'):
+        return os.fspath(value)
+
+    raise TypeError('{} is not JSON serializable'.format(type(value)))
+
+
+class Manifest():
+    '''A dependency ordered list of processing tasks
+
+    Tasks of an already existing manifest file are loaded, so that the
+    single batch routines can add their stage one after the other.
+
+    Args:
+        exec_file (str): path to the manifest (JSON lines) file
+    '''
+
+    def __init__(self, exec_file):
+
+        self.exec_file = os.path.abspath(exec_file)
+        self.tasks = []
+        self._ids = set()
+
+        if os.path.isfile(self.exec_file):
+            self.tasks = load(self.exec_file)
+            self._ids = set(task['id'] for task in self.tasks)
+
+    def add(self, task_id, stage, function, kwargs=None, depends=()):
+        '''Adds a task to the manifest
+
+        Args:
+            task_id (str): a unique identifier of the task
+            stage (str): the processing stage (e.g. ard, timeseries)
+            function: a module level function executing the task
+            kwargs (dict): the (json serializable) keyword arguments
+            depends (list): the ids of the tasks that need to finish first
+        '''
+
+        if task_id in self._ids:
+            print(' INFO: Task {} is already in the manifest.'.format(task_id))
+            return
+
+        missing = [dep for dep in depends if dep not in self._ids]
+        if missing:
+            raise ValueError(' ERROR: Task {} depends on unknown task(s)'
+                             ' {}.'.format(task_id, ', '.join(missing)))
+
+        self.tasks.append(dict(
+            id=task_id,
+            stage=stage,
+            function='{}:{}'.format(function.__module__, function.__name__),
+            kwargs=kwargs or {},
+            depends=list(depends)))
+        self._ids.add(task_id)
+
+    def ids(self, prefix):
+        '''Returns the ids of all tasks below the (dot separated) prefix
+
+        E.g. 'ard.117' matches 'ard.117.20180101', but not 'ard.1170.*'.
+        '''
+        return [task['id'] for task in self.tasks
+                if task['id'] == prefix or
+                task['id'].startswith('{}.'.format(prefix))]
+
+    def stages(self):
+        '''Returns the stages in execution order with their task ids'''
+
+        stages = {}
+        for task in self.tasks:
+            stages.setdefault(task['stage'], []).append(task['id'])
+
+        return stages
+
+    def write(self):
+        '''Writes the manifest and the GNU parallel and SLURM scripts'''
+
+        os.makedirs(os.path.dirname(self.exec_file), exist_ok=True)
+
+        # tasks are added after their dependencies, so the order is kept
+        with open(self.exec_file, 'w') as file:
+            for task in self.tasks:
+                file.write('{}\n'.format(
+                    json.dumps(task, default=_to_builtin)))
+
+        self._write_parallel_script()
+        self._write_slurm_script()
+
+        print(' INFO: Written {} tasks in {} stages to {}.'.format(
+            len(self.tasks), len(self.stages()), self.exec_file))
+
+    def _task_command(self):
+        return '{} -m ost.helpers.manifest {}'.format(
+            shlex.quote(sys.executable), shlex.quote(self.exec_file))
+
+    def _write_parallel_script(self):
+
+        lines = ['#!/usr/bin/env bash',
+                 '# runs all OST tasks of {} stage by stage'.format(
+                     os.path.basename(self.exec_file)),
+                 '# usage: bash {} [number of parallel jobs]'.format(
+                     os.path.basename(self.exec_file) + '.parallel.sh'),
+                 'set -e',
+                 'JOBS=${1:-1}',
+                 '']
+
+        for stage, ids in self.stages().items():
+            lines.append('echo " INFO: Running stage {} ({} tasks)"'.format(
+                stage, len(ids)))
+            lines.append('{} --stage {} --list | parallel --halt '
+                         'soon,fail=1 -j "$JOBS" {} {{}}'.format(
+                             self._task_command(), shlex.quote(stage),
+                             self._task_command()))
+            lines.append('')
+
+        with open('{}.parallel.sh'.format(self.exec_file), 'w') as file:
+            file.write('\n'.join(lines))
+
+    def _write_slurm_script(self):
+
+        lines = ['#!/usr/bin/env bash',
+                 '# submits all OST tasks of {} as chained SLURM array'
+                 ' jobs'.format(os.path.basename(self.exec_file)),
+                 '# usage: bash {} [additional sbatch options]'.format(
+                     os.path.basename(self.exec_file) + '.slurm.sh'),
+                 'set -e',
+                 'DEPENDENCY=""',
+                 '']
+
+        for stage, ids in self.stages().items():
+            command = '{} --stage {} --index $SLURM_ARRAY_TASK_ID'.format(
+                self._task_command(), shlex.quote(stage))
+            lines.append(
+                'JOB=$(sbatch --parsable $DEPENDENCY --job-name=ost_{} '
+                '--array=0-{} "$@" --wrap={})'.format(
+                    stage, len(ids) - 1, shlex.quote(command)))
+            lines.append('echo " INFO: Submitted stage {} as job $JOB"'.format(
+                stage))
+            lines.append('DEPENDENCY="--dependency=afterok:${JOB%%;*}"')
+            lines.append('')
+
+        with open('{}.slurm.sh'.format(self.exec_file), 'w') as file:
+            file.write('\n'.join(lines))
+
+
+def load(exec_file):
+    '''Loads the tasks of a manifest file
+
+    Args:
+        exec_file (str): path to the manifest (JSON lines) file
+
+    Returns:
+        list: the task dictionaries in execution order
+    '''
+
+    with open(exec_file, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def run_task(exec_file, task_id=None, stage=None, index=None):
+    '''Executes a single task of a manifest
+
+    The task is either selected by its id, or by its index within a stage.
+
+    Args:
+        exec_file (str): path to the manifest (JSON lines) file
+        task_id (str): the id of the task
+        stage (str): the stage of the task (if selected by index)
+        index (int): the index of the task within the stage
+
+    Returns:
+        int: the return code of the task
+    '''
+
+    tasks = load(exec_file)
+
+    if task_id is not None:
+        selected = [task for task in tasks if task['id'] == task_id]
+    else:
+        selected = [task for task in tasks if task['stage'] == stage]
+        selected = selected[int(index):int(index) + 1]
+
+    if not selected:
+        print(' ERROR: No such task in {}.'.format(exec_file))
+        return 1
+
+    task = selected[0]
+    module, function = task['function'].split(':')
+    function = getattr(importlib.import_module(module), function)
+
+    print(' INFO: Running task {}.'.format(task['id']))
+    return_code = function(**task['kwargs'])
+
+    return 0 if return_code is None else int(return_code)
+
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Executes a single task of an OST task manifest.')
+    parser.add_argument('manifest',
+                        help=' (str) path to the manifest file')
+    parser.add_argument('task_id', nargs='?', default=None,
+                        help=' (str) the id of the task to run')
+    parser.add_argument('--stage', default=None,
+                        help=' (str) the stage of the task to run')
+    parser.add_argument('--index', default=None, type=int,
+                        help=' (int) the index of the task within the stage')
+    parser.add_argument('--list', action='store_true',
+                        help=' list the task ids (of the given stage)')
+
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for task in load(args.manifest):
+            if args.stage is None or task['stage'] == args.stage:
+                print(task['id'])
+        return 0
+
+    if args.task_id is None and (args.stage is None or args.index is None):
+        parser.error('either a task id or --stage and --index are needed')
+
+    return run_task(args.manifest, args.task_id, args.stage, args.index)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+'''
+This module records the resource usage of external commands.
+
+Every command started by helpers.run_command (SNAP's gpt, otbcli_Mosaic,
+ImageMagick's convert, ...) is written as a JSON line to the metrics file
+given by the OST_METRICS_FILE environment variable:
+
+    {"time": 1546300800.0, "host": "node01", "stage": "calibration",
+     "product": "20180101_117", "executable": "gpt",
+     "operator": "Calibration", "parameters": {...}, "wall": 120.3,
+     "utime": 410.2, "stime": 12.1, "maxrss_mb": 6120.5,
+     "read_bytes": ..., "write_bytes": ..., "return_code": 0}
+
+The CPU times, peak memory and I/O are the ones of the command and all of
+its child processes. Since the variable is inherited, the records of all
+worker processes end up in the same file. summary() aggregates the records
+per stage to identify the bottlenecks of a processing chain.
+'''
+
+import os
+import sys
+import json
+import time
+import socket
+
+from ost.helpers.resources import maxrss_to_mb
+
+METRICS_ENV = 'OST_METRICS_FILE'
+
+# the block size of ru_inblock and ru_oublock
+_BLOCK_SIZE = 512
+
+
+def activate(metrics_file):
+    '''Sets the metrics file for this and all child processes
+
+    Args:
+        metrics_file (str): path to the JSON lines file (appended to)
+    '''
+
+    os.makedirs(os.path.dirname(os.path.abspath(metrics_file)),
+                exist_ok=True)
+    os.environ[METRICS_ENV] = os.path.abspath(metrics_file)
+
+
+def deactivate():
+    '''Stops the recording of metrics'''
+
+    os.environ.pop(METRICS_ENV, None)
+
+
+def enabled():
+    return bool(os.environ.get(METRICS_ENV))
+
+
+def wait_io(pid):
+    '''Waits for a child to exit and returns its I/O counters
+
+    The child is not reaped, so that its rusage can be collected with
+    os.wait4 afterwards.
+
+    Args:
+        pid (int): the process id of the child
+
+    Returns:
+        dict: the counters of /proc/<pid>/io (None if not available)
+    '''
+
+    if not enabled() or not sys.platform.startswith('linux'):
+        return None
+
+    try:
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        with open('/proc/{}/io'.format(pid), 'r') as io_file:
+            return dict((key, int(value)) for key, value in
+                        (line.split(':') for line in io_file))
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def command_tags(args, logfile, tags=None):
+    '''Derives stage, product and parameters from a command line
+
+    OST names its log files either {product}_{stage}.err_log (e.g.
+    20180101_A117_IW1_7684_cal.err_log) or {product}.{stage}.errLog
+    (e.g. 20180101_117.Backscatter.errLog).
+
+    Args:
+        args (list): the command line split into its arguments
+        logfile (str): the log file of the command
+        tags (dict): tags overriding the derived ones
+
+    Returns:
+        dict: executable, stage, product, directory and, for gpt,
+              operator and parameters
+    '''
+
+    overrides = tags or {}
+    tags = dict(executable=os.path.basename(args[0]) if args else None)
+
+    if logfile:
+        name = os.path.basename(str(logfile))
+        for suffix in ('.err_log', '.errLog', '.log'):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+                break
+
+        if '.' in name:
+            product, _, stage = name.rpartition('.')
+        else:
+            product, _, stage = name.rpartition('_')
+
+        tags.update(stage=stage.strip('_') or None, product=product or None,
+                    directory=os.path.dirname(str(logfile)))
+
+    # the operator or graph of gpt, and its -P parameters and options
+    if tags['executable'] and tags['executable'].startswith('gpt'):
+        if len(args) > 1:
+            tags['operator'] = os.path.basename(args[1])
+        parameters = {}
+        for idx, arg in enumerate(args[2:], 2):
+            if arg.startswith('-P') and '=' in arg:
+                key, value = arg[2:].split('=', 1)
+                parameters[key] = value
+            elif arg in ('-q', '-c', '-x') and idx + 1 < len(args):
+                parameters[arg] = args[idx + 1]
+        tags['parameters'] = parameters
+
+    tags.update(overrides)
+    return tags
+
+
+def record(args, logfile, wall, rusage=None, io=None, return_code=None,
+           tags=None):
+    '''Appends the resource usage of a finished command to the metrics file
+
+    Args:
+        args (list): the command line split into its arguments
+        logfile (str): the log file of the command (used for tagging)
+        wall (float): the elapsed time in seconds
+        rusage: the resource usage as returned by os.wait4 (optional)
+        io (dict): the counters of /proc/<pid>/io (optional)
+        return_code (int): the return code of the command
+        tags (dict): tags overriding the ones derived from the logfile
+    '''
+
+    metrics_file = os.environ.get(METRICS_ENV)
+    if not metrics_file:
+        return
+
+    entry = dict(time=time.time(), host=socket.gethostname(),
+                 pid=os.getpid(), wall=round(wall, 3),
+                 return_code=return_code)
+    entry.update(command_tags(args, logfile, tags))
+
+    if rusage is not None:
+        entry.update(utime=rusage.ru_utime,
+                     stime=rusage.ru_stime,
+                     maxrss_mb=round(maxrss_to_mb(rusage.ru_maxrss), 1),
+                     read_bytes=rusage.ru_inblock * _BLOCK_SIZE,
+                     write_bytes=rusage.ru_oublock * _BLOCK_SIZE)
+
+    # /proc is more precise than the block counts
+    if io is not None:
+        entry.update(read_bytes=io.get('read_bytes'),
+                     write_bytes=io.get('write_bytes'),
+                     read_chars=io.get('rchar'),
+                     write_chars=io.get('wchar'))
+
+    # a single write in append mode keeps lines of concurrent
+    # processes from being interleaved
+    line = '{}\n'.format(json.dumps(entry)).encode()
+    fd = os.open(metrics_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def load(metrics_files):
+    '''Loads all records of one or more metrics files
+
+    Args:
+        metrics_files (str/list): path(s) to the JSON lines file(s)
+
+    Returns:
+        list: the records as dictionaries
+    '''
+
+    if isinstance(metrics_files, str):
+        metrics_files = [metrics_files]
+
+    records = []
+    for metrics_file in metrics_files:
+        with open(metrics_file, 'r') as file:
+            records.extend(json.loads(line) for line in file if line.strip())
+
+    return records
+
+
+def summary(metrics_files, key='stage'):
+    '''Aggregates the records of one or more metrics files
+
+    Args:
+        metrics_files (str/list): path(s) to the JSON lines file(s)
+        key (str): the tag to group by (e.g. stage, operator or host)
+
+    Returns:
+        dict: calls, wall, utime, stime (all in seconds), maximum
+              maxrss_mb, and read_bytes and write_bytes per group,
+              sorted by the total wall time
+    '''
+
+    groups = {}
+    for entry in load(metrics_files):
+        group = groups.setdefault(entry.get(key), dict(
+            calls=0, failed=0, wall=0.0, utime=0.0, stime=0.0,
+            maxrss_mb=0.0, read_bytes=0, write_bytes=0))
+        group['calls'] += 1
+        group['failed'] += 1 if entry.get('return_code') else 0
+        for field in ['wall', 'utime', 'stime', 'read_bytes', 'write_bytes']:
+            group[field] += entry.get(field) or 0
+        group['maxrss_mb'] = max(group['maxrss_mb'],
+                                 entry.get('maxrss_mb') or 0)
+
+    return dict(sorted(groups.items(), key=lambda item: -item[1]['wall']))
@@ -15,7 +15,7 @@ import urllib
 import requests
 import tqdm
 
-from ost.helpers import helpers as h
+from ost.helpers import helpers as h, trace
 
 
 def ask_credentials():
@@ -83,6 +83,8 @@ def check_connection(uname, pword):
     return response.status_code
 
 
+@trace.traced('download', 'download',
+              label=lambda argument_list: os.path.basename(argument_list[1]))
 def s1_download(argument_list):
     '''Function to download a single Sentinel-1 product from ONDA DIAS
 
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+'''
+This module prefetches the orbit files of Sentinel-1 products.
+
+SNAP's Apply-Orbit-File looks for the orbit file of a product in its
+auxdata directory and downloads it if it is not there. Every import then
+depends on the orbit server, which is slow on many parallel jobs and fails
+on compute nodes without internet access. prefetch() works out the orbit
+files of all products of an inventory (the precise POEORB files, or the
+restituted RESORB files for products too recent for POEORB) and downloads
+them once into SNAP's auxdata layout:
+
+    {orbit_dir}/POEORB/S1A/2018/01/S1A_OPER_AUX_POEORB_OPOD_..._V..._....EOF.zip
+
+where orbit_dir is ~/.snap/auxdata/Orbits/Sentinel-1 by default. For a
+shared directory, SNAP's AuxDataPath (in snap.auxdata.properties) has to
+point to its parent's parent.
+'''
+
+import os
+import re
+import glob
+import functools
+import threading
+from os.path import join as opj
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ORBIT_URL = 'http://step.esa.int/auxdata/orbits/Sentinel-1/{}/{}/{}/{:02d}/'
+ORBIT_DIR = opj(os.path.expanduser('~'), '.snap', 'auxdata', 'Orbits',
+                'Sentinel-1')
+
+ORBIT_PATTERN = re.compile(r'(S1[AB])_OPER_AUX_(POEORB|RESORB)_OPOD_'
+                           r'\d{8}T\d{6}_V(\d{8}T\d{6})_(\d{8}T\d{6})'
+                           r'\.EOF\.zip')
+
+# the orbit has to cover the product with some margin
+_MARGIN = timedelta(seconds=60)
+
+
+def _time(string):
+    return datetime.strptime(string, '%Y%m%dT%H%M%S')
+
+
+def sensing_times(identifier):
+    '''Returns mission, start and stop time of a Sentinel-1 product
+
+    Args:
+        identifier (str): the product identifier, e.g.
+            S1A_IW_GRDH_1SDV_20180101T170000_20180101T170025_019960_021FDA_A1B2
+
+    Returns:
+        tuple: mission (S1A or S1B), start and stop as datetime
+    '''
+
+    parts = os.path.basename(str(identifier)).split('_')
+    times = [part for part in parts if re.match(r'^\d{8}T\d{6}$', part)]
+    return parts[0], _time(times[0]), _time(times[1])
+
+
+def _covers(name, start, stop):
+    '''Checks if an orbit file covers a time span'''
+
+    match = ORBIT_PATTERN.match(os.path.basename(name))
+    return bool(match) and (_time(match.group(3)) <= start - _MARGIN and
+                            _time(match.group(4)) >= stop + _MARGIN)
+
+
+def _months(start):
+    '''The year and month folders an orbit file of a product can be in'''
+
+    before = start - timedelta(days=1)
+    return sorted({(start.year, start.month), (before.year, before.month)})
+
+
+@functools.lru_cache(maxsize=None)
+def _listing(mission, orbit_type, year, month):
+    '''Returns the orbit files of a month on the orbit server'''
+
+    response = requests.get(ORBIT_URL.format(orbit_type, mission, year,
+                                             month), timeout=60)
+    if response.status_code == 404:
+        return ()
+    response.raise_for_status()
+
+    return tuple(sorted(set(match.group(0) for match in
+                            ORBIT_PATTERN.finditer(response.text))))
+
+
+def find_orbit(identifier, orbit_dir=ORBIT_DIR, download=True):
+    '''Finds (and downloads) the orbit file of a Sentinel-1 product
+
+    Args:
+        identifier (str): the product identifier
+        orbit_dir (str): the Sentinel-1 orbit directory of SNAP's auxdata
+        download (bool): download the orbit file if not found locally
+
+    Returns:
+        str: the path to the orbit file (None if not available)
+    '''
+
+    mission, start, stop = sensing_times(identifier)
+
+    for orbit_type in ['POEORB', 'RESORB']:
+
+        # already there
+        for year, month in _months(start):
+            for file in glob.glob(opj(orbit_dir, orbit_type, mission,
+                                      str(year), '{:02d}'.format(month),
+                                      '*.EOF.zip')):
+                if _covers(file, start, stop):
+                    return file
+
+        if not download:
+            continue
+
+        for year, month in _months(start):
+            # the latest version of a file covering the product
+            names = [name for name in _listing(mission, orbit_type,
+                                               year, month)
+                     if _covers(name, start, stop)]
+            if not names:
+                continue
+
+            out_dir = opj(orbit_dir, orbit_type, mission, str(year),
+                          '{:02d}'.format(month))
+            os.makedirs(out_dir, exist_ok=True)
+            outfile = opj(out_dir, names[-1])
+
+            response = requests.get('{}{}'.format(ORBIT_URL.format(
+                orbit_type, mission, year, month), names[-1]), timeout=120)
+            response.raise_for_status()
+            with open('{}.part'.format(outfile), 'wb') as file:
+                file.write(response.content)
+            os.replace('{}.part'.format(outfile), outfile)
+
+            return outfile
+
+    return None
+
+
+def prefetch(identifiers, orbit_dir=ORBIT_DIR, max_workers=4):
+    '''Downloads the orbit files of all products of an inventory
+
+    Args:
+        identifiers (list): the product identifiers
+        orbit_dir (str): the Sentinel-1 orbit directory of SNAP's auxdata
+        max_workers (int): the number of orbit files downloaded at once
+
+    Returns:
+        dict: the orbit file per identifier (None if not available)
+    '''
+
+    identifiers = sorted(set(identifiers))
+    print(' INFO: Prefetching the orbit files of {} products.'.format(
+        len(identifiers)))
+
+    # set after the first connection error, e.g. on nodes without
+    # internet access, so that not every product waits for the timeout
+    unreachable = threading.Event()
+
+    def _find(identifier):
+        try:
+            return find_orbit(identifier, orbit_dir,
+                              download=not unreachable.is_set())
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as error:
+            if not unreachable.is_set():
+                unreachable.set()
+                print(' INFO: Orbit server not reachable ({}), only using'
+                      ' the local orbit files.'.format(error))
+            return find_orbit(identifier, orbit_dir, download=False)
+        except (requests.exceptions.RequestException, OSError) as error:
+            print(' INFO: No orbit file for {} ({}).'.format(identifier,
+                                                             error))
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        orbit_files = dict(zip(identifiers,
+                               executor.map(_find, identifiers)))
+
+    missing = [identifier for identifier, orbit_file in orbit_files.items()
+               if orbit_file is None]
+    restituted = [identifier for identifier, orbit_file
+                  in orbit_files.items()
+                  if orbit_file and '_RESORB_' in orbit_file]
+
+    if restituted:
+        print(' INFO: Only restituted orbits available for {} products.'
+              .format(len(restituted)))
+    if missing:
+        print(' INFO: No orbit file found for {} products. SNAP will try'
+              ' to download them during the processing.'.format(
+                  len(missing)))
+
+    return orbit_files
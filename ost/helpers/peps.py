@@ -12,7 +12,7 @@ import requests
 import tqdm
 
 # import ost classes/functions
-from ost.helpers import helpers as h
+from ost.helpers import helpers as h, trace
 
 
 def ask_credentials():
@@ -81,6 +81,8 @@ def check_connection(uname, pword):
     return response.status_code
 
 
+@trace.traced('download', 'download',
+              label=lambda argument_list: os.path.basename(argument_list[1]))
 def s1_download(argument_list):
     '''Function to download a single Sentinel-1 product from CNES' PEPS
 
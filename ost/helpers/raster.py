@@ -8,9 +8,12 @@ import os
 from os.path import join as opj
 import numpy as np
 import json
+import re
 import glob
 import shutil
 import itertools
+import xml.etree.ElementTree as eTree
+from concurrent.futures import ThreadPoolExecutor
 
 # geo libs
 import gdal
@@ -19,6 +22,7 @@ import imageio
 import rasterio
 import rasterio.mask
 from rasterio.features import shapes
+from rasterio.windows import Window
 
 from ost.helpers import helpers as h
 
@@ -163,6 +167,105 @@ def convert_to_db(pow_array):
     return np.nan_to_num(db_array)
 
 
+def _dimap_bands(dim_file, unit=None):
+    '''Returns the band information of a BEAM-Dimap product
+
+    Args:
+        dim_file (str): path to the .dim file
+        unit (str): only bands of this physical unit (e.g. intensity)
+
+    Returns:
+        tree: the parsed .dim file
+        list: the Spectral_Band_Info and DATA_FILE_PATH elements per band
+    '''
+
+    tree = eTree.parse(dim_file)
+    data_files = {data_file.findtext('BAND_INDEX'):
+                  data_file.find('DATA_FILE_PATH')
+                  for data_file in tree.getroot().iter('Data_File')}
+
+    bands = []
+    for info in tree.getroot().iter('Spectral_Band_Info'):
+        band_index = info.findtext('BAND_INDEX')
+        if unit is not None and info.findtext('PHYSICAL_UNIT') != unit:
+            continue
+        # virtual bands have no data file
+        if band_index in data_files:
+            bands.append((info, data_files[band_index]))
+
+    return tree, bands
+
+
+def _block_to_db(img_file, block_rows=1024):
+    '''Converts a single band image to dB in place, block by block'''
+
+    with rasterio.open(img_file, 'r+') as band:
+        for row in range(0, band.height, block_rows):
+            window = Window(0, row, band.width,
+                            min(block_rows, band.height - row))
+            array = band.read(1, window=window)
+            band.write(convert_to_db(array).astype(array.dtype), 1,
+                       window=window)
+
+
+def linear_to_db_dimap(dimap_prefix, ncores=os.cpu_count()):
+    '''Converts the intensity bands of a BEAM-Dimap product to dB in place
+
+    This replaces SNAP's LinearToFromdB operator, which needs a JVM and
+    writes a full copy of the product. The bands are converted as in
+    convert_to_db (0 stays 0, i.e. no data) by one thread per band, and
+    renamed with a _db suffix and the physical unit intensity_db as SNAP
+    would do.
+
+    Args:
+        dimap_prefix (str): the product path without the .dim extension
+        ncores (int): the maximum number of bands converted at once
+
+    Returns:
+        list: the names of the converted bands
+    '''
+
+    dim_file = '{}.dim'.format(dimap_prefix)
+    tree, bands = _dimap_bands(dim_file, unit='intensity')
+    if not bands:
+        return []
+
+    product_dir = os.path.dirname(os.path.abspath(dim_file))
+    hdr_files = [opj(product_dir, data_file.get('href'))
+                 for _, data_file in bands]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(ncores, len(bands)))) \
+            as executor:
+        list(executor.map(_block_to_db, ['{}.img'.format(hdr_file[:-4])
+                                         for hdr_file in hdr_files]))
+
+    band_names = []
+    for (info, data_file), hdr_file in zip(bands, hdr_files):
+        name = info.findtext('BAND_NAME')
+        db_name = '{}_db'.format(name)
+
+        # rename the image and header, and the band within the header
+        db_hdr_file = opj(os.path.dirname(hdr_file), '{}.hdr'.format(db_name))
+        os.rename('{}.img'.format(hdr_file[:-4]),
+                  '{}.img'.format(db_hdr_file[:-4]))
+        with open(hdr_file, 'r') as file:
+            header = file.read()
+        with open(db_hdr_file, 'w') as file:
+            file.write(re.sub(r'(band names\s*=\s*\{\s*)' + re.escape(name),
+                              r'\g<1>' + db_name, header))
+        os.remove(hdr_file)
+
+        # update the product description
+        info.find('BAND_NAME').text = db_name
+        info.find('PHYSICAL_UNIT').text = 'intensity_db'
+        data_file.set('href', '{}/{}.hdr'.format(
+            os.path.dirname(data_file.get('href')), db_name))
+        band_names.append(db_name)
+
+    tree.write(dim_file, encoding='ISO-8859-1', xml_declaration=True)
+    return band_names
+
+
 # rescale sar dB dat ot integer format
 def scale_to_int(float_array, min_value, max_value, datatype):
 
@@ -424,7 +527,8 @@ def create_rgb_jpeg(filelist, outfile=None, shrink_factor=1, plot=False,
                   -size {}x{} caption:\"{}\" {} +swap -gravity north \
                   -composite {}'.format(out_meta['width'], label_height,
                                         date, outfile, outfile)
-            h.run_command(cmd, '{}.log'.format(outfile), elapsed=False)
+            h.run_command(cmd, '{}.log'.format(outfile), elapsed=False,
+                          tags=dict(stage='label'))
             
     if plot:
         plt.imshow(arr)
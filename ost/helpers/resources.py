@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+'''
+This module provides a simple budgeting of cpus and memory for SNAP's gpt.
+
+A ResourceManager splits the cores and the RAM of the machine between a
+number of concurrent processing jobs. Each gpt invocation started via
+helpers.run_command gets its share as thread count (-q), tile cache (-c)
+and maximum JVM heap (-Xmx). The peak memory of finished gpt calls is
+recorded, and the number of concurrent jobs is reduced if the observed
+memory footprint does not fit into the budget.
+'''
+
+import os
+import sys
+import multiprocessing
+from contextlib import contextmanager
+
+from ost.helpers import snap_engine
+
+# the manager of the current process (inherited by forked workers)
+_MANAGER = None
+
+
+def total_memory():
+    '''Returns the physical memory of the machine in MB
+
+    Returns:
+        int: the total physical memory in MB (None if unknown)
+    '''
+
+    try:
+        return int(os.sysconf('SC_PAGE_SIZE') *
+                   os.sysconf('SC_PHYS_PAGES') / 2 ** 20)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def available_memory():
+    '''Returns the currently available memory of the machine in MB
+
+    Returns:
+        int: the available memory in MB (total memory if unknown)
+    '''
+
+    try:
+        with open('/proc/meminfo', 'r') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(int(line.split()[1]) / 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+
+    return total_memory()
+
+
+def maxrss_to_mb(maxrss):
+    '''Converts the ru_maxrss of a rusage object into MB
+
+    Args:
+        maxrss (int): ru_maxrss as returned by os.wait4 or getrusage
+
+    Returns:
+        float: the peak resident set size in MB
+    '''
+
+    # macOS reports bytes, Linux kilobytes
+    if sys.platform == 'darwin':
+        return maxrss / 2 ** 20
+
+    return maxrss / 1024
+
+
+class ResourceManager():
+    '''Budgets cpus and memory between concurrent gpt jobs
+
+    Args:
+        max_workers (int): upper limit of concurrent jobs
+        cores (int): the cpus to use (default: all)
+        memory (int): the memory to use in MB (default: available memory)
+        reserve (int): memory in MB kept free for the OS and other processes
+        min_job_memory (int): minimum memory per job in MB
+        heap_fraction (float): share of a job's memory used as JVM heap,
+                               the rest is left for the JVM's native memory
+        cache_fraction (float): share of the heap used as SNAP tile cache
+
+    Example:
+        manager = ResourceManager(max_workers=8)
+        manager.activate()
+        allocation = manager.allocation()
+        # ... run allocation['workers'] jobs with allocation['ncores']
+        # threads each, while calling manager.adapt() before submitting
+    '''
+
+    def __init__(self, max_workers=None, cores=None, memory=None,
+                 reserve=2048, min_job_memory=4096, heap_fraction=0.75,
+                 cache_fraction=0.5):
+
+        self.cores = cores or os.cpu_count()
+        self.memory = (memory or available_memory() or
+                       min_job_memory + reserve)
+        self.reserve = min(reserve, self.memory // 4)
+        self.min_job_memory = min_job_memory
+        self.heap_fraction = heap_fraction
+        self.cache_fraction = cache_fraction
+        self.max_workers = max(1, int(max_workers or self.cores))
+
+        # jobs that fit into the memory budget
+        self.workers = max(1, min(self.max_workers, self.cores,
+                                  int(self.budget // self.min_job_memory)))
+
+        # peak memory of the gpt calls, shared with forked workers
+        self._peak = multiprocessing.Value('d', 0.0)
+
+    @property
+    def budget(self):
+        '''The memory in MB that is shared between the jobs'''
+        return self.memory - self.reserve
+
+    def allocation(self, workers=None):
+        '''Returns the resources of a single job
+
+        Args:
+            workers (int): the number of concurrent jobs
+                           (default: the number of jobs fitting the budget)
+
+        Returns:
+            dict: workers, ncores (threads per gpt call), heap and cache
+                  (both in MB) per job
+        '''
+
+        workers = workers or self.workers
+        job_memory = self.budget / workers
+        heap = max(1024, int(job_memory * self.heap_fraction))
+
+        return dict(workers=workers,
+                    ncores=max(1, self.cores // workers),
+                    heap=heap,
+                    cache=max(256, int(heap * self.cache_fraction)))
+
+    def activate(self, workers=None):
+        '''Makes this manager the one used by helpers.run_command
+
+        The allocation is exported as environment variables, so that
+        it is inherited by worker processes and command line calls.
+
+        Args:
+            workers (int): the number of concurrent jobs
+        '''
+
+        global _MANAGER
+        _MANAGER = self
+
+        allocation = self.allocation(workers)
+        os.environ['OST_GPT_THREADS'] = str(allocation['ncores'])
+        os.environ['OST_GPT_HEAP'] = str(allocation['heap'])
+        os.environ['OST_GPT_CACHE'] = str(allocation['cache'])
+
+        print(' INFO: Running {} concurrent job(s) with {} threads, {} MB'
+              ' heap and {} MB tile cache each.'.format(
+                  allocation['workers'], allocation['ncores'],
+                  allocation['heap'], allocation['cache']))
+
+        # gpt calls sent to a SNAP engine wait for one of its job slots
+        engine_jobs = os.environ.get(snap_engine.JOBS_ENV)
+        if (os.environ.get(snap_engine.ENGINE_ENV) and engine_jobs and
+                int(engine_jobs) < allocation['workers']):
+            print(' WARNING: The SNAP engine runs {} gpt call(s) at once, the'
+                  ' other jobs will wait for it. Start it with max_jobs={}.'
+                  .format(engine_jobs, allocation['workers']))
+
+        return allocation
+
+    def deactivate(self):
+        '''Removes the budget of this manager from the environment'''
+
+        global _MANAGER
+        if _MANAGER is self:
+            _MANAGER = None
+            for variable in ['OST_GPT_THREADS', 'OST_GPT_HEAP',
+                             'OST_GPT_CACHE']:
+                os.environ.pop(variable, None)
+
+    def record(self, peak_mb):
+        '''Records the peak memory of a finished gpt call
+
+        Args:
+            peak_mb (float): the peak resident set size in MB
+        '''
+
+        with self._peak.get_lock():
+            if peak_mb > self._peak.value:
+                self._peak.value = peak_mb
+
+    @property
+    def peak(self):
+        '''The highest observed peak memory of a gpt call in MB'''
+        return self._peak.value
+
+    def adapt(self):
+        '''Adjusts the number of concurrent jobs to the observed memory
+
+        Returns:
+            int: the number of jobs that fit the memory budget
+        '''
+
+        if self.peak:
+            fitting = int(self.budget // (self.peak * 1.1))
+            workers = max(1, min(self.max_workers, self.cores, fitting))
+            if workers < self.workers:
+                print(' INFO: Peak memory of {:.0f} MB per job observed.'
+                      ' Reducing concurrency to {} job(s).'.format(
+                          self.peak, workers))
+            self.workers = workers
+
+        return self.workers
+
+
+def record_peak(maxrss):
+    '''Passes the peak memory of a finished gpt call to the active manager
+
+    Args:
+        maxrss (int): ru_maxrss of the finished child process
+    '''
+
+    if _MANAGER is not None:
+        _MANAGER.record(maxrss_to_mb(maxrss))
+
+
+@contextmanager
+def divided_budget(parts, min_job_memory=4096):
+    '''Divides the budget of the current job between concurrent gpt calls
+
+    The threads, heap and tile cache of the job (see
+    ResourceManager.activate) are split between the calls, as far as the
+    memory allows. Without a budget, the available memory is split.
+
+    Args:
+        parts (int): the number of gpt calls that should run at once
+        min_job_memory (int): minimum memory per gpt call in MB
+
+    Yields:
+        int: the number of gpt calls to run at once
+    '''
+
+    variables = ['OST_GPT_THREADS', 'OST_GPT_HEAP', 'OST_GPT_CACHE']
+    saved = dict((variable, os.environ.get(variable))
+                 for variable in variables)
+
+    threads = int(saved['OST_GPT_THREADS'] or os.cpu_count())
+    if saved['OST_GPT_HEAP']:
+        memory = int(saved['OST_GPT_HEAP'])
+        min_memory = min_job_memory * 0.75
+    else:
+        memory = available_memory() or min_job_memory
+        min_memory = min_job_memory
+
+    parts = max(1, min(parts, threads, int(memory // min_memory)))
+
+    try:
+        if parts > 1:
+            os.environ['OST_GPT_THREADS'] = str(threads // parts)
+            for variable in ['OST_GPT_HEAP', 'OST_GPT_CACHE']:
+                if saved[variable]:
+                    os.environ[variable] = str(
+                        int(saved[variable]) // parts)
+        yield parts
+    finally:
+        for variable, value in saved.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+
+def gpt_arguments(args):
+    '''Adds the budgeted threads, tile cache and heap to a gpt call
+
+    Args:
+        args (list): the command line split into its arguments
+
+    Returns:
+        args (list): the command line with the thread and tile cache options
+        env (dict): the environment with the heap option (None if unchanged)
+    '''
+
+    if not args or not os.path.basename(args[0]).startswith('gpt'):
+        return args, None
+
+    threads = os.environ.get('OST_GPT_THREADS')
+    heap = os.environ.get('OST_GPT_HEAP')
+    cache = os.environ.get('OST_GPT_CACHE')
+
+    # limit the thread count to the budget
+    if threads and '-q' in args[:-1]:
+        idx = args.index('-q') + 1
+        try:
+            if int(args[idx]) > int(threads):
+                args = args[:idx] + [threads] + args[idx + 1:]
+        except ValueError:
+            pass
+
+    if cache and '-c' not in args:
+        # after the operator/graph argument
+        args = args[:2] + ['-c', '{}M'.format(cache)] + args[2:]
+
+    env = None
+    if heap:
+        env = os.environ.copy()
+        env['_JAVA_OPTIONS'] = ' '.join(
+            [env.get('_JAVA_OPTIONS', ''), '-Xmx{}M'.format(heap)]).strip()
+
+    return args, env
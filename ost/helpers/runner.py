@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+'''
+This module runs external commands under supervision.
+
+The output of a command (stdout and stderr, e.g. SNAP's gpt) is streamed
+into its log file while it runs, instead of being held in memory until it
+exits. The log file is rotated if it becomes large, and removed if the
+command succeeds. For gpt, the progress percentages are passed to a
+callback (and written as a counter to the timeline, see
+ost.helpers.trace).
+
+A command is killed
+    - if it runs longer than the timeout of its stage (see set_timeouts),
+    - if it is cancelled (see cancel_all, or the cancel event of a call),
+    - as soon as it prints a message after which it cannot succeed anymore
+      (see FATAL_MESSAGES), e.g. when the JVM runs out of memory, which
+      often leaves gpt hanging instead of exiting.
+
+Timeouts are given per stage (the stage as derived from the log file, see
+metrics.command_tags) in the OST_TIMEOUTS environment variable, so that
+they apply to all worker processes as well:
+
+    runner.set_timeouts({'default': 4 * 3600, 'Import': 1800})
+'''
+
+import os
+import re
+import json
+import signal
+import threading
+import subprocess
+
+from ost.helpers import metrics, trace
+
+TIMEOUT_ENV = 'OST_TIMEOUTS'
+
+# messages after which a command cannot succeed
+FATAL_MESSAGES = [
+    'java.lang.OutOfMemoryError',
+    'GC overhead limit exceeded',
+    'No space left on device',
+]
+
+# progress of gpt, e.g. ....10%....20%....30%
+PROGRESS = re.compile(r'(\d{1,3})%')
+
+# seconds between the checks of timeout and cancellation, and between
+# SIGTERM and SIGKILL
+_INTERVAL = 1
+_GRACE = 10
+
+# cancels all running commands of this process
+_CANCEL = threading.Event()
+
+
+def set_timeouts(timeouts):
+    '''Sets the timeouts per stage for this and all child processes
+
+    Args:
+        timeouts (dict): seconds per stage, e.g. dict(calibration=3600),
+                         with 'default' for all other stages
+    '''
+
+    os.environ[TIMEOUT_ENV] = json.dumps(timeouts)
+
+
+def timeout(stage):
+    '''Returns the timeout of a stage in seconds (None if unlimited)'''
+
+    try:
+        timeouts = json.loads(os.environ.get(TIMEOUT_ENV) or '{}')
+    except ValueError:
+        return None
+
+    return timeouts.get(stage, timeouts.get('default'))
+
+
+def cancel_all():
+    '''Kills all commands running in this process, and all started later'''
+    _CANCEL.set()
+
+
+def reset():
+    '''Allows to run commands again after cancel_all'''
+    _CANCEL.clear()
+
+
+def cancelled():
+    '''Checks if the commands of this process have been cancelled'''
+    return _CANCEL.is_set()
+
+
+def command_stage(args, logfile, tags=None):
+    '''Returns the stage of a command, which defines its timeout'''
+
+    info = metrics.command_tags(args, logfile, tags)
+    return info.get('stage') or info['executable']
+
+
+class _Log():
+    '''A log file shared by the reader threads, rotated if it gets large'''
+
+    def __init__(self, logfile, max_bytes=10 * 2 ** 20, backups=2):
+        self.logfile = str(logfile)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.lock = threading.Lock()
+        self.file = open(self.logfile, 'wb')
+
+    def write(self, data):
+        with self.lock:
+            if self.file.tell() + len(data) > self.max_bytes:
+                self._rotate()
+            self.file.write(data)
+            self.file.flush()
+
+    def _rotate(self):
+        self.file.close()
+        for idx in range(self.backups, 0, -1):
+            source = ('{}.{}'.format(self.logfile, idx - 1) if idx > 1
+                      else self.logfile)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.logfile, idx))
+        self.file = open(self.logfile, 'wb')
+
+    def close(self, remove=False):
+        with self.lock:
+            self.file.close()
+        if remove:
+            for file in [self.logfile] + ['{}.{}'.format(self.logfile, idx)
+                                          for idx in range(1, self.backups
+                                                           + 1)]:
+                if os.path.exists(file):
+                    os.remove(file)
+
+
+def _signal(process, signum):
+    '''Sends a signal to a command and all processes it started
+
+    Returns:
+        bool: False if the command does not exist anymore
+    '''
+
+    try:
+        os.killpg(process.pid, signum)
+    except OSError:
+        return False
+
+    return True
+
+
+def _exit_code(status):
+    '''Converts a wait status into a return code as used by subprocess'''
+
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+
+    return os.WEXITSTATUS(status)
+
+
+class Supervisor():
+    '''Streams the output of a running command and kills it if needed
+
+    Args:
+        process (Popen): the started command with stdout and stderr pipes
+        log (_Log): the log file of the command
+        timeout (float): the maximum run time in seconds (None: unlimited)
+        cancel (threading.Event): kills the command when set
+        on_progress: a function called with the progress in percent
+    '''
+
+    def __init__(self, process, log, timeout=None, cancel=None,
+                 on_progress=None):
+
+        self.process = process
+        self.log = log
+        self.timeout = timeout
+        self.cancel = cancel
+        self.on_progress = on_progress
+        self.progress = None
+        self.reason = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+        self._threads = [
+            threading.Thread(target=self._read, args=(stream,), daemon=True)
+            for stream in (process.stdout, process.stderr)]
+        self._threads.append(threading.Thread(target=self._watch,
+                                              daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _read(self, stream):
+        '''Writes the output of a stream to the log and parses it'''
+
+        # a number at the end of a chunk may be continued by the next one,
+        # and a message may be split between two chunks
+        digits, tail = '', ''
+        for chunk in iter(lambda: stream.read1(65536), b''):
+            self.log.write(chunk)
+            text = chunk.decode(errors='replace')
+
+            progress = digits + text
+            digits = re.search(r'\d{0,3}$', progress).group(0)
+            for match in PROGRESS.finditer(progress[:len(progress) -
+                                                    len(digits)]):
+                self._report(int(match.group(1)))
+
+            window, tail = tail + text, (tail + text)[-64:]
+            for message in FATAL_MESSAGES:
+                if message in window:
+                    self._kill('fatal message: {}'.format(message))
+
+        stream.close()
+
+    def _report(self, percent):
+        if percent == self.progress or percent > 100:
+            return
+
+        self.progress = percent
+        if self.on_progress is not None:
+            self.on_progress(percent)
+
+    def _watch(self):
+        '''Kills the command after its timeout or on cancellation'''
+
+        waited = 0
+        while not self._done.wait(_INTERVAL):
+            waited += _INTERVAL
+            if self.timeout and waited > self.timeout:
+                self._kill('timeout of {} seconds'.format(self.timeout))
+            elif _CANCEL.is_set() or (self.cancel is not None and
+                                      self.cancel.is_set()):
+                self._kill('cancelled')
+
+    def _kill(self, reason):
+        '''Terminates the command, and kills it if it does not exit'''
+
+        with self._lock:
+            if self.reason is not None:
+                return
+            self.reason = reason
+
+        self.log.write('\nOST: killed the command ({})\n'.format(
+            reason).encode())
+
+        if not _signal(self.process, signal.SIGTERM):
+            return
+
+        def _force():
+            if not self._done.wait(_GRACE):
+                _signal(self.process, signal.SIGKILL)
+
+        threading.Thread(target=_force, daemon=True).start()
+
+    def finish(self):
+        '''Stops the watching after the command exited'''
+
+        self._done.set()
+        for thread in self._threads:
+            thread.join(_GRACE)
+
+
+def run(args, logfile, env=None, tags=None, cancel=None, on_progress=None):
+    '''Runs a command and returns its return code and resource usage
+
+    Args:
+        args (list): the command line split into its arguments
+        logfile (str): the log file of the command (removed on success)
+        env (dict): the environment of the command (default: inherited)
+        tags (dict): stage, product etc. of the command (derived from the
+                     logfile's name if not given), the stage defines the
+                     timeout
+        cancel (threading.Event): kills the command when set
+        on_progress: a function called with the progress in percent
+
+    Returns:
+        return_code (int): the return code (negative if killed)
+        rusage: the resource usage as returned by os.wait4
+        io (dict): the counters of /proc/<pid>/io (None if not available)
+    '''
+
+    info = metrics.command_tags(args, logfile, tags)
+    stage = info.get('stage') or info['executable']
+
+    if on_progress is None and trace.enabled():
+        name = '{} {}'.format(stage, info.get('product') or '').strip()
+
+        def on_progress(percent):
+            trace.counter(name, percent)
+
+    log = _Log(logfile)
+
+    # a session of its own, so that the command is killed with its children
+    process = subprocess.Popen(args, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, env=env,
+                               start_new_session=True)
+    supervisor = Supervisor(process, log, timeout(stage), cancel,
+                            on_progress)
+
+    try:
+        # the i/o counters have to be read before the child is reaped
+        io = metrics.wait_io(process.pid)
+
+        # wait4 gives us the resource usage of this very child
+        _, status, rusage = os.wait4(process.pid, 0)
+        return_code = process.returncode = _exit_code(status)
+    except BaseException:
+        # e.g. KeyboardInterrupt, which does not reach the own session
+        _signal(process, signal.SIGKILL)
+        process.wait()
+        raise
+    finally:
+        supervisor.finish()
+        log.close(remove=process.returncode == 0 and
+                  supervisor.reason is None)
+
+    if supervisor.reason is not None:
+        print(' ERROR: {} was killed ({}).'.format(stage, supervisor.reason))
+        return_code = return_code or 1
+
+    return return_code, rusage, io
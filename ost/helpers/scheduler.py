@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+'''
+This module provides a simple dependency aware task scheduler.
+
+Tasks are added to a TaskGraph together with the keys of the tasks they
+depend on. Once all dependencies of a task have succeeded, it is submitted
+to a pool of worker processes, so that independent tasks run concurrently.
+Intermediate products can be registered with a cleanup function which is
+called as soon as the last consumer of a task has finished.
+
+If a TaskStore is given, the result of each task is recorded persistently,
+tasks that already succeeded are not run again, and failed tasks are
+retried up to a maximum number of attempts.
+
+Several machines can share the work on a common processing directory
+(worker mode). Tasks are then claimed through lock files (see
+ost.helpers.locks). Tasks claimed by other workers are put aside and tried
+again later, so that they are either found finished or, if the other
+worker died, taken over.
+'''
+
+from os.path import join as opj
+import time
+import queue
+import multiprocessing
+
+from ost.helpers import helpers as h
+from ost.helpers import state, trace
+from ost.helpers.locks import FileLock
+
+
+def _stage(key):
+    '''Returns the stage of a task, i.e. the first part of a tuple key'''
+    return key[0] if isinstance(key, tuple) else None
+
+
+def _run_task(argument_list):
+    '''Executes a single task and catches its errors
+
+    Args:
+        argument_list (list): key, function, args and kwargs of the task
+
+    Returns:
+        key: the key of the task
+        return_code (int): the return code of the function (None counts as 0)
+        error (str): the class of the raised exception (None if not raised)
+        duration (float): the run time of the task in seconds
+    '''
+
+    key, function, args, kwargs = argument_list
+    start, error = time.time(), None
+
+    try:
+        with trace.span(state.task_id(key), _stage(key) or 'task'):
+            return_code = function(*args, **kwargs)
+    except Exception as exception:
+        print(' ERROR: Task {} failed with {}'.format(key, exception))
+        return_code, error = 1, type(exception).__name__
+
+    return (key, 0 if return_code is None else return_code, error,
+            time.time() - start)
+
+
+class TaskGraph():
+    '''A directed acyclic graph of tasks with reference counted cleanup
+
+    Example:
+        graph = TaskGraph()
+        graph.add('import', _import, args=(...), cleanup=delete_import)
+        graph.add('ard', _ard, args=(...), depends=['import'])
+        return_codes = graph.run(max_workers=4)
+    '''
+
+    def __init__(self):
+
+        self.tasks = {}
+        self.order = []
+
+    def add(self, key, function, args=(), kwargs=None, depends=(),
+            cleanup=None, outputs=(), lock=None):
+        '''Adds a task to the graph
+
+        Args:
+            key: a unique (hashable) identifier of the task
+            function: a module level (i.e. picklable) function
+            args (tuple): positional arguments of the function
+            kwargs (dict): keyword arguments of the function
+            depends (list): keys of the tasks that need to succeed first
+            cleanup: a function called with the key of the task in the
+                     main process, once all tasks depending on it finished
+            outputs (list): the paths of the products of the task, recorded
+                            in the TaskStore on success
+            lock (str): name of the lock claimed in worker mode, tasks
+                        sharing a lock are processed by the same worker
+        '''
+
+        if key in self.tasks:
+            raise ValueError(' ERROR: Task {} has already been added.'.format(
+                key))
+
+        self.tasks[key] = dict(function=function,
+                               args=tuple(args),
+                               kwargs=kwargs or {},
+                               depends=list(depends),
+                               cleanup=cleanup,
+                               outputs=list(outputs),
+                               lock=lock)
+        self.order.append(key)
+
+    def _check(self):
+        '''Checks for unknown dependencies and cycles'''
+
+        for key, task in self.tasks.items():
+            for dep in task['depends']:
+                if dep not in self.tasks:
+                    raise ValueError(' ERROR: Task {} depends on unknown'
+                                     ' task {}.'.format(key, dep))
+
+        # depth first search for cycles
+        state = {}
+        for root in self.order:
+            if root in state:
+                continue
+            stack = [(root, iter(self.tasks[root]['depends']))]
+            state[root] = 'visiting'
+            while stack:
+                key, deps = stack[-1]
+                for dep in deps:
+                    if state.get(dep) == 'visiting':
+                        raise ValueError(' ERROR: Cyclic dependency between'
+                                         ' {} and {}.'.format(key, dep))
+                    if dep not in state:
+                        state[dep] = 'visiting'
+                        stack.append((dep, iter(self.tasks[dep]['depends'])))
+                        break
+                else:
+                    state[key] = 'done'
+                    stack.pop()
+
+    def run(self, max_workers=1, resources=None, store=None,
+            max_attempts=1, lock_dir=None, stale_after=600, poll=30):
+        '''Executes all tasks of the graph
+
+        Tasks whose dependencies failed are skipped and reported as failed.
+        A failed task is resubmitted until it has been attempted
+        max_attempts times. With a TaskStore, attempts are counted over
+        consecutive runs, and tasks already done are not run again. Tasks
+        with a cleanup, whose products are transient, are only run again if
+        a task depending on them is not done yet.
+
+        With a lock_dir, the locks of the tasks are claimed before they
+        start and released once all tasks sharing them finished. The task
+        functions need to return early if their products already exist,
+        since a task postponed because of another worker's lock is run once
+        that lock is released.
+
+        Args:
+            max_workers (int): the number of tasks executed at once
+            resources (ResourceManager): if given, its budget is applied to
+                                         the gpt calls of the tasks and the
+                                         number of concurrent tasks is
+                                         reduced if memory gets short
+            store (TaskStore): a persistent record of the task states
+            max_attempts (int): the maximum number of attempts per task
+            lock_dir (str): directory of the lock files (enables worker mode)
+            stale_after (int): seconds after which a lock without heartbeat
+                               is taken over
+            poll (int): seconds between the claims of postponed tasks
+
+        Returns:
+            dict: the return code of each task (None if skipped)
+        '''
+
+        self._check()
+        start = time.time()
+
+        # reference counts for the eviction of intermediate products
+        consumers = {key: 0 for key in self.tasks}
+        dependents = {key: [] for key in self.tasks}
+        for key, task in self.tasks.items():
+            for dep in set(task['depends']):
+                consumers[dep] += 1
+                dependents[dep].append(key)
+
+        missing = {key: len(set(task['depends']))
+                   for key, task in self.tasks.items()}
+        return_codes = {}
+        ready = [key for key in self.order if missing[key] == 0]
+        finished = queue.Queue()
+        running = 0
+        released = set()
+        attempts = {key: 0 for key in self.tasks}
+
+        # worker mode: the held locks, and the tasks of each lock
+        locks, waiting, retry_at = {}, [], 0
+        lock_tasks = {}
+        for key, task in self.tasks.items():
+            if lock_dir and task['lock'] is not None:
+                lock_tasks.setdefault(task['lock'], set()).add(key)
+
+        def _claim(key):
+            '''Claims the lock of a task, False if held by another worker'''
+            name = self.tasks[key]['lock']
+            if name not in lock_tasks or name in locks:
+                return True
+            lock = FileLock(opj(lock_dir, '{}.lock'.format(name)),
+                            stale_after)
+            if not lock.acquire():
+                return False
+            locks[name] = lock
+            return True
+
+        def _settle(key):
+            '''Releases the lock of a task once its last task finished'''
+            name = self.tasks[key]['lock']
+            if name not in lock_tasks:
+                return
+            lock_tasks[name].discard(key)
+            if not lock_tasks[name] and name in locks:
+                locks.pop(name).release()
+
+        def _release(key):
+            '''Calls the cleanup of a task if nothing depends on it anymore'''
+            cleanup = self.tasks[key]['cleanup']
+            if consumers[key] == 0 and key not in released:
+                released.add(key)
+                if cleanup is not None:
+                    cleanup(key)
+
+        def _skip(key):
+            '''Marks a task and everything depending on it as failed'''
+            todo = [key]
+            while todo:
+                key = todo.pop()
+                if key in return_codes:
+                    continue
+                return_codes[key] = None
+                _settle(key)
+                print(' INFO: Skipping task {} because of a failed'
+                      ' dependency.'.format(key))
+                for dep in set(self.tasks[key]['depends']):
+                    consumers[dep] -= 1
+                    if dep in return_codes:
+                        _release(dep)
+                todo.extend(dependents[key])
+
+        def _finish(key, return_code, error=None, duration=None):
+            '''Updates the graph after a task has finished'''
+
+            if store is not None and duration is not None:
+                store.finish(state.task_id(key), return_code, duration, error,
+                             self.tasks[key]['outputs'], _stage(key))
+
+            # resubmit failed tasks as long as attempts are left
+            if return_code != 0 and attempts[key] < max_attempts:
+                print(' INFO: Retrying task {} (attempt {} of {}).'.format(
+                    key, attempts[key] + 1, max_attempts))
+                ready.append(key)
+                return
+
+            return_codes[key] = return_code
+            _settle(key)
+            for dep in set(self.tasks[key]['depends']):
+                consumers[dep] -= 1
+                _release(dep)
+
+            if return_code != 0:
+                print(' ERROR: Task {} exited with return code {}.'.format(
+                    key, return_code))
+                for dependent in dependents[key]:
+                    _skip(dependent)
+                _release(key)
+                return
+
+            _release(key)
+            for dependent in dependents[key]:
+                missing[dependent] -= 1
+                if missing[dependent] == 0 and dependent not in return_codes:
+                    ready.append(dependent)
+
+        # take over the state of previous runs
+        if store is not None:
+            done = store.ids(state.DONE)
+            failed = store.ids(state.FAILED)
+
+            # the products of tasks with a cleanup are gone, so these are
+            # only taken over if all tasks depending on them are done
+            resumed = set(key for key in self.order
+                          if state.task_id(key) in done and
+                          self.tasks[key]['cleanup'] is None)
+            changed = True
+            while changed:
+                changed = False
+                for key in self.order:
+                    if (key not in resumed and state.task_id(key) in done
+                            and all(dependent in resumed
+                                    for dependent in dependents[key])):
+                        resumed.add(key)
+                        changed = True
+
+            for key in self.order:
+                record = state.task_id(key)
+                if key in resumed:
+                    if key in ready:
+                        ready.remove(key)
+                    _finish(key, 0)
+                elif record in failed:
+                    attempts[key] = store.attempts(record)
+                    if attempts[key] >= max_attempts:
+                        print(' INFO: Task {} failed {} times before and'
+                              ' is not retried.'.format(key, attempts[key]))
+                        if key in ready:
+                            ready.remove(key)
+                        attempts[key] = max_attempts
+                        _finish(key, 1)
+
+        if resources is not None:
+            max_workers = resources.activate(max_workers)['workers']
+
+        pool = None
+        if max_workers > 1:
+            pool = multiprocessing.Pool(processes=max_workers)
+
+        try:
+            while ready or running or waiting:
+
+                limit = max_workers
+                if resources is not None:
+                    limit = min(max_workers, resources.adapt())
+
+                # try to claim the postponed tasks again
+                if waiting and time.time() >= retry_at:
+                    ready.extend(waiting)
+                    waiting = []
+
+                while ready and (pool is None or running < limit):
+                    key = ready.pop(0)
+                    if key in return_codes:
+                        continue
+                    if not _claim(key):
+                        if not waiting:
+                            print(' INFO: Task {} is processed by another'
+                                  ' worker, trying again later.'.format(key))
+                            retry_at = time.time() + poll
+                        waiting.append(key)
+                        continue
+                    task = self.tasks[key]
+                    attempts[key] += 1
+                    if store is not None:
+                        store.start(state.task_id(key), _stage(key))
+                    argument_list = [key, task['function'], task['args'],
+                                     task['kwargs']]
+                    if pool is None:
+                        _finish(*_run_task(argument_list))
+                    else:
+                        pool.apply_async(
+                            _run_task, (argument_list,),
+                            callback=finished.put,
+                            error_callback=lambda error, key=key:
+                                finished.put((key, 1, type(error).__name__,
+                                              0.0)))
+                        running += 1
+
+                if running:
+                    timeout = None
+                    if waiting:
+                        timeout = max(0, retry_at - time.time())
+                    try:
+                        result = finished.get(timeout=timeout)
+                    except queue.Empty:
+                        continue
+                    running -= 1
+                    _finish(*result)
+                elif waiting and not ready:
+                    time.sleep(max(0, retry_at - time.time()))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            for lock in locks.values():
+                lock.release()
+            if resources is not None:
+                resources.deactivate()
+
+        failed = [key for key in self.order if return_codes.get(key) != 0]
+        print(' INFO: {} of {} tasks succeeded.'.format(
+            len(self.order) - len(failed), len(self.order)))
+        h.timer(start)
+
+        return return_codes
@@ -16,7 +16,7 @@ import tqdm
 #import zipfile
 from shapely.wkt import loads
 
-from ost.helpers import helpers as h
+from ost.helpers import helpers as h, trace
 
 
 def ask_credentials():
@@ -231,6 +231,8 @@ def check_connection(uname, pword):
     return response.status_code
 
 
+@trace.traced('download', 'download',
+              label=lambda argument_list: os.path.basename(argument_list[1]))
 def s1_download(argument_list):
     '''Function to download a single Sentinel-1 product from Copernicus scihub
 
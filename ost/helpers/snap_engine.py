@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+'''
+This module provides a persistent SNAP engine for the gpt calls of OST.
+
+Every call of SNAP's gpt starts a new JVM, loads the SNAP modules and
+parses the graph, which takes 10-20 seconds before any pixel is processed.
+For small products such as single bursts, this dominates the processing
+time. The SNAP engine is a long-lived Python process that keeps a JVM
+loaded through SNAP's Python bridge (esa_snappy, or snappy for older SNAP
+versions) and executes gpt command lines sent to it over a local socket.
+
+If the OST_SNAP_ENGINE environment variable points to the socket of a
+running engine, helpers.run_command sends all gpt calls to the engine.
+If the engine is not reachable, the calls fall back to gpt.
+
+All calls share the JVM of the engine: its heap is set once at start
+(the -Xmx of the per-job budget does not apply), and the thread count
+(-q), tile cache size (-c) and tile cache clearing (-x) of a call act on
+the JAI state of the whole engine. The engine should therefore be sized
+for all concurrent jobs (see Project.start_snap_engine), and the peak
+memory of a call is reported as the engine's peak divided by its jobs.
+
+The timeouts and the cancellation of ost.helpers.runner apply to calls
+sent to the engine as well. The engine then interrupts the job and the
+call fails. Since the engine does not stream the output of its jobs, the
+progress and the fatal messages are not available for them.
+
+Example:
+    from ost.helpers import snap_engine
+    engine = snap_engine.start()
+    ...   # all processing
+    snap_engine.stop()
+
+The engine can also be started separately, e.g. to serve the workers of
+a machine:
+
+    ost-snap-engine --socket /tmp/ost-snap.sock --max-jobs 2
+    export OST_SNAP_ENGINE=/tmp/ost-snap.sock
+    export OST_SNAP_ENGINE_JOBS=2
+'''
+
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import tempfile
+import threading
+import subprocess
+import socketserver
+
+ENGINE_ENV = 'OST_SNAP_ENGINE'
+JOBS_ENV = 'OST_SNAP_ENGINE_JOBS'
+
+# seconds between the checks of timeout and cancellation
+_INTERVAL = 1
+
+
+def _send(socket_path, request, timeout=None):
+    '''Sends a request to the engine and returns its response'''
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendall('{}\n'.format(json.dumps(request)).encode())
+
+        with connection.makefile('r') as response:
+            return json.loads(response.readline())
+
+
+def available(socket_path=None):
+    '''Checks if an engine answers on the socket
+
+    Args:
+        socket_path (str): the socket of the engine
+                           (default: the one of OST_SNAP_ENGINE)
+
+    Returns:
+        bool: True if the engine is running
+    '''
+
+    socket_path = socket_path or os.environ.get(ENGINE_ENV)
+    if not socket_path or os.name == 'nt':
+        return False
+
+    try:
+        return _send(socket_path, dict(command='ping'), timeout=10).get('ok')
+    except (OSError, ValueError):
+        return False
+
+
+def _wait(socket_path, request, timeout=None, cancelled=None):
+    '''Sends a job to the engine and waits for its response
+
+    Returns:
+        tuple: the response of the engine (None if the job has been aborted
+               because of its timeout or a cancellation) and the reason of
+               the abort
+    '''
+
+    start_time = time.time()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        connection.sendall('{}\n'.format(json.dumps(request)).encode())
+
+        # check timeout and cancellation while waiting
+        connection.settimeout(_INTERVAL)
+        data = b''
+        while not data.endswith(b'\n'):
+            try:
+                chunk = connection.recv(65536)
+            except socket.timeout:
+                if timeout and time.time() - start_time > timeout:
+                    return None, 'timeout of {} seconds'.format(timeout)
+                if cancelled is not None and cancelled():
+                    return None, 'cancelled'
+                continue
+
+            if not chunk:
+                raise ValueError('connection closed by the engine')
+            data += chunk
+
+    return json.loads(data.decode()), None
+
+
+def run(args, logfile=None, timeout=None, cancelled=None):
+    '''Executes a gpt command line by the engine
+
+    Args:
+        args (list): the gpt command line split into its arguments
+        logfile (str): the file the error message is written to on failure
+        timeout (float): the maximum run time in seconds (None: unlimited)
+        cancelled: a function returning True if the job is to be aborted
+
+    Returns:
+        tuple: the return code and the peak memory per job (as ru_maxrss,
+               None if not reported), None if no engine is reachable, in
+               which case the command has to be run by gpt
+    '''
+
+    socket_path = os.environ.get(ENGINE_ENV)
+    if not socket_path or os.name == 'nt':
+        return None
+
+    job = uuid.uuid4().hex
+    try:
+        response, reason = _wait(socket_path, dict(
+            command='gpt', args=args[1:], job=job), timeout, cancelled)
+    except (OSError, ValueError) as error:
+        print(' INFO: SNAP engine not reachable ({}), using gpt.'.format(
+            error))
+        return None
+
+    if response is None:
+        try:
+            _send(socket_path, dict(command='abort', job=job), timeout=10)
+        except (OSError, ValueError):
+            pass
+        print(' ERROR: The SNAP engine job was aborted ({}).'.format(reason))
+        response = dict(return_code=1, error='aborted ({})'.format(reason))
+
+    if response['return_code'] != 0 and logfile:
+        with open(str(logfile), 'w') as file:
+            file.write('{}\n'.format(response.get('error')))
+
+    maxrss = response.get('maxrss')
+    if maxrss is not None:
+        maxrss = maxrss / max(1, response.get('jobs', 1))
+
+    return response['return_code'], maxrss
+
+
+def start(socket_path=None, max_jobs=1, heap=None, timeout=300):
+    '''Starts an engine in the background for this and all child processes
+
+    Args:
+        socket_path (str): the socket of the engine
+                           (default: a new one in the temp directory)
+        max_jobs (int): the number of gpt calls executed at once (their
+                        heap, thread count and tile cache are shared)
+        heap (int): the maximum JVM heap in MB for all jobs together
+                    (default: as configured for SNAP's Python bridge)
+        timeout (int): seconds to wait for the engine to be ready
+
+    Returns:
+        the Popen object of the engine (None if it could not be started)
+    '''
+
+    if os.name == 'nt':
+        print(' INFO: The SNAP engine is not supported on Windows.')
+        return None
+
+    socket_path = socket_path or _temp_path('ost-snap-{}.sock'.format(
+        os.getpid()))
+
+    env = os.environ.copy()
+    if heap:
+        env['_JAVA_OPTIONS'] = ' '.join(
+            [env.get('_JAVA_OPTIONS', ''), '-Xmx{}M'.format(heap)]).strip()
+
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'ost.helpers.snap_engine',
+         '--socket', socket_path, '--max-jobs', str(max_jobs)], env=env)
+
+    # loading the SNAP modules takes a while
+    start_time = time.time()
+    while time.time() - start_time < timeout:
+        if process.poll() is not None:
+            print(' ERROR: The SNAP engine could not be started. Is'
+                  ' esa_snappy (or snappy) configured for this Python?')
+            return None
+        if available(socket_path):
+            os.environ[ENGINE_ENV] = socket_path
+            os.environ[JOBS_ENV] = str(max_jobs)
+            print(' INFO: SNAP engine listening on {}.'.format(socket_path))
+            return process
+        time.sleep(1)
+
+    print(' ERROR: The SNAP engine did not start within {} seconds.'.format(
+        timeout))
+    process.terminate()
+    return None
+
+
+def stop(socket_path=None):
+    '''Shuts down an engine
+
+    Args:
+        socket_path (str): the socket of the engine
+                           (default: the one of OST_SNAP_ENGINE)
+    '''
+
+    socket_path = socket_path or os.environ.get(ENGINE_ENV)
+    if os.environ.get(ENGINE_ENV) == socket_path:
+        os.environ.pop(ENGINE_ENV, None)
+        os.environ.pop(JOBS_ENV, None)
+
+    if not socket_path:
+        return
+
+    try:
+        _send(socket_path, dict(command='shutdown'), timeout=60)
+    except (OSError, ValueError):
+        pass
+
+
+def _temp_path(name):
+    '''Returns a path in the temp directory (socket paths need to be short)'''
+    return os.path.join(tempfile.gettempdir(), name)
+
+
+def _load_snap(running):
+    '''Loads SNAP through its Python bridge
+
+    Args:
+        running (dict): the Java threads of the running jobs, by job id
+
+    Returns:
+        a function executing a list of gpt arguments within the JVM
+    '''
+
+    try:
+        import esa_snappy as snappy
+    except ImportError:
+        import snappy
+
+    jpy = snappy.jpy
+    jpy.get_type('org.esa.snap.core.gpf.GPF').getDefaultInstance()\
+        .getOperatorSpiRegistry().loadOperatorSpis()
+    command_line_tool = jpy.get_type(
+        'org.esa.snap.core.gpf.main.CommandLineTool')
+    system = jpy.get_type('java.lang.System')
+    thread = jpy.get_type('java.lang.Thread')
+
+    def _gpt(args, job=None):
+        running[job] = thread.currentThread()
+        try:
+            command_line_tool().run(jpy.array('java.lang.String', args))
+        finally:
+            running.pop(job, None)
+            # clear an interrupt that came too late
+            thread.interrupted()
+            system.gc()
+
+    return _gpt
+
+
+def serve(socket_path, max_jobs=1):
+    '''Runs the engine until it receives a shutdown request
+
+    Args:
+        socket_path (str): the socket to listen on
+        max_jobs (int): the number of gpt calls executed at once
+    '''
+
+    # not available on Windows, where the engine is not supported
+    import resource
+
+    # the Java threads of the running jobs, and the aborted jobs
+    running, aborted = {}, set()
+
+    gpt = _load_snap(running)
+    jobs = threading.BoundedSemaphore(max_jobs)
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def handle(self):
+            request = json.loads(self.rfile.readline())
+
+            if request['command'] == 'ping':
+                response = dict(ok=True)
+            elif request['command'] == 'shutdown':
+                response = dict(ok=True)
+                threading.Thread(target=self.server.shutdown).start()
+            elif request['command'] == 'abort':
+                # jobs still waiting for a slot are not started at all
+                aborted.add(request['job'])
+                thread = running.get(request['job'])
+                if thread is not None:
+                    thread.interrupt()
+                response = dict(ok=True)
+            else:
+                job = request.get('job')
+                with jobs:
+                    start_time = time.time()
+                    try:
+                        if job in aborted:
+                            raise RuntimeError('aborted')
+                        gpt(request['args'], job)
+                        response = dict(return_code=0)
+                    except Exception as error:
+                        response = dict(return_code=1, error=str(error))
+                    finally:
+                        aborted.discard(job)
+                    response['wall'] = time.time() - start_time
+                    response['maxrss'] = resource.getrusage(
+                        resource.RUSAGE_SELF).ru_maxrss
+                    response['jobs'] = max_jobs
+
+            # the client is gone if the job has been aborted
+            try:
+                self.wfile.write('{}\n'.format(
+                    json.dumps(response)).encode())
+            except OSError:
+                pass
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, Handler)
+    server.daemon_threads = True
+    print(' INFO: SNAP engine ready on {}.'.format(socket_path))
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def main(argv=None):
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Keeps SNAP loaded and executes gpt calls of OST.')
+    parser.add_argument('--socket', default=_temp_path('ost-snap.sock'),
+                        help=' (str) path to the socket to listen on')
+    parser.add_argument('--max-jobs', default=1, type=int,
+                        help=' (int) number of gpt calls executed at once')
+    args = parser.parse_args(argv)
+
+    serve(args.socket, args.max_jobs)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
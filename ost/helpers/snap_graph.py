@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+'''
+This module builds SNAP processing graphs on the fly.
+
+The graphs in ost/graphs cover single processing steps, each of which is
+run by a separate call of SNAP's gpt that writes a full BEAM-DIMAP product
+to the temp directory. A Graph chains several operators instead, so that a
+whole processing chain runs within a single JVM and only the final
+products are written to disk.
+
+Example:
+    graph = Graph()
+    read = graph.add('Read', file='/path/to/S1A_IW_GRDH.zip')
+    cal = graph.add('Calibration', read, outputSigmaBand=True)
+    graph.add('Write', cal, file='/path/to/out.dim', formatName='BEAM-DIMAP')
+    graph.write('/path/to/graph.xml')
+'''
+
+import os
+import xml.etree.ElementTree as eTree
+
+from ost.helpers import helpers as h
+
+# the map projection of the terrain corrected products (as in ost/graphs)
+WGS84 = ('GEOGCS["WGS84(DD)", DATUM["WGS84", SPHEROID["WGS84", 6378137.0, '
+         '298.257223563]], PRIMEM["Greenwich", 0.0], UNIT["degree", '
+         '0.017453292519943295], AXIS["Geodetic longitude", EAST], '
+         'AXIS["Geodetic latitude", NORTH]]')
+
+
+def _to_text(value):
+    '''Converts a parameter value to its representation in the graph xml'''
+
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, tuple)):
+        return ','.join(str(item) for item in value)
+
+    return str(value)
+
+
+class Graph():
+    '''A SNAP processing graph of chained operators'''
+
+    def __init__(self):
+        self.nodes = []
+
+    def add(self, operator, sources=None, node_id=None, **parameters):
+        '''Adds an operator to the graph
+
+        Args:
+            operator (str): the name of the SNAP operator, e.g. Calibration
+            sources (str/list): the id(s) of the source node(s)
+            node_id (str): the id of the node (default: the operator name,
+                           numbered if the operator is already in the graph)
+            parameters: the parameters of the operator
+
+        Returns:
+            str: the id of the node
+        '''
+
+        if node_id is None:
+            ids = [node[0] for node in self.nodes]
+            node_id, idx = operator, 1
+            while node_id in ids:
+                node_id, idx = '{}({})'.format(operator, idx + 1), idx + 1
+
+        if sources is None:
+            sources = []
+        elif isinstance(sources, str):
+            sources = [sources]
+
+        self.nodes.append((node_id, operator, list(sources), parameters))
+        return node_id
+
+    def to_xml(self):
+        '''Returns the graph in SNAP's graph xml format'''
+
+        root = eTree.Element('graph', id='Graph')
+        eTree.SubElement(root, 'version').text = '1.0'
+
+        for node_id, operator, sources, parameters in self.nodes:
+            node = eTree.SubElement(root, 'node', id=node_id)
+            eTree.SubElement(node, 'operator').text = operator
+
+            # multiple sources are named sourceProduct, sourceProduct.1, ...
+            source_element = eTree.SubElement(node, 'sources')
+            for idx, source in enumerate(sources):
+                name = 'sourceProduct.{}'.format(idx) if idx else 'sourceProduct'
+                eTree.SubElement(source_element, name, refid=source)
+
+            parameter_element = eTree.SubElement(
+                node, 'parameters',
+                {'class': 'com.bc.ceres.binding.dom.XppDomElement'})
+            for key, value in parameters.items():
+                eTree.SubElement(parameter_element, key).text = _to_text(value)
+
+        return eTree.tostring(root, encoding='unicode')
+
+    def write(self, graph_file):
+        '''Writes the graph to an xml file
+
+        Args:
+            graph_file (str): path to the graph xml
+        '''
+
+        with open(graph_file, 'w') as file:
+            file.write(self.to_xml())
+
+    def run(self, graph_file, logfile, ncores=os.cpu_count(), tags=None):
+        '''Writes the graph and executes it with SNAP's gpt
+
+        Args:
+            graph_file (str): path to the graph xml
+            logfile (str): path to the logfile in case of errors
+            ncores (int): number of threads used by SNAP's gpt
+            tags (dict): stage, product etc. of the metrics record
+
+        Returns:
+            int: the return code of gpt
+        '''
+
+        self.write(graph_file)
+        command = '{} \'{}\' -x -q {}'.format(
+            h.gpt_path(), graph_file, 2 * ncores)
+
+        return h.run_command(command, logfile, tags=tags)
+
+
+def terrain_correction_parameters(resolution, dem_dict, source_bands=None):
+    '''Returns the Terrain-Correction parameters of the OST graphs
+
+    Args:
+        resolution (int): the resolution of the output product in meters
+        dem_dict (dict): the dem parameters of the ARD definition
+        source_bands (str): the bands to geocode (default: all)
+
+    Returns:
+        dict: the parameters of SNAP's Terrain-Correction operator
+    '''
+
+    return dict(
+        sourceBands=source_bands,
+        demName=dem_dict['dem name'],
+        externalDEMFile=dem_dict['dem file'],
+        externalDEMNoDataValue=dem_dict['dem nodata'],
+        externalDEMApplyEGM=True,
+        demResamplingMethod=dem_dict['dem resampling'],
+        imgResamplingMethod=dem_dict['image resampling'],
+        pixelSpacingInMeter=resolution,
+        pixelSpacingInDegree=0.0,
+        mapProjection=WGS84,
+        alignToStandardGrid=False,
+        nodataValueAtSea=False,
+        saveSelectedSourceBand=True,
+        applyRadiometricNormalization=False,
+    )
+
+
+def dem_parameters(dem_dict):
+    '''Returns the DEM parameters of operators such as Terrain-Flattening
+
+    Args:
+        dem_dict (dict): the dem parameters of the ARD definition
+
+    Returns:
+        dict: demName, demResamplingMethod, externalDEMFile and
+              externalDEMNoDataValue
+    '''
+
+    return dict(demName=dem_dict['dem name'],
+                demResamplingMethod=dem_dict['dem resampling'],
+                externalDEMFile=dem_dict['dem file'],
+                externalDEMNoDataValue=dem_dict['dem nodata'])
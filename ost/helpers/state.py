@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+'''
+This module provides a persistent store for the state of processing tasks.
+
+Each task (e.g. the ARD processing of one acquisition) is recorded in a
+SQLite database with its status, the number of attempts, the duration of
+the last attempt, the class of its last error and its output paths.
+This allows to retry only the failed tasks with a limit per task, and to
+query the progress of a project without scanning the processing directory
+for .processed files.
+
+Task ids follow the ones of the task manifest (see ost.helpers.manifest),
+e.g. 'ard.117.20180101' for the ARD of track 117 acquired at 2018-01-01.
+'''
+
+import os
+import json
+import time
+import sqlite3
+
+# the status a task can have
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+
+def task_id(key):
+    '''Converts the key of a TaskGraph task into a task id
+
+    Args:
+        key: a string or a tuple, e.g. ('ard', '117', '20180101')
+
+    Returns:
+        str: the dot separated task id, e.g. 'ard.117.20180101'
+    '''
+
+    if isinstance(key, tuple):
+        return '.'.join(str(part) for part in key)
+
+    return str(key)
+
+
+class TaskStore():
+    '''A SQLite based record of the processing tasks of a project
+
+    Args:
+        db_file (str): path to the SQLite database (created if not existent)
+    '''
+
+    def __init__(self, db_file):
+
+        self.db_file = os.path.abspath(db_file)
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tasks ('
+                ' id TEXT PRIMARY KEY,'
+                ' stage TEXT,'
+                ' status TEXT NOT NULL,'
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' return_code INTEGER,'
+                ' error TEXT,'
+                ' duration REAL,'
+                ' outputs TEXT,'
+                ' updated REAL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS tasks_status'
+                ' ON tasks (stage, status)')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=60)
+
+    def start(self, task_id, stage=None):
+        '''Marks a task as running and counts the attempt
+
+        Args:
+            task_id (str): the id of the task
+            stage (str): the processing stage of the task
+        '''
+
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO tasks (id, stage, status, attempts, updated)'
+                ' VALUES (?, ?, ?, 1, ?)'
+                ' ON CONFLICT(id) DO UPDATE SET status = excluded.status,'
+                ' attempts = attempts + 1, updated = excluded.updated',
+                (task_id, stage, RUNNING, time.time()))
+
+    def finish(self, task_id, return_code, duration=None, error=None,
+               outputs=None, stage=None):
+        '''Records the result of a task
+
+        Args:
+            task_id (str): the id of the task
+            return_code (int): the return code of the task (0 is success)
+            duration (float): the duration of the attempt in seconds
+            error (str): the class of the error, if an exception was raised
+            outputs (list): the paths of the products of the task
+            stage (str): the processing stage of the task
+        '''
+
+        status = DONE if return_code == 0 else FAILED
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO tasks (id, stage, status, attempts, return_code,'
+                ' error, duration, outputs, updated)'
+                ' VALUES (?, ?, ?, 0, ?, ?, ?, ?, ?)'
+                ' ON CONFLICT(id) DO UPDATE SET status = excluded.status,'
+                ' return_code = excluded.return_code,'
+                ' error = excluded.error, duration = excluded.duration,'
+                ' outputs = excluded.outputs, updated = excluded.updated',
+                (task_id, stage, status, return_code, error, duration,
+                 json.dumps(list(outputs or [])), time.time()))
+
+    def get(self, task_id):
+        '''Returns the record of a task
+
+        Args:
+            task_id (str): the id of the task
+
+        Returns:
+            dict: the record of the task (None if unknown)
+        '''
+
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute(
+                'SELECT * FROM tasks WHERE id = ?', (task_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        record = dict(row)
+        record['outputs'] = json.loads(record['outputs'] or '[]')
+        return record
+
+    def status(self, task_id):
+        '''Returns the status of a task (None if unknown)'''
+
+        record = self.get(task_id)
+        return record['status'] if record else None
+
+    def attempts(self, task_id):
+        '''Returns the number of attempts of a task'''
+
+        record = self.get(task_id)
+        return record['attempts'] if record else 0
+
+    def ids(self, status=None, stage=None):
+        '''Returns the ids of the tasks with the given status and stage
+
+        Args:
+            status (str): one of pending, running, done or failed (optional)
+            stage (str): the processing stage (optional)
+
+        Returns:
+            set: the task ids
+        '''
+
+        query, params = 'SELECT id FROM tasks WHERE 1', []
+        if status is not None:
+            query += ' AND status = ?'
+            params.append(status)
+        if stage is not None:
+            query += ' AND stage = ?'
+            params.append(stage)
+
+        with self._connect() as connection:
+            return set(row[0] for row in connection.execute(query, params))
+
+    def count(self, status=None, stage=None):
+        '''Returns the number of tasks with the given status and stage'''
+
+        return len(self.ids(status, stage))
+
+    def summary(self, stage=None):
+        '''Returns the number of tasks per status
+
+        Args:
+            stage (str): the processing stage (optional)
+
+        Returns:
+            dict: status as key, number of tasks as value
+        '''
+
+        query, params = 'SELECT status, COUNT(*) FROM tasks', []
+        if stage is not None:
+            query += ' WHERE stage = ?'
+            params.append(stage)
+
+        with self._connect() as connection:
+            return dict(connection.execute(
+                query + ' GROUP BY status', params).fetchall())
+
+    def reset(self, status=FAILED, stage=None):
+        '''Resets the attempts of tasks, so that they are retried again
+
+        Args:
+            status (str): the status of the tasks to reset
+            stage (str): the processing stage (optional)
+        '''
+
+        query, params = ('UPDATE tasks SET status = ?, attempts = 0'
+                         ' WHERE status = ?', [PENDING, status])
+        if stage is not None:
+            query += ' AND stage = ?'
+            params.append(stage)
+
+        with self._connect() as connection:
+            connection.execute(query, params)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+'''
+This module writes a timeline of a processing run in Chrome's trace format.
+
+If the OST_TRACE_FILE environment variable is set, spans for search,
+download, every external command (import, calibration, terrain correction,
+stacking, mosaicking, ...), timescans and scheduled tasks are written to
+that file. Every process, including the workers of a pool, appends to the
+same file, which uses the JSON array format of the trace event
+specification. It can be opened directly in https://ui.perfetto.dev or
+chrome://tracing, where each process is shown as a row, so that
+concurrency, queueing and stragglers become visible.
+
+The trace files of several machines (see worker mode) are combined by
+merge().
+'''
+
+import os
+import json
+import time
+import socket
+import functools
+import threading
+from contextlib import contextmanager
+
+TRACE_ENV = 'OST_TRACE_FILE'
+
+# the process for which the process name has been written
+_NAMED_PID = None
+
+
+def activate(trace_file):
+    '''Starts the tracing for this and all child processes
+
+    Args:
+        trace_file (str): path to the trace file (appended to)
+    '''
+
+    trace_file = os.path.abspath(trace_file)
+    os.makedirs(os.path.dirname(trace_file), exist_ok=True)
+
+    # the opening bracket of the JSON array format
+    try:
+        fd = os.open(trace_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        pass
+    else:
+        os.write(fd, b'[\n')
+        os.close(fd)
+
+    os.environ[TRACE_ENV] = trace_file
+
+
+def deactivate():
+    '''Stops the tracing'''
+
+    os.environ.pop(TRACE_ENV, None)
+
+
+def enabled():
+    return bool(os.environ.get(TRACE_ENV))
+
+
+def _write(events):
+    '''Appends events to the trace file in a single write'''
+
+    data = ''.join('{},\n'.format(json.dumps(event)) for event in events)
+
+    fd = os.open(os.environ[TRACE_ENV],
+                 os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, data.encode())
+    finally:
+        os.close(fd)
+
+
+def complete(name, cat, start, duration, **args):
+    '''Writes a finished span
+
+    Args:
+        name (str): the name of the span, e.g. calibration
+        cat (str): the category of the span, e.g. gpt
+        start (float): the start time in seconds since the epoch
+        duration (float): the duration in seconds
+        args: additional information shown with the span
+    '''
+
+    global _NAMED_PID
+
+    if not enabled():
+        return
+
+    pid, host = os.getpid(), socket.gethostname()
+    events = []
+
+    # name the row of this process once
+    if _NAMED_PID != pid:
+        _NAMED_PID = pid
+        events.append(dict(name='process_name', ph='M', pid=pid, tid=0,
+                           args=dict(name='{}:{}'.format(host, pid),
+                                     host=host)))
+
+    events.append(dict(name=name, cat=cat, ph='X', pid=pid,
+                       tid=threading.get_ident() % 2 ** 31,
+                       ts=round(start * 1e6), dur=round(duration * 1e6),
+                       args=dict(args, host=host)))
+    _write(events)
+
+
+def counter(name, value):
+    '''Writes the value of a counter, e.g. the progress of a command
+
+    Args:
+        name (str): the name of the counter track
+        value (float): the current value
+    '''
+
+    if not enabled():
+        return
+
+    _write([dict(name=name, ph='C', pid=os.getpid(),
+                 ts=round(time.time() * 1e6), args=dict(value=value))])
+
+
+@contextmanager
+def span(name, cat='ost', **args):
+    '''Traces the enclosed block
+
+    Example:
+        with trace.span('download', 'download', product=product):
+            ...
+    '''
+
+    if not enabled():
+        yield
+        return
+
+    start = time.time()
+    try:
+        yield
+    finally:
+        complete(name, cat, start, time.time() - start, **args)
+
+
+def traced(name, cat='ost', label=None):
+    '''Decorator tracing every call of a function
+
+    Args:
+        name (str): the name of the spans
+        cat (str): the category of the spans
+        label: a function returning a label from the function's arguments
+    '''
+
+    def decorator(function):
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+
+            if not enabled():
+                return function(*args, **kwargs)
+
+            info = {}
+            if label is not None:
+                try:
+                    info['label'] = str(label(*args, **kwargs))
+                except Exception:
+                    pass
+
+            with span(name, cat, **info):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def load(trace_file):
+    '''Loads the events of a trace file
+
+    Args:
+        trace_file (str): path to a trace file written by this module
+
+    Returns:
+        list: the trace events
+    '''
+
+    with open(trace_file, 'r') as file:
+        content = file.read().strip()
+
+    # the array is neither closed nor free of a trailing comma
+    content = content.lstrip('[').rstrip(']').strip().rstrip(',')
+    return json.loads('[{}]'.format(content))
+
+
+def merge(trace_files, outfile):
+    '''Combines the trace files of several machines
+
+    Since process ids are only unique per machine, every (host, pid) pair
+    gets a new id. Counter events carry no host (all their arguments are
+    plotted), they take the host of the other events of their process.
+
+    Args:
+        trace_files (list): paths of the trace files
+        outfile (str): path of the combined trace (JSON object format)
+    '''
+
+    pids, events = {}, []
+    for trace_file in trace_files:
+        file_events = load(trace_file)
+        hosts = dict((event['pid'], event['args']['host'])
+                     for event in file_events
+                     if event.get('args', {}).get('host'))
+
+        for event in file_events:
+            key = (event.get('args', {}).get('host') or
+                   hosts.get(event['pid']), event['pid'])
+            event['pid'] = pids.setdefault(key, len(pids) + 1)
+            events.append(event)
+
+    with open(outfile, 'w') as file:
+        json.dump(dict(traceEvents=events, displayTimeUnit='ms'), file)
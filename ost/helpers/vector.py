@@ -5,10 +5,13 @@ from functools import partial
 
 import ogr
 import pyproj
+import numpy as np
 import geopandas as gpd
 
 from osgeo import osr
 from shapely.ops import transform
+from shapely.prepared import prep
+from shapely.strtree import STRtree
 from shapely.wkt import loads
 from shapely.geometry import Point, Polygon, mapping, shape
 from fiona import collection
@@ -305,6 +308,82 @@ def wkt_to_shp(wkt, outfile):
     gdf.to_file(outfile)
 
 
+def intersects_mask(geometries, geom):
+    '''Boolean mask of the geometries that intersect a single geometry
+
+    The candidates are pre-selected by their bounding boxes through an
+    STRtree, and only those are tested against a prepared version of
+    the geometry, so that large sets of footprints (e.g. bursts) can be
+    filtered against complex AOIs without a full spatial join.
+
+    Args:
+        geometries (GeoSeries): the geometries to test
+        geom (shapely geometry): the geometry to test against (e.g. an AOI)
+
+    Returns:
+        list: a boolean value per geometry, in the order of the input
+
+    '''
+
+    geoms = list(geometries)
+    mask = [False] * len(geoms)
+    if not geoms:
+        return mask
+
+    tree = STRtree(geoms)
+    hits = tree.query(geom)
+
+    # shapely < 2.0 returns the geometries, not their positions
+    if len(hits) and not isinstance(hits[0], (int, np.integer)):
+        position = {id(candidate): i for i, candidate in enumerate(geoms)}
+        hits = [position[id(candidate)] for candidate in hits]
+
+    prepared_geom = prep(geom)
+    for i in hits:
+        if prepared_geom.intersects(geoms[i]):
+            mask[i] = True
+
+    return mask
+
+
+def equal_area_proj4(geom):
+    '''Proj4 string of an equal-area projection centred on a geometry
+
+    Args:
+        geom (shapely geometry): a geometry in Lat/Lon (WGS84)
+
+    Returns:
+        str: proj4 string of a Lambert Azimuthal Equal Area projection
+             centred on the geometry's centroid
+
+    '''
+
+    centroid = geom.centroid
+    return ('+proj=laea +lat_0={} +lon_0={} +x_0=0 +y_0=0 +datum=WGS84'
+            ' +units=m +no_defs'.format(centroid.y, centroid.x))
+
+
+def to_equal_area(gdf, proj4):
+    '''Reprojects a GeoDataFrame for area calculations
+
+    GeoDataFrames without a crs are assumed to be in Lat/Lon (WGS84).
+
+    Args:
+        gdf (GeoDataFrame): the GeoDataFrame to reproject
+        proj4 (str): the target projection, e.g. from equal_area_proj4
+
+    Returns:
+        GeoDataFrame: the reprojected GeoDataFrame
+
+    '''
+
+    if not gdf.crs:
+        gdf = gdf.copy()
+        gdf.crs = {'init': 'epsg:4326', 'no_defs': True}
+
+    return gdf.to_crs(proj4)
+
+
 def gdf_to_json_geometry(gdf):
     """Function to parse features from GeoDataFrame in such a manner 
        that rasterio wants them"""
@@ -4,9 +4,11 @@ from os.path import join as opj
 import numpy as np
 import rasterio
 from ost.helpers import vector as vec
-from ost.helpers import helpers as h
+from ost.helpers import helpers as h, trace
 
 
+@trace.traced('mosaic', 'mosaic',
+              label=lambda filelist, outfile, *args, **kwargs: outfile)
 def mosaic(filelist, outfile, temp_dir, cut_to_aoi=False):
 
     check_file = opj(
@@ -37,7 +39,9 @@ def mosaic(filelist, outfile, temp_dir, cut_to_aoi=False):
                                              tempfile, dtype)
     )
 
-    return_code = h.run_command(cmd, logfile)
+    return_code = h.run_command(
+        cmd, logfile,
+        tags=dict(stage='mosaic', product=os.path.basename(outfile)[:-4]))
     if return_code != 0:
         if os.path.isfile(tempfile):
             os.remove(tempfile)
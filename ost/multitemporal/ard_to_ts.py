@@ -9,7 +9,7 @@ import datetime
 
 import gdal
 
-from ost.helpers import raster as ras, helpers as h
+from ost.helpers import raster as ras, helpers as h, trace
 
 def create_stack(filelist, out_stack, logfile,
                  polarisation=None, pattern=None):
@@ -74,6 +74,9 @@ def mt_speckle_filter(in_stack, out_stack, logfile):
     return return_code
 
   
+@trace.traced('timeseries', 'timeseries',
+              label=lambda list_of_files, processing_dir, temp_dir, burst,
+              proc_file, product, pol: '{}.{}.{}'.format(burst, product, pol))
 def ard_to_ts(list_of_files, processing_dir, temp_dir, 
               burst, proc_file, product, pol):
 
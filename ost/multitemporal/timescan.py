@@ -13,6 +13,7 @@ from scipy import stats
 
 from ost.helpers import raster as ras
 from ost.helpers import helpers as h
+from ost.helpers import trace
 
 
 def remove_outliers(arrayin, stddev=3, z_threshold=None):
@@ -130,6 +131,8 @@ def nan_percentile(arr, q):
     return result
 
 
+@trace.traced('timescan', 'timescan',
+              label=lambda stack, out_prefix, *args, **kwargs: out_prefix)
 def mt_metrics(stack, out_prefix, metrics, rescale_to_datatype=False,
                to_power=False, outlier_removal=False, datelist=None):
 
@@ -5,15 +5,20 @@
 
 import os
 from os.path import join as opj
-import imp
 import glob
 import json
+import shutil
+import tempfile
 import itertools
 
 import gdal
 import geopandas as gpd
 
-from ost.helpers import scihub, vector as vec 
+from ost.helpers import scihub, vector as vec, helpers as h
+from ost.helpers.scheduler import TaskGraph
+from ost.helpers.resources import ResourceManager
+from ost.helpers.manifest import Manifest
+from ost.helpers import state
 from ost.s1 import burst_to_ard
 from ost import Sentinel1_Scene as S1Scene
 from ost.helpers import raster as ras
@@ -23,6 +28,11 @@ from ost.multitemporal import ard_to_ts
 from ost.multitemporal import timescan
 from ost.mosaic import mosaic
 
+# the multi-temporal products of the burst processing
+PRODUCT_LIST = ['bs.HH', 'bs.VV', 'bs.HV', 'bs.VH',
+                'coh.VV', 'coh.VH', 'coh.HH', 'coh.HV',
+                'pol.Entropy', 'pol.Anisotropy', 'pol.Alpha']
+
 
 def burst_inventory(inventory_df, outfile, download_dir=os.getenv('HOME'),
                     data_mount='/eodata', uname=None, pword=None):
@@ -122,33 +132,30 @@ def refine_burst_inventory(aoi, burst_gdf, outfile, coverages=None):
 
     '''
 
-    # turn aoi into a geodataframe
-    aoi_gdf = gpd.GeoDataFrame(vec.wkt_to_gdf(aoi).buffer(0.05))
-    aoi_gdf.columns = ['geometry']
+    # turn aoi into a single (buffered) geometry
+    aoi_geom = vec.wkt_to_gdf(aoi).buffer(0.05).unary_union
     # get columns of input dataframe for later return function
     cols = burst_gdf.columns
 
     # 1) get only intersecting footprints (double, since we do this before)
-    burst_gdf = gpd.sjoin(burst_gdf, aoi_gdf, how='inner', op='intersects')
+    burst_gdf = burst_gdf[vec.intersects_mask(burst_gdf.geometry, aoi_geom)]
 
-    # if aoi  gdf has an id field we need to rename the changed id_left field
-    if 'id_left' in burst_gdf.columns.tolist():
-        # rename id_left to id
-        burst_gdf.columns = (['id' if x == 'id_left' else x
-                              for x in burst_gdf.columns.tolist()])
-    
     # remove duplicates
-    burst_gdf.drop_duplicates(['SceneID', 'Date', 'bid'], inplace=True)
-    
+    burst_gdf = burst_gdf.drop_duplicates(['SceneID', 'Date', 'bid'])
+
     # check if number of bursts align with number of coverages
     if coverages:
-        for burst in burst_gdf.bid.unique():
-            if len(burst_gdf[burst_gdf.bid == burst]) != coverages:
-                print(' INFO. Removing burst {} because of'
-                      ' unsuffcient coverage.'.format(burst))
-                burst_gdf.drop(burst_gdf[burst_gdf.bid == burst].index, 
-                               inplace=True)
-    
+        nr_of_bursts = burst_gdf.groupby('bid')['bid'].transform('size')
+        complete = nr_of_bursts == coverages
+
+        for burst in burst_gdf.bid[~complete].unique():
+            print(' INFO. Removing burst {} because of'
+                  ' unsuffcient coverage.'.format(burst))
+
+        burst_gdf = burst_gdf[complete]
+
+    burst_gdf = burst_gdf.copy()
+
     # save file to out
     burst_gdf['Date'] = burst_gdf['Date'].astype(str)
     burst_gdf['BurstNr'] = burst_gdf['BurstNr'].astype(str)
@@ -158,18 +165,123 @@ def refine_burst_inventory(aoi, burst_gdf, outfile, coverages=None):
     return burst_gdf[cols]
 
 
-def burst_to_ard_batch(burst_inventory, download_dir, processing_dir,
-                       temp_dir, proc_file, data_mount='/eodata', 
-                       exec_file=None):
-    '''Handles the batch processing of a OST complinat burst inventory file
+def _burst_import(infile, out_prefix, logfile, swath, burst_nr, proc_file,
+                  ncores=os.cpu_count(), out_dirs=()):
+    '''Imports a single burst, unless it has already been imported
+
+    The import is also skipped if all ARD products depending on it have
+    been processed, e.g. by another worker in the meantime.
 
     Args:
-        burst_inventory (GeoDataFrame):
-        download_dir (str):
-        processing_dir (str):
-        temp_dir (str):
-        ard_parameters (dict):
+        infile (str): path to the full SLC scene
+        out_prefix (str): prefix of the imported BEAM-Dimap product
+        logfile (str): file where SNAP's STDOUT/STDERR is written to
+        swath (str): subswath
+        burst_nr (int): index number of the burst within the subswath
+        proc_file (str): path to the OST processing parameters file
+        ncores (int): number of threads used by SNAP's gpt
+        out_dirs (list): the output directories of the ARD products
+                         depending on the import
+
+    Returns:
+        return_code (int): 0 if the burst has been imported
+    '''
+
+    if os.path.exists('{}.dim'.format(out_prefix)):
+        return 0
+
+    if out_dirs and all(os.path.isfile(opj(out_dir, '.processed'))
+                        for out_dir in out_dirs):
+        return 0
+
+    with open(proc_file, 'r') as ard_file:
+        ard = json.load(ard_file)['processing parameters']['single ARD']
+        polars = ard['polarisation'].replace(' ', '')
+
+    return burst_to_ard._import(infile, out_prefix, logfile, swath,
+                                burst_nr, polars, ncores)
+
+
+def _burst_to_ard_task(temp_dir, **kwargs):
+    '''Runs burst_to_ard within its own scratch directory
 
+    Args:
+        temp_dir (str): directory in which the scratch directory is created
+        kwargs: keyword arguments passed on to burst_to_ard.burst_to_ard
+
+    Returns:
+        return_code (int): 0 if the ARD product has been created
+    '''
+
+    # e.g. processed by another worker in the meantime
+    if os.path.isfile(opj(kwargs['out_dir'], '.processed')):
+        return 0
+
+    scratch_dir = tempfile.mkdtemp(
+        prefix='{}_'.format(kwargs['master_burst_id']), dir=temp_dir)
+
+    try:
+        return burst_to_ard.burst_to_ard(temp_dir=scratch_dir, **kwargs)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _burst_batch_task(temp_dir, bursts, proc_file, ncores=os.cpu_count()):
+    '''Runs the fused ARD graph of several bursts in a scratch directory
+
+    Args:
+        temp_dir (str): directory in which the scratch directory is created
+        bursts (list): the keyword arguments of burst_to_ard per burst
+        proc_file (str): path to the OST processing parameters file
+        ncores (int): number of threads used by SNAP's gpt
+
+    Returns:
+        return_code (int): 0 if the ARD products of all bursts have been
+                           created
+    '''
+
+    scratch_dir = tempfile.mkdtemp(
+        prefix='{}_'.format(bursts[0]['master_burst_id']), dir=temp_dir)
+
+    try:
+        return burst_to_ard.bursts_to_ard_fused(bursts, proc_file,
+                                                scratch_dir, ncores)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def _burst_processing_graph(burst_inventory, download_dir, processing_dir,
+                            temp_dir, proc_file, data_mount='/eodata',
+                            ncores=os.cpu_count(), store=None, batch=None):
+    '''Expresses the burst batch processing as a task graph
+
+    There is one import task per burst and date, and one ARD task per burst
+    and date. The ARD task (calibration, speckle filtering, terrain
+    correction, H-A-Alpha) depends on the import of its date and, for the
+    coherence, on the import of the next date. Thereby every burst is
+    imported only once, and the import is deleted after its last consumer
+    finished.
+
+    With a fused graph (see burst_to_ard.bursts_to_ard_fused), the ARD task
+    imports the bursts itself. Bursts of the same master and slave scene
+    are then processed in batches of up to 'burst batch' bursts, with a
+    single gpt call per batch.
+
+    Args:
+        burst_inventory (GeoDataFrame): an OST burst inventory
+        download_dir (str): the download directory of the SLC scenes
+        processing_dir (str): the directory for the ARD products
+        temp_dir (str): the directory for the intermediate products
+        proc_file (str): path to the OST processing parameters file
+        data_mount (str): mount point of a data archive
+        ncores (int): number of threads used by SNAP's gpt per task
+        store (TaskStore): bursts recorded as done in the store are left out
+        batch (int): the number of bursts of a scene processed by a single
+                     fused graph (default: 'burst batch' of the ARD
+                     parameters)
+
+    Returns:
+        TaskGraph: the graph of all bursts not yet processed
     '''
 
     # load ard parameters
@@ -177,227 +289,348 @@ def burst_to_ard_batch(burst_inventory, download_dir, processing_dir,
         ard_params = json.load(ard_file)['processing parameters']
         ard = ard_params['single ARD']
 
-    for burst in burst_inventory.bid.unique():      # ***
+    # a fused graph imports its bursts itself, possibly several at once
+    fused = ard.get('fused graph', False)
+    if batch is None:
+        batch = ard.get('burst batch', 1) if fused else 1
+    batches = {}
 
-        # create a list of dates over which we loop
-        dates = burst_inventory.Date[
-                burst_inventory.bid == burst].sort_values().tolist()
-
-        # loop through dates
-        for idx, date in enumerate(dates):      # ******
-
-            print(' INFO: Entering burst {} at date {}.'.format(burst, date))
-            # get master date
-            master_date = dates[idx]
-            # we set this for handling the end of the time-series
-            end = False
-            coherence = ard['coherence']
-
-            # try to get slave date
-            try:
-                slave_date = dates[idx + 1]    # last burst in timeseries?
-            except IndexError:
-                end = True
-                print(' INFO: Reached the end of the time-series.'
-                      ' Therefore no coherence calculation is done.')
-            else:
-                end = False
+    import_dir = opj(temp_dir, 'imports')
+    os.makedirs(import_dir, exist_ok=True)
 
-            # read master burst
-            master_burst = burst_inventory[
-                (burst_inventory.Date == master_date) &
-                (burst_inventory.bid == burst)]
+    def _delete_import(key):
+        prefix = opj(import_dir, '{}_{}_import'.format(key[2], key[1]))
+        if os.path.exists('{}.dim'.format(prefix)):
+            h.delete_dimap(prefix)
 
-            master_scene = S1Scene(master_burst.SceneID.values[0])
+    done = store.ids(state.DONE, 'ard') if store is not None else set()
 
-            # get path to file
-            master_file = master_scene.get_path(download_dir, data_mount)
-            # get subswath
-            subswath = master_burst.SwathID.values[0]
-            # get burst number in file
-            master_burst_nr = master_burst.BurstNr.values[0]
-            # create a fileId
-            master_id = '{}_{}'.format(master_date, master_burst.bid.values[0])
+    graph = TaskGraph()
+    for burst in burst_inventory.bid.unique():
+
+        burst_df = burst_inventory[
+            burst_inventory.bid == burst].sort_values('Date')
+        dates = burst_df.Date.tolist()
+
+        # the scenes, swath and burst numbers per date
+        burst_info = {}
+        for date, scene_id, swath, burst_nr in zip(
+                dates, burst_df.SceneID, burst_df.SwathID, burst_df.BurstNr):
+            burst_info[date] = dict(
+                file=S1Scene(scene_id).get_path(download_dir, data_mount),
+                date=date, swath=swath, burst_nr=burst_nr,
+                burst_id='{}_{}'.format(date, burst))
+
+        for idx, date in enumerate(dates):
 
             # create out folder
             out_dir = opj(processing_dir, burst, date)
             os.makedirs(out_dir, exist_ok=True)
 
             # check if already processed
+            if 'ard.{}.{}'.format(burst, date) in done:
+                print(' INFO: Burst {} from {} already processed'.format(
+                      burst, date))
+                continue
+
             if os.path.isfile(opj(out_dir, '.processed')):
                 print(' INFO: Burst {} from {} already processed'.format(
                       burst, date))
-            else:
-                
-                if end is True:
-                    coherence = False
-                    slave_file, slave_burst_nr, slave_id = None, None, None
-                else:
-                    # read slave burst
-                    slave_burst = burst_inventory[
-                            (burst_inventory.Date == slave_date) &
-                            (burst_inventory.bid == burst)]
-    
-                    slave_scene = S1Scene(slave_burst.SceneID.values[0])
-    
-                    # get path to slave file
-                    slave_file = slave_scene.get_path(download_dir,
-                                                      data_mount)
-    
-                    # burst number in slave file (subswath is same)
-                    slave_burst_nr = slave_burst.BurstNr.values[0]
-    
-                    # outfile name
-                    slave_id = '{}_{}'.format(slave_date,
-                                              slave_burst.bid.values[0])
-    
-                # just write command into a textfile
-                if exec_file:
-                    # remove older files in case they exist
-                    if os.path.isfile(exec_file):
-                        os.remove(exec_file)
-                    # construct command arguments
-                    args = ('-m {} -ms {} -mn {} -mi {} -p {} -o {} -t {} '
-                            '-s {} -sn {} -si {} -c {} -r {}').format(
-                                  master_file, subswath, master_burst_nr, master_id, 
-                                  proc_file, out_dir, temp_dir, 
-                                  slave_file, slave_burst_nr, slave_id, 
-                                  coherence, False)                                
-                    
-                    # get path to graph
-                    rootpath = imp.find_module('ost')[1]
-                    python_exe = opj(rootpath, 's1', 'burst_to_ard.py')
-                    with open(exec_file, 'a') as exe:
-                        exe.write('{} {} \n'.format(python_exe, args))
-                
-                # run the command      
-                else:
-                    # run routine
-                    burst_to_ard.burst_to_ard(
-                         master_file=master_file,
-                         swath=subswath,
-                         master_burst_nr=master_burst_nr,
-                         master_burst_id=master_id,
-                         proc_file=proc_file,
-                         out_dir=out_dir,
-                         temp_dir=temp_dir,
-                         slave_file=slave_file,
-                         slave_burst_nr=slave_burst_nr,
-                         slave_burst_id=slave_id,
-                         coherence=coherence,
-                         remove_slave_import=False)
-            
-            
-def burst_ards_to_timeseries(burst_inventory, processing_dir, temp_dir,
-                             proc_file, exec_file=None):
+                # take over bursts processed without a store
+                if store is not None:
+                    store.finish('ard.{}.{}'.format(burst, date), 0,
+                                 outputs=[out_dir], stage='ard')
+                continue
+
+            master = burst_info[date]
+            coherence = ard['coherence'] and idx + 1 < len(dates)
+            slave = burst_info[dates[idx + 1]] if coherence else None
+
+            if fused and batch > 1:
+                batches.setdefault(
+                    (master['file'], slave['file'] if slave else None), []
+                ).append(dict(
+                    master_file=master['file'], swath=master['swath'],
+                    master_burst_nr=master['burst_nr'],
+                    master_burst_id=master['burst_id'], out_dir=out_dir,
+                    slave_file=slave['file'] if slave else None,
+                    slave_burst_nr=slave['burst_nr'] if slave else None,
+                    slave_burst_id=slave['burst_id'] if slave else None,
+                    coherence=coherence, burst=burst, date=date))
+                continue
+
+            depends = []
+            for info in [master, slave]:
+                if info is None or fused:
+                    continue
+                key = ('import', burst, info['date'])
+                if key not in graph.tasks:
+                    graph.add(
+                        key, _burst_import,
+                        args=(info['file'],
+                              opj(import_dir,
+                                  '{}_import'.format(info['burst_id'])),
+                              opj(processing_dir, burst, key[2],
+                                  '{}_import.err_log'.format(
+                                      info['burst_id'])),
+                              info['swath'], info['burst_nr'], proc_file,
+                              ncores),
+                        kwargs=dict(out_dirs=[]),
+                        cleanup=_delete_import,
+                        lock='burst.{}'.format(burst))
+
+                # the ARD products using the import
+                graph.tasks[key]['kwargs']['out_dirs'].append(out_dir)
+                depends.append(key)
+
+            graph.add(
+                ('ard', burst, date), _burst_to_ard_task,
+                kwargs=dict(temp_dir=temp_dir,
+                            master_file=master['file'],
+                            swath=master['swath'],
+                            master_burst_nr=master['burst_nr'],
+                            master_burst_id=master['burst_id'],
+                            proc_file=proc_file,
+                            out_dir=out_dir,
+                            slave_file=slave['file'] if slave else None,
+                            slave_burst_nr=slave['burst_nr'] if slave else None,
+                            slave_burst_id=slave['burst_id'] if slave else None,
+                            coherence=coherence,
+                            import_dir=import_dir,
+                            keep_imports=True,
+                            ncores=ncores),
+                depends=depends,
+                outputs=[out_dir],
+                lock='burst.{}'.format(burst))
+
+    # the bursts of the same master and slave scene in batches
+    for bursts in batches.values():
+        for idx in range(0, len(bursts), batch):
+            chunk = bursts[idx:idx + batch]
+            key = ('ard', '+'.join(burst.pop('burst') for burst in chunk),
+                   chunk[0]['date'])
+            for burst in chunk:
+                burst.pop('date')
+
+            graph.add(key, _burst_batch_task,
+                      args=(temp_dir, chunk, proc_file, ncores),
+                      outputs=[burst['out_dir'] for burst in chunk],
+                      lock=state.task_id(key))
+
+    return graph
+
+
+def _delete_imports(import_dir):
+    '''Removes the directory of the burst imports after the ARD processing'''
+
+    shutil.rmtree(import_dir, ignore_errors=True)
+
+
+def burst_to_ard_batch(burst_inventory, download_dir, processing_dir,
+                       temp_dir, proc_file, data_mount='/eodata',
+                       exec_file=None, max_workers=1, store=None,
+                       max_attempts=1, lock_dir=None):
+    '''Handles the batch processing of a OST complinat burst inventory file
+
+    Unless an exec_file is given, the bursts are processed as a task graph
+    (see _burst_processing_graph), in which independent bursts and dates
+    are processed by up to max_workers concurrent jobs. Cores and memory
+    are shared between the jobs by a ResourceManager.
+
+    If an exec_file is given, the tasks of the graph are added to the task
+    manifest instead (see ost.helpers.manifest). The imports are then kept
+    in temp_dir until a final cleanup task removes them.
+
+    With a TaskStore, bursts recorded as done are skipped without looking
+    at the processing directory, and failed tasks are retried up to
+    max_attempts times.
+
+    With a lock_dir, several machines can process the same inventory on a
+    shared processing directory, each claiming all dates of single bursts.
+
+    Args:
+        burst_inventory (GeoDataFrame):
+        download_dir (str):
+        processing_dir (str):
+        temp_dir (str):
+        ard_parameters (dict):
+        exec_file (str): path to a task manifest to export to (optional)
+        max_workers (int): the number of tasks executed at once
+        store (TaskStore): a persistent record of the task states (optional)
+        max_attempts (int): the maximum number of attempts per task
+        lock_dir (str): the directory of the lock files (worker mode)
+
+    '''
+
+    if not exec_file:
+        manager = ResourceManager(max_workers)
+        graph = _burst_processing_graph(
+            burst_inventory, download_dir, processing_dir, temp_dir,
+            proc_file, data_mount, manager.allocation()['ncores'], store)
+        graph.run(manager.workers, resources=manager, store=store,
+                  max_attempts=max_attempts, lock_dir=lock_dir)
+        return
+
+    # one task per burst, so that the time-series can depend on them
+    graph = _burst_processing_graph(
+        burst_inventory, download_dir, processing_dir, temp_dir,
+        proc_file, data_mount, batch=1)
+
+    # the thread count is left to the machine executing the task
+    import_args = ['infile', 'out_prefix', 'logfile', 'swath', 'burst_nr',
+                   'proc_file']
+
+    manifest = Manifest(exec_file)
+    for key in graph.order:
+        task = graph.tasks[key]
+        depends = ['.'.join(dep) for dep in task['depends']]
+
+        if key[0] == 'import':
+            kwargs = dict(zip(import_args, task['args']), **task['kwargs'])
+        else:
+            kwargs = dict(task['kwargs'])
+            kwargs.pop('ncores', None)
+
+        manifest.add('.'.join(key), key[0], task['function'], kwargs,
+                     depends=depends)
+
+    if manifest.ids('ard'):
+        manifest.add('ard-cleanup', 'ard-cleanup', _delete_imports,
+                     dict(import_dir=opj(temp_dir, 'imports')),
+                     depends=manifest.ids('ard'))
+
+    manifest.write()
+
+
+def _burst_to_timeseries(processing_dir, temp_dir, burst, proc_file):
+    '''Creates the common extent, ls mask and time-series of a burst
+
+    Args:
+        processing_dir (str): the directory of the ARD products
+        temp_dir (str): the directory for intermediate products
+        burst (str): the burst id
+        proc_file (str): the OST processing parameter json file
+
+    Returns:
+        return_code (int): 0 if all time-series have been created
+    '''
 
     # load ard parameters
     with open(proc_file, 'r') as ard_file:
         ard_params = json.load(ard_file)['processing parameters']
         ard = ard_params['single ARD']
         ard_mt = ard_params['single ARD']
-        
-    # create extents
-    for burst in burst_inventory.bid.unique():      # ***
 
-        # get the burst directory
-        burst_dir = opj(processing_dir, burst)
-        
-        # get common burst extent
-        list_of_bursts = glob.glob(opj(burst_dir, '20*', '*data*', '*img'))
-        list_of_bursts = [x for x in list_of_bursts if 'layover' not in x]
-        extent = opj(burst_dir, '{}.extent.shp'.format(burst))
-        
-        if os.path.isfile(extent):
-            continue
-        
-        # placeholder for parallelisation
-        if exec_file:
-            if os.path.isfile(exec_file):
-                os.remove(exec_file)
-            print('create command')
-            continue
-        
+    # get the burst directory
+    burst_dir = opj(processing_dir, burst)
+
+    # get common burst extent
+    list_of_bursts = glob.glob(opj(burst_dir, '20*', '*data*', '*img'))
+    list_of_bursts = [x for x in list_of_bursts if 'layover' not in x]
+    extent = opj(burst_dir, '{}.extent.shp'.format(burst))
+
+    if not os.path.isfile(extent):
         print(' INFO: Creating common extent mask for burst {}'.format(burst))
         common_extent.mt_extent(list_of_bursts, extent, temp_dir, -0.0018)
-      
-    if ard['create ls mask'] or ard['apply ls mask']: 
-        
-        # create layover
-        for burst in burst_inventory.bid.unique():      # ***
-    
-            # get the burst directory
-            burst_dir = opj(processing_dir, burst)
-            
-            # get common burst extent
-            list_of_scenes = glob.glob(opj(burst_dir, '20*', '*data*', '*img'))
-            list_of_layover = [x for x in list_of_scenes if 'layover' in x]
-        
-            # layover/shadow mask
-            out_ls = opj(burst_dir, '{}.ls_mask.tif'.format(burst))
 
-            if os.path.isfile(out_ls):
-                continue
+    if ard['create ls mask'] or ard['apply ls mask']:
+
+        # get common burst extent
+        list_of_scenes = glob.glob(opj(burst_dir, '20*', '*data*', '*img'))
+        list_of_layover = [x for x in list_of_scenes if 'layover' in x]
+
+        # layover/shadow mask
+        out_ls = opj(burst_dir, '{}.ls_mask.tif'.format(burst))
 
+        if not os.path.isfile(out_ls):
             print(' INFO: Creating common Layover/Shadow mask'
                   ' for burst {}'.format(burst))
-            common_ls_mask.mt_layover(list_of_layover, out_ls, temp_dir, 
+            common_ls_mask.mt_layover(list_of_layover, out_ls, temp_dir,
                                       extent, ard_mt['apply ls mask'])
-        
+
     # create timeseries
-    for burst in burst_inventory.bid.unique():
-        
-        dict_of_product_types = {'bs': 'Gamma0', 'coh': 'coh', 'pol': 'pol'}
-        pols = ['VV', 'VH', 'HH', 'HV', 'Alpha', 'Entropy', 'Anisotropy']
-        
-        for pr, pol in itertools.product(dict_of_product_types.items(), pols):
+    dict_of_product_types = {'bs': 'Gamma0', 'coh': 'coh', 'pol': 'pol'}
+    pols = ['VV', 'VH', 'HH', 'HV', 'Alpha', 'Entropy', 'Anisotropy']
+
+    return_code = 0
+    for pr, pol in itertools.product(dict_of_product_types.items(), pols):
+
+        product = pr[0]
+        product_name = pr[1]
+
+        # take care of H-A-Alpha naming for file search
+        if pol in ['Alpha', 'Entropy', 'Anisotropy'] and product is 'pol':
+            product_name = '*'
+
+        # see if there is actually any imagery in thi polarisation
+        list_of_files = sorted(glob.glob(
+            opj(processing_dir, burst, '20*', '*data*', '{}*{}*img'
+            .format(product_name, pol))))
+
+        if not len(list_of_files) > 1:
+            continue
+
+        # create list of dims if polarisation is present
+        list_of_dims = sorted(glob.glob(
+            opj(processing_dir, burst, '20*', '*{}*dim'.format(product)
+            )))
+
+        # run processing
+        return_code = ard_to_ts.ard_to_ts(
+                        list_of_dims,
+                        processing_dir,
+                        temp_dir,
+                        burst,
+                        proc_file,
+                        product=product,
+                        pol=pol
+        ) or return_code
+
+    return return_code
+
+
+def burst_ards_to_timeseries(burst_inventory, processing_dir, temp_dir,
+                             proc_file, exec_file=None, store=None,
+                             max_attempts=1, lock_dir=None):
+
+    manifest = Manifest(exec_file) if exec_file else None
+    graph = TaskGraph()
+
+    for burst in burst_inventory.bid.unique():      # ***
+
+        if manifest is not None:
+            manifest.add('timeseries.{}'.format(burst), 'timeseries',
+                         _burst_to_timeseries,
+                         dict(processing_dir=processing_dir,
+                              temp_dir=temp_dir, burst=burst,
+                              proc_file=proc_file),
+                         depends=manifest.ids('ard.{}'.format(burst)))
+            continue
+
+        graph.add(('timeseries', burst), _burst_to_timeseries,
+                  args=(processing_dir, temp_dir, burst, proc_file),
+                  outputs=[opj(processing_dir, burst, 'Timeseries')],
+                  lock='timeseries.{}'.format(burst))
+
+    if manifest is not None:
+        manifest.write()
+    else:
+        graph.run(store=store, max_attempts=max_attempts, lock_dir=lock_dir)
+
 
-            product = pr[0]
-            product_name = pr[1]
-        
-            # take care of H-A-Alpha naming for file search
-            if pol in ['Alpha', 'Entropy', 'Anisotropy'] and product is 'pol':
-                product_name = '*'
-            
-            # see if there is actually any imagery in thi polarisation
-            list_of_files = sorted(glob.glob(
-                opj(processing_dir, burst, '20*', '*data*', '{}*{}*img'
-                .format(product_name, pol))))
-     
-            if not len(list_of_files) > 1:
-                continue
-            
-            # create list of dims if polarisation is present
-            list_of_dims = sorted(glob.glob(
-                opj(processing_dir, burst, '20*', '*{}*dim'.format(product)
-                ))) 
-            
-            # placeholder for parallelisation
-            if exec_file:
-                if os.path.isfile(exec_file):
-                    os.remove(exec_file)
-                
-                print('create command')
-                continue
-            
-            # run processing
-            ard_to_ts.ard_to_ts(
-                            list_of_dims, 
-                            processing_dir, 
-                            temp_dir, 
-                            burst, 
-                            proc_file, 
-                            product=product, 
-                            pol=pol
-            )
-            
 # --------------------
 # timescan part
 # --------------------
-def timeseries_to_timescan(burst_inventory, processing_dir, temp_dir, 
-                           proc_file, exec_file=None):
-    '''Function to create a timescan out of a OST timeseries.
+def _burst_to_timescan(processing_dir, burst, proc_file):
+    '''Creates the timescans of all products of a burst
 
+    Args:
+        processing_dir (str): the directory of the ARD products
+        burst (str): the burst id
+        proc_file (str): the OST processing parameter json file
+
+    Returns:
+        return_code (int): 0 if all timescans have been created
     '''
 
     # load ard parameters
@@ -406,177 +639,222 @@ def timeseries_to_timescan(burst_inventory, processing_dir, temp_dir,
         ard = ard_params['single ARD']
         ard_mt = ard_params['time-series ARD']
         ard_tscan = ard_params['time-scan ARD']
-    
-    
+
     # get the db scaling right
     to_db = ard['to db']
     if ard['to db'] or ard_mt['to db']:
         to_db = True
-    
-    # a products list
-    product_list = ['bs.HH', 'bs.VV', 'bs.HV', 'bs.VH',
-                    'coh.VV', 'coh.VH', 'coh.HH', 'coh.HV', 
-                    'pol.Entropy', 'pol.Anisotropy', 'pol.Alpha']
-    
+
     # get datatype right
     dtype_conversion = True if ard_mt['dtype output'] != 'float32' else False
-    
+
+    print(' INFO: Entering burst {}.'.format(burst))
+    # get burst directory
+    burst_dir = opj(processing_dir, burst)
+    # get timescan directory
+    timescan_dir = opj(burst_dir, 'Timescan')
+    os.makedirs(timescan_dir, exist_ok=True)
+
+    return_code = 0
+    for product in PRODUCT_LIST:
+
+        if os.path.isfile(
+            opj(timescan_dir, '.{}.processed'.format(product))):
+            print(' INFO: Timescans for burst {} already'
+                  ' processed.'.format(burst))
+            continue
+
+        # get respective timeseries
+        timeseries = opj(burst_dir,
+                         'Timeseries',
+                         'Timeseries.{}.vrt'.format(product))
+
+        if not os.path.isfile(timeseries):
+            continue
+
+        print(' INFO: Creating Timescans of {} for burst {}.'.format(product, burst))
+        # datelist for harmonics
+        scenelist = glob.glob(
+                opj(burst_dir, 'Timeseries', '*{}*tif'.format(product))
+        )
+
+        datelist = []
+        for layer in sorted(scenelist):
+            datelist.append(os.path.basename(layer).split('.')[1][:6])
+
+        # define timescan prefix
+        timescan_prefix = opj(timescan_dir, product)
+
+        # get rescaling and db right (backscatter vs. polarimetry)
+        if 'bs.' in timescan_prefix:    # backscatter
+            rescale = dtype_conversion
+            to_power = to_db
+        else:
+            to_power = False
+            rescale = False
+
+        # run command
+        return_code = timescan.mt_metrics(
+                timeseries,
+                timescan_prefix,
+                ard_tscan['metrics'],
+                rescale_to_datatype=rescale,
+                to_power=to_power,
+                outlier_removal=ard_tscan['remove outliers'],
+                datelist=datelist
+        ) or return_code
+
+    ras.create_tscan_vrt(timescan_dir, proc_file)
+
+    return return_code
+
+
+def timeseries_to_timescan(burst_inventory, processing_dir, temp_dir,
+                           proc_file, exec_file=None, store=None,
+                           max_attempts=1, lock_dir=None):
+    '''Function to create a timescan out of a OST timeseries.
+
+    '''
+
+    manifest = Manifest(exec_file) if exec_file else None
+    graph = TaskGraph()
+
     for burst in burst_inventory.bid.unique():   # ***
 
-        print(' INFO: Entering burst {}.'.format(burst))
-        # get burst directory
-        burst_dir = opj(processing_dir, burst)
-        # get timescan directory
-        timescan_dir = opj(burst_dir, 'Timescan')
-        os.makedirs(timescan_dir, exist_ok=True)
-    
-        for product in product_list:
-        
-            if os.path.isfile(
-                opj(timescan_dir, '.{}.processed'.format(product))):
-                print(' INFO: Timescans for burst {} already'
-                      ' processed.'.format(burst))
-            
-            # get respective timeseries
-            timeseries = opj(burst_dir, 
-                             'Timeseries',
-                             'Timeseries.{}.vrt'.format(product))
-            
-            if not os.path.isfile(timeseries):
-                continue
-            
-            print(' INFO: Creating Timescans of {} for burst {}.'.format(product, burst))
-            # datelist for harmonics
-            scenelist = glob.glob(
-                    opj(burst_dir, 'Timeseries', '*{}*tif'.format(product))
-            )
-            
-            datelist = []
-            for layer in sorted(scenelist):
-                datelist.append(os.path.basename(layer).split('.')[1][:6])
-    
-            # define timescan prefix
-            timescan_prefix = opj(timescan_dir, product)
+        if manifest is not None:
+            manifest.add('timescan.{}'.format(burst), 'timescan',
+                         _burst_to_timescan,
+                         dict(processing_dir=processing_dir, burst=burst,
+                              proc_file=proc_file),
+                         depends=manifest.ids('timeseries.{}'.format(burst)))
+            continue
 
-            # get rescaling and db right (backscatter vs. polarimetry)
-            if 'bs.' in timescan_prefix:    # backscatter
-                rescale = dtype_conversion
-                to_power = to_db                       
+        graph.add(('timescan', burst), _burst_to_timescan,
+                  args=(processing_dir, burst, proc_file),
+                  outputs=[opj(processing_dir, burst, 'Timescan')],
+                  lock='timescan.{}'.format(burst))
+
+    if manifest is not None:
+        manifest.write()
+    else:
+        graph.run(store=store, max_attempts=max_attempts, lock_dir=lock_dir)
+
+
+def _mosaic_timeseries_product(processing_dir, temp_dir, burst, product,
+                               cut_to_aoi=False):
+    '''Mosaics all time-series layers of one product
+
+    Args:
+        processing_dir (str): the directory of the ARD products
+        temp_dir (str): the directory for intermediate products
+        burst (str): a burst id used to count the time-series layers
+        product (str): the product (e.g. bs.VV or pol.Alpha)
+        cut_to_aoi (str): the WKT of the AOI to cut the mosaic to (optional)
+    '''
+
+    ts_dir = opj(processing_dir, 'Mosaic', 'Timeseries')
+    os.makedirs(ts_dir, exist_ok=True)
+
+    nr_of_ts = len(glob.glob(opj(
+            processing_dir,
+            burst,
+            'Timeseries',
+            '*.{}.tif'.format(product)))
+    )
+
+    if not nr_of_ts > 1:
+        return
+
+    outfiles = []
+    for i in range(1, nr_of_ts + 1):
+
+        filelist = glob.glob(opj(
+                processing_dir, '*', 'Timeseries', '{}.*{}.tif'
+                .format(i, product)))
+        filelist = [file for file in filelist if 'Mosaic' not in file]
+
+
+        print(' INFO: Creating timeseries mosaic {} for {}.'.format(
+                i, product))
+
+        # create dates for timseries naming
+        datelist = []
+        for file in filelist:
+            if '.coh.' in file:
+                datelist.append('{}_{}'.format(
+                    os.path.basename(file).split('.')[2],
+                    os.path.basename(file).split('.')[1]))
             else:
-                to_power = False
-                rescale = False
-            
-            # placeholder for parallelisation
-            if exec_file:
-                continue
-            
-            # run command
-            timescan.mt_metrics(
-                    timeseries, 
-                    timescan_prefix, 
-                    ard_tscan['metrics'],
-                    rescale_to_datatype=rescale,
-                    to_power=to_power,
-                    outlier_removal=ard_tscan['remove outliers'], 
-                    datelist=datelist
-            )
-        
-        if not exec_file:
-            ras.create_tscan_vrt(timescan_dir, proc_file)
+                datelist.append(os.path.basename(file).split('.')[1])
+
+        start, end = sorted(datelist)[0], sorted(datelist)[-1]
+        filelist = ' '.join(filelist)
+
+        if start == end:
+            outfile = opj(ts_dir, '{}.{}.{}.tif'.format(i, start, product))
+
+        else:
+            outfile = opj(ts_dir, '{}.{}-{}.{}.tif'.format(i, start, end, product))
+
+        check_file = opj(
+            os.path.dirname(outfile),
+            '.{}.processed'.format(os.path.basename(outfile)[:-4])
+        )
+
+        outfiles.append(outfile)
 
+        if os.path.isfile(check_file):
+            print( 'INFO: Mosaic layer {} already'
+                   ' processed.'.format(outfile))
+            continue
 
-def mosaic_timeseries(burst_inventory, processing_dir, temp_dir, 
+        # the command
+        print(' INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
+        mosaic.mosaic(filelist, outfile, temp_dir, cut_to_aoi)
+
+    # create final vrt
+    vrt_options = gdal.BuildVRTOptions(srcNodata=0, separate=True)
+    gdal.BuildVRT(opj(ts_dir, '{}.Timeseries.vrt'.format(product)),
+                  outfiles,
+                  options=vrt_options)
+
+
+def mosaic_timeseries(burst_inventory, processing_dir, temp_dir,
                       cut_to_aoi=False, exec_file=None):
 
     print(' ------------------------------------')
     print(' INFO: Mosaicking Time-series layers.')
     print(' ------------------------------------')
-    
+
     # create output folder
     ts_dir = opj(processing_dir, 'Mosaic', 'Timeseries')
     os.makedirs(ts_dir, exist_ok=True)
 
-    # a products list
-    product_list = ['bs.HH', 'bs.VV', 'bs.HV', 'bs.VH',
-                    'coh.VV', 'coh.VH', 'coh.HH', 'coh.HV', 
-                    'pol.Entropy', 'pol.Anisotropy', 'pol.Alpha']
-    
+    manifest = Manifest(exec_file) if exec_file else None
+    bursts = burst_inventory.bid.unique()
+
     # now we loop through each timestep and product
-    for product in product_list:  # ****
-        
-        bursts = burst_inventory.bid.unique()
-        nr_of_ts = len(glob.glob(opj(
-                processing_dir, 
-                bursts[0], 
-                'Timeseries', 
-                '*.{}.tif'.format(product)))
-        )
-    
-        if not nr_of_ts > 1:
+    for product in PRODUCT_LIST:  # ****
+
+        if manifest is not None:
+            manifest.add('mosaic-timeseries.{}'.format(product),
+                         'mosaic-timeseries', _mosaic_timeseries_product,
+                         dict(processing_dir=processing_dir,
+                              temp_dir=temp_dir, burst=bursts[0],
+                              product=product, cut_to_aoi=cut_to_aoi),
+                         depends=manifest.ids('timeseries'))
             continue
-        
-        outfiles = []
-        for i in range(1, nr_of_ts + 1):
-
-            filelist = glob.glob(opj(
-                    processing_dir, '*', 'Timeseries', '{}.*{}.tif'
-                    .format(i, product)))
-            filelist = [file for file in filelist if 'Mosaic' not in file]
-            
-
-            print(' INFO: Creating timeseries mosaic {} for {}.'.format(
-                    i, product))
-
-            # create dates for timseries naming
-            datelist = []
-            for file in filelist:
-                if '.coh.' in file:
-                    datelist.append('{}_{}'.format(
-                        os.path.basename(file).split('.')[2],
-                        os.path.basename(file).split('.')[1]))
-                else:
-                    datelist.append(os.path.basename(file).split('.')[1])
-                
-            start, end = sorted(datelist)[0], sorted(datelist)[-1]
-            filelist = ' '.join(filelist)
-            
-            if start == end:
-                outfile = opj(ts_dir, '{}.{}.{}.tif'.format(i, start, product))
-                
-            else:
-                outfile = opj(ts_dir, '{}.{}-{}.{}.tif'.format(i, start, end, product))
-            
-            check_file = opj(
-                os.path.dirname(outfile),
-                '.{}.processed'.format(os.path.basename(outfile)[:-4])
-            )
-            
-            outfiles.append(outfile)
-            
-            if os.path.isfile(check_file):
-                print( 'INFO: Mosaic layer {} already'
-                       ' processed.'.format(outfile))
-                continue
 
-            # the command
-            print(' INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
-            mosaic.mosaic(filelist, outfile, temp_dir, cut_to_aoi)
+        _mosaic_timeseries_product(processing_dir, temp_dir, bursts[0],
+                                   product, cut_to_aoi)
 
-        # create vrt
-        if exec_file:
-            continue
-        
-        # create final vrt
-        vrt_options = gdal.BuildVRTOptions(srcNodata=0, separate=True)
-        gdal.BuildVRT(opj(ts_dir, '{}.Timeseries.vrt'.format(product)),
-                      outfiles,
-                      options=vrt_options)
+    if manifest is not None:
+        manifest.write()
 
 
-def mosaic_timescan(burst_inventory, processing_dir, temp_dir, proc_file, 
-                    cut_to_aoi=False, exec_file=None):
+def _timescan_metrics(proc_file):
+    '''Returns the names of the timescan layers of the processing file'''
 
-    
     # load ard parameters
     with open(proc_file, 'r') as ard_file:
         ard_params = json.load(ard_file)['processing parameters']
@@ -585,50 +863,84 @@ def mosaic_timescan(burst_inventory, processing_dir, temp_dir, proc_file,
     if 'harmonics' in metrics:
         metrics.remove('harmonics')
         metrics.extend(['amplitude', 'phase', 'residuals'])
-        
+
     if 'percentiles' in metrics:
             metrics.remove('percentiles')
             metrics.extend(['p95', 'p5'])
-        
-    # a products list
-    product_list = ['bs.HH', 'bs.VV', 'bs.HV', 'bs.VH',
-                    'coh.VV', 'coh.VH', 'coh.HH', 'coh.HV', 
-                    'pol.Entropy', 'pol.Anisotropy', 'pol.Alpha']
-    
-    
+
+    return metrics
+
+
+def _mosaic_timescan_layer(processing_dir, temp_dir, product, metric,
+                           cut_to_aoi=False):
+    '''Mosaics one timescan layer of all bursts
+
+    Args:
+        processing_dir (str): the directory of the ARD products
+        temp_dir (str): the directory for intermediate products
+        product (str): the product (e.g. bs.VV or pol.Alpha)
+        metric (str): the timescan metric
+        cut_to_aoi (str): the WKT of the AOI to cut the mosaic to (optional)
+    '''
+
     tscan_dir = opj(processing_dir, 'Mosaic', 'Timescan')
     os.makedirs(tscan_dir, exist_ok=True)
-    outfiles = []
-    
-    for product, metric in itertools.product(product_list, metrics):   # ****
 
-        filelist = glob.glob(
-            opj(processing_dir, '*', 'Timescan', 
-                '*{}.{}.tif'.format(product, metric))
-        )
+    filelist = glob.glob(
+        opj(processing_dir, '*', 'Timescan',
+            '*{}.{}.tif'.format(product, metric))
+    )
 
-        if not len(filelist) >= 2:
-            continue
-        
-        filelist = ' '.join(filelist)
+    if not len(filelist) >= 2:
+        return
 
-        outfile = opj(tscan_dir, '{}.{}.tif'.format(product, metric))
-        check_file = opj(
-                os.path.dirname(outfile),
-                '.{}.processed'.format(os.path.basename(outfile)[:-4])
-        )
+    filelist = ' '.join(filelist)
 
-        if os.path.isfile(check_file):
-            print(' INFO: Mosaic layer {} already '
-                  ' processed.'.format(os.path.basename(outfile)))
+    outfile = opj(tscan_dir, '{}.{}.tif'.format(product, metric))
+    check_file = opj(
+            os.path.dirname(outfile),
+            '.{}.processed'.format(os.path.basename(outfile)[:-4])
+    )
+
+    if os.path.isfile(check_file):
+        print(' INFO: Mosaic layer {} already '
+              ' processed.'.format(os.path.basename(outfile)))
+        return
+
+    print(' INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
+    mosaic.mosaic(filelist, outfile, temp_dir, cut_to_aoi)
+
+
+def mosaic_timescan(burst_inventory, processing_dir, temp_dir, proc_file,
+                    cut_to_aoi=False, exec_file=None):
+
+    metrics = _timescan_metrics(proc_file)
+
+    tscan_dir = opj(processing_dir, 'Mosaic', 'Timescan')
+    os.makedirs(tscan_dir, exist_ok=True)
+
+    manifest = Manifest(exec_file) if exec_file else None
+
+    for product, metric in itertools.product(PRODUCT_LIST, metrics):   # ****
+
+        if manifest is not None:
+            manifest.add('mosaic-timescan.{}.{}'.format(product, metric),
+                         'mosaic-timescan', _mosaic_timescan_layer,
+                         dict(processing_dir=processing_dir,
+                              temp_dir=temp_dir, product=product,
+                              metric=metric, cut_to_aoi=cut_to_aoi),
+                         depends=manifest.ids('timescan'))
             continue
 
-        print(' INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
-        mosaic.mosaic(filelist, outfile, temp_dir, cut_to_aoi)
-        outfiles.append(outfile)
+        _mosaic_timescan_layer(processing_dir, temp_dir, product, metric,
+                               cut_to_aoi)
 
-    if exec_file:
-        print(' gdalbuildvrt ....command, outfiles')
+    if manifest is not None:
+        manifest.add('mosaic-timescan-vrt', 'mosaic-timescan-vrt',
+                     ras.create_tscan_vrt,
+                     dict(timescan_dir=tscan_dir, proc_file=proc_file),
+                     depends=manifest.ids('mosaic-timescan'))
+        manifest.write()
     else:
         # create vrt
         ras.create_tscan_vrt(tscan_dir, proc_file)
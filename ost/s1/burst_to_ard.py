@@ -4,11 +4,14 @@ from os.path import join as opj
 import importlib
 import json
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-from ost.helpers import helpers as h
+from ost.helpers import helpers as h, raster as ras, snap_graph, cache
+from ost.helpers import resources
 
 
-def _import(infile, out_prefix, logfile, swath, burst, polar='VV,VH,HH,HV'):
+def _import(infile, out_prefix, logfile, swath, burst, polar='VV,VH,HH,HV',
+            ncores=os.cpu_count()):
     '''A wrapper of SNAP import of a single Sentinel-1 SLC burst
 
     This function takes an original Sentinel-1 scene (either zip or
@@ -28,6 +31,7 @@ def _import(infile, out_prefix, logfile, swath, burst, polar='VV,VH,HH,HV'):
         polar (str): a string consisiting of the polarisation (comma separated)
                      e.g. 'VV,VH',
                      default value: 'VV,VH,HH,HV'
+        ncores (int): number of threads used by SNAP's gpt
 
     '''
 
@@ -43,7 +47,7 @@ def _import(infile, out_prefix, logfile, swath, burst, polar='VV,VH,HH,HV'):
 
     command = '{} {} -x -q {} -Pinput={} -Ppolar={} -Pswath={}\
                       -Pburst={} -Poutput={}' \
-        .format(gpt_file, graph, os.cpu_count(), infile, polar, swath,
+        .format(gpt_file, graph, ncores, infile, polar, swath,
                 burst, out_prefix)
 
     return_code = h.run_command(command, logfile)
@@ -58,7 +62,8 @@ def _import(infile, out_prefix, logfile, swath, burst, polar='VV,VH,HH,HV'):
     return return_code
 
 
-def _ha_alpha(infile, outfile, logfile, pol_speckle_filter=False):
+def _ha_alpha(infile, outfile, logfile, pol_speckle_filter=False,
+              ncores=os.cpu_count()):
     '''A wrapper of SNAP H-A-alpha polarimetric decomposition
 
     This function takes an OST imported Sentinel-1 scene/burst
@@ -74,6 +79,7 @@ def _ha_alpha(infile, outfile, logfile, pol_speckle_filter=False):
                  where SNAP'S STDOUT/STDERR is written to
         pol_speckle_filter (bool): wether or not to apply the
                                    polarimetric speckle filter
+        ncores (int): number of threads used by SNAP's gpt
 
     '''
 
@@ -92,7 +98,7 @@ def _ha_alpha(infile, outfile, logfile, pol_speckle_filter=False):
 
     print(" INFO: Calculating the H-alpha dual polarisation")
     command = '{} {} -x -q {} -Pinput={} -Poutput={}' \
-        .format(gpt_file, graph, 2 * os.cpu_count(), infile, outfile)
+        .format(gpt_file, graph, 2 * ncores, infile, outfile)
 
     return_code = h.run_command(command, logfile)
 
@@ -106,7 +112,8 @@ def _ha_alpha(infile, outfile, logfile, pol_speckle_filter=False):
     return return_code
 
 
-def _calibration(infile, outfile, logfile, product_type='GTCgamma'):
+def _calibration(infile, outfile, logfile, product_type='GTCgamma',
+                 ncores=os.cpu_count()):
     '''A wrapper around SNAP's radiometric calibration
 
     This function takes OST imported Sentinel-1 product and generates
@@ -129,6 +136,7 @@ def _calibration(infile, outfile, logfile, product_type='GTCgamma'):
         resolution (int): the resolution of the output product in meters
         product_type (str): the product type of the output product
                             i.e. RTC, GTCgamma or GTCsigma
+        ncores (int): number of threads used by SNAP's gpt
 
     '''
 
@@ -156,7 +164,7 @@ def _calibration(infile, outfile, logfile, product_type='GTCgamma'):
 
     print(" INFO: Removing thermal noise, calibrating and debursting")
     command = '{} {} -x -q {} -Pinput={} -Poutput={}' \
-        .format(gpt_file, graph, 2 * os.cpu_count(), infile, outfile)
+        .format(gpt_file, graph, 2 * ncores, infile, outfile)
 
     return_code = h.run_command(command, logfile)
 
@@ -170,7 +178,8 @@ def _calibration(infile, outfile, logfile, product_type='GTCgamma'):
     return return_code
 
 
-def _terrain_flattening(infile, outfile, logfile, dem_dict):
+def _terrain_flattening(infile, outfile, logfile, dem_dict,
+                        ncores=os.cpu_count()):
     '''A wrapper around SNAP's terrain flattening
 
     This function takes OST calibrated Sentinel-1 SLC product and applies
@@ -183,6 +192,7 @@ def _terrain_flattening(infile, outfile, logfile, dem_dict):
                  file written in BEAM-Dimap format
         logfile: string or os.path object for the file
                  where SNAP'S STDOUT/STDERR is written to
+        ncores (int): number of threads used by SNAP's gpt
 
     '''
 
@@ -201,7 +211,7 @@ def _terrain_flattening(infile, outfile, logfile, dem_dict):
                ' -PexternalDEMNoDataValue=\'{}\''
                ' -PdemResamplingMethod=\'{}\''
                ' -t {} {}'.format(
-                   gpt_file, 2 * os.cpu_count(), 
+                   gpt_file, 2 * ncores, 
                    dem_dict['dem name'], dem_dict['dem file'], 
                    dem_dict['dem nodata'], dem_dict['dem resampling'],
                    outfile, infile)
@@ -219,7 +229,7 @@ def _terrain_flattening(infile, outfile, logfile, dem_dict):
     return return_code
 
 
-def _speckle_filter(infile, outfile, logfile):
+def _speckle_filter(infile, outfile, logfile, ncores=os.cpu_count()):
     '''A wrapper around SNAP's Lee-Sigma Speckle Filter
 
     This function takes OST imported Sentinel-1 product and applies
@@ -233,6 +243,7 @@ def _speckle_filter(infile, outfile, logfile):
                  file written in BEAM-Dimap format
         logfile: string or os.path object for the file
                  where SNAP'S STDOUT/STDERR is written to
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     # get path to SNAP's command line executable gpt
@@ -241,7 +252,7 @@ def _speckle_filter(infile, outfile, logfile):
     print(' INFO: Applying the Lee-Sigma Speckle Filter')
     # contrcut command string
     command = '{} Speckle-Filter -x -q {} -PestimateENL=true \
-              -t \'{}\' \'{}\''.format(gpt_file, 2 * os.cpu_count(),
+              -t \'{}\' \'{}\''.format(gpt_file, 2 * ncores,
                                        outfile, infile)
 
     # run command and get return code
@@ -258,43 +269,41 @@ def _speckle_filter(infile, outfile, logfile):
     return return_code
 
 
-def _linear_to_db(infile, outfile, logfile):
-    '''A wrapper around SNAP's linear to db routine
+def _linear_to_db(infile, logfile, ncores=os.cpu_count()):
+    '''Converts an OST calibrated product to dB-scale in place
 
-    This function takes an OST calibrated Sentinel-1 product
-    and converts it to dB.
+    This function takes an OST calibrated Sentinel-1 product and
+    converts its intensity bands to dB. Instead of a gpt call of SNAP's
+    LinearToFromdB, the bands are converted block-wise by rasterio and
+    numpy, so neither a JVM is started nor a copy of the product written.
 
     Args:
         infile: string or os.path object for
-                an OST imported frame in BEAM-Dimap format (i.e. *.dim)
-        outfile: string or os.path object for the output
-                 file written in BEAM-Dimap format
+                an OST calibrated product in BEAM-Dimap format (i.e. *.dim)
         logfile: string or os.path object for the file
-                 where SNAP'S STDOUT/STDERR is written to
-    '''
+                 where the error message is written to
+        ncores (int): number of bands converted at once
 
-    # get path to SNAP's command line executable gpt
-    gpt_file = h.gpt_path()
+    Returns:
+        int: 0 on success, 1 on failure
+    '''
 
     print(' INFO: Converting the image to dB-scale.')
-    # construct command string
-    command = '{} LinearToFromdB -x -q {} -t \'{}\' {}'.format(
-        gpt_file, 2 * os.cpu_count(), outfile, infile)
-
-    # run command and get return code
-    return_code = h.run_command(command, logfile)
-
-    # handle errors and logs
-    if return_code == 0:
-        print(' INFO: Succesfully converted product to dB-scale.')
-    else:
+    try:
+        ras.linear_to_db_dimap(str(infile)[:-4], ncores)
+    except Exception as error:
+        with open(str(logfile), 'w') as file:
+            file.write('{}\n'.format(error))
         print(' ERROR: Linear to dB conversion exited with an error. \
-                See {} for Snap Error output'.format(logfile))
-        # sys.exit(113)
-    return return_code
+                See {} for the error output'.format(logfile))
+        return 1
+
+    print(' INFO: Succesfully converted product to dB-scale.')
+    return 0
 
 
-def _ls_mask(infile, outfile, logfile, resolution, dem_dict):
+def _ls_mask(infile, outfile, logfile, resolution, dem_dict,
+             ncores=os.cpu_count()):
     '''A wrapper around SNAP's Layover/Shadow mask routine
 
     This function takes OST imported Sentinel-1 product and calculates
@@ -314,6 +323,7 @@ def _ls_mask(infile, outfile, logfile, resolution, dem_dict):
                        'SRTM 3sec'
                        'ASTER 1sec GDEM'
                        'ACE30'
+        ncores (int): number of threads used by SNAP's gpt
 
     '''
 
@@ -334,7 +344,7 @@ def _ls_mask(infile, outfile, logfile, resolution, dem_dict):
                ' -Pdem_resampling=\'{}\''
                ' -Pimage_resampling=\'{}\''
                ' -Poutput={}'.format(
-                   gpt_file, graph, 2 * os.cpu_count(), infile, resolution,
+                   gpt_file, graph, 2 * ncores, infile, resolution,
                    dem_dict['dem name'], dem_dict['dem file'], 
                    dem_dict['dem nodata'], dem_dict['dem resampling'], 
                    dem_dict['image resampling'],
@@ -399,7 +409,8 @@ def _ls_mask(infile, outfile, logfile, resolution, dem_dict):
 #    return return_code
 
 
-def _coreg2(master, slave,  outfile, logfile, dem_dict):
+def _coreg2(master, slave,  outfile, logfile, dem_dict,
+            ncores=os.cpu_count()):
     '''A wrapper around SNAP's back-geocoding co-registration routine
 
     This function takes a list of 2 OST imported Sentinel-1 SLC products
@@ -419,6 +430,7 @@ def _coreg2(master, slave,  outfile, logfile, dem_dict):
                        'SRTM 3sec'
                        'ASTER 1sec GDEM'
                        'ACE30'
+        ncores (int): number of threads used by SNAP's gpt
 
     '''
 
@@ -438,7 +450,7 @@ def _coreg2(master, slave,  outfile, logfile, dem_dict):
                 ' -Pdem_nodata=\'{}\'' 
                 ' -Pdem_resampling=\'{}\''
                 ' -Poutput={} '.format(
-                    gpt_file, graph, 2 * os.cpu_count(), 
+                    gpt_file, graph, 2 * ncores, 
                     master, slave,
                     dem_dict['dem name'], dem_dict['dem file'], 
                     dem_dict['dem nodata'], dem_dict['dem resampling'], 
@@ -456,7 +468,8 @@ def _coreg2(master, slave,  outfile, logfile, dem_dict):
     return return_code
 
 
-def _coherence(infile, outfile, logfile, polar='VV,VH,HH,HV'):
+def _coherence(infile, outfile, logfile, polar='VV,VH,HH,HV',
+               ncores=os.cpu_count()):
     '''A wrapper around SNAP's coherence routine
 
     This function takes a co-registered stack of 2 Sentinel-1 SLC products
@@ -469,6 +482,7 @@ def _coherence(infile, outfile, logfile, polar='VV,VH,HH,HV'):
                  file written in BEAM-Dimap format
         logfile: string or os.path object for the file
                  where SNAP'S STDOUT/STDERR is written to
+        ncores (int): number of threads used by SNAP's gpt
 
     '''
 
@@ -481,7 +495,7 @@ def _coherence(infile, outfile, logfile, polar='VV,VH,HH,HV'):
 
     print(' INFO: Coherence estimation')
     command = '{} {} -x -q {} -Pinput={} -Ppolar=\'{}\' -Poutput={}' \
-        .format(gpt_file, graph, 2 * os.cpu_count(), infile, polar, outfile)
+        .format(gpt_file, graph, 2 * ncores, infile, polar, outfile)
 
     return_code = h.run_command(command, logfile)
 
@@ -494,7 +508,8 @@ def _coherence(infile, outfile, logfile, polar='VV,VH,HH,HV'):
     return return_code
 
 
-def _terrain_correction(infile, outfile, logfile, resolution, dem_dict):
+def _terrain_correction(infile, outfile, logfile, resolution, dem_dict,
+                        ncores=os.cpu_count()):
     '''A wrapper around SNAP's Terrain Correction routine
 
     This function takes an OST calibrated Sentinel-1 product and
@@ -514,6 +529,7 @@ def _terrain_correction(infile, outfile, logfile, resolution, dem_dict):
                        'SRTM 3sec'
                        'ASTER 1sec GDEM'
                        'ACE30'
+        ncores (int): number of threads used by SNAP's gpt
 
     '''
 
@@ -531,7 +547,7 @@ def _terrain_correction(infile, outfile, logfile, resolution, dem_dict):
                    ' -PnodataValueAtSea=\'false\''
                    ' -PpixelSpacingInMeter=\'{}\''
                    ' -t {} {}'.format(
-                       gpt_file, 2 * os.cpu_count(), 
+                       gpt_file, 2 * ncores, 
                        dem_dict['dem name'], dem_dict['dem file'], 
                        dem_dict['dem nodata'], dem_dict['dem resampling'], 
                        dem_dict['image resampling'],
@@ -598,97 +614,320 @@ def _terrain_correction(infile, outfile, logfile, resolution, dem_dict):
 #    return return_code
 
 
-def burst_to_ard(master_file,
-                 swath,
-                 master_burst_nr,
-                 master_burst_id,
-                 proc_file,
-                 out_dir,
-                 temp_dir,
-                 slave_file=None,
-                 slave_burst_nr=None,
-                 slave_burst_id=None,
-                 coherence=False,
-                 remove_slave_import=False):
-    '''The main routine to turn a burst into an ARD product
+def _fused_import(graph, reads, infile, swath, burst_nr, polars,
+                  import_prefix=None):
+    '''Adds the import of a burst to a fused graph
+
+    Existing imports are read as they are. Otherwise the burst is split
+    from the SLC scene, whose Read node is shared by all bursts of the
+    scene within the graph.
 
     Args:
-        master_file (str): path to full master SLC scene
-        swath (str): subswath
-        master_burst_nr (): index number of the burst
-        master_burst_id ():
-        out_dir (str):
-        temp_dir (str):
-        slave_file (str):
-        slave_burst_nr (str):
-        slave_burst_id (str):
-        proc_file (str):
-        remove_slave_import (bool):
+        graph (Graph): the graph to add the nodes to
+        reads (dict): the Read nodes of the graph by scene
+        infile (str): path to the full SLC scene
+        swath (str): the IW subswath of the burst
+        burst_nr (int): index number of the burst within the subswath
+        polars (str): comma separated polarisations
+        import_prefix (str): prefix of an existing import (optional)
+
+    Returns:
+        str: the id of the node of the imported burst
+    '''
+
+    if import_prefix and os.path.exists('{}.dim'.format(import_prefix)):
+        return graph.add('Read', file='{}.dim'.format(import_prefix))
+
+    if infile not in reads:
+        reads[infile] = graph.add('Read', file=infile)
+
+    node = graph.add('TOPSAR-Split', reads[infile], subswath=swath,
+                     selectedPolarisations=polars,
+                     firstBurstIndex=burst_nr, lastBurstIndex=burst_nr)
+
+    return graph.add('Apply-Orbit-File', node,
+                     orbitType='Sentinel Precise (Auto Download)',
+                     polyDegree=3, continueOnFail=True)
+
 
+def _burst_ls_mask(out_dir, ard):
+    '''Returns the Layover/Shadow mask shared by a burst id (None if not)
+
+    With 'ls mask per track' set in the ARD parameters, the mask is only
+    computed for the first date of a burst id, since the geometry of the
+    repeat passes is nearly the same.
     '''
 
-    # load ards
-    with open(proc_file, 'r') as ard_file:
-        ard_params = json.load(ard_file)['processing parameters']
-        ard = ard_params['single ARD']
-        
-    # import master
-    master_import = opj(temp_dir, '{}_import'.format(master_burst_id))
+    if not ard.get('ls mask per track'):
+        return None
 
-    if not os.path.exists('{}.dim'.format(master_import)):
-        import_log = opj(out_dir, '{}_import.err_log'.format(master_burst_id))
-        polars = ard['polarisation'].replace(' ', '')
-        return_code = _import(master_file, master_import, import_log,
-                              swath, master_burst_nr, polars)
-        if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+    return cache.track_product(out_dir, 'ls_mask',
+                               dict(resolution=ard['resolution'],
+                                    dem=ard['dem']))
+
+
+def _fused_burst_nodes(graph, reads, burst, ard, temp_dir):
+    '''Adds the complete ARD processing of a burst to a fused graph
+
+    The imported burst feeds the backscatter branch (calibration, speckle
+    filter, terrain flattening, dB, terrain correction, Layover/Shadow
+    mask), the H-A-Alpha branch and, together with the import of the
+    slave, the coherence branch.
+
+    Args:
+        graph (Graph): the graph to add the nodes to
+        reads (dict): the Read nodes of the graph by scene
+        burst (dict): the keyword arguments of burst_to_ard for the burst
+        ard (dict): the single ARD parameters
+        temp_dir (str): directory the products are written to
+
+    Returns:
+        list: the prefixes of the written products and whether their
+              statistics are checked
+    '''
 
+    burst_id = burst['master_burst_id']
+    polars = ard['polarisation'].replace(' ', '')
+    products = []
+
+    def _write(node, name, test_stats=True):
+        prefix = opj(temp_dir, '{}_{}'.format(burst_id, name))
+        graph.add('Write', node, file='{}.dim'.format(prefix),
+                  formatName='BEAM-DIMAP')
+        products.append((prefix, test_stats))
+
+    def _geocode(node, source_bands=None):
+        return graph.add('Terrain-Correction', node,
+                         **snap_graph.terrain_correction_parameters(
+                             ard['resolution'], ard['dem'], source_bands))
+
+    master = _fused_import(
+        graph, reads, burst['master_file'], burst['swath'],
+        burst['master_burst_nr'], polars,
+        opj(burst['import_dir'], '{}_import'.format(burst_id))
+        if burst.get('import_dir') else None)
+
+    # H-A-Alpha
     if ard['H-A-Alpha']:
-        # create HAalpha file
-        out_haa = opj(temp_dir, '{}_h'.format(master_burst_id))
-        haa_log = opj(out_dir, '{}_haa.err_log'.format(
-            master_burst_id))
-        return_code = _ha_alpha('{}.dim'.format(master_import),
-                                out_haa, haa_log, ard['remove pol speckle'])
+        node = graph.add('TOPSAR-Deburst', master)
+        if ard['remove pol speckle']:
+            node = graph.add('Polarimetric-Speckle-Filter', node,
+                             filter='Improved Lee Sigma Filter',
+                             filterSize=5, numLooksStr=1, windowSize='7x7',
+                             targetWindowSizeStr='3x3', anSize=50,
+                             sigmaStr=0.9)
+        node = graph.add('Polarimetric-Decomposition', node,
+                         decomposition='H-Alpha Dual Pol Decomposition',
+                         windowSize=5, outputHAAlpha=True)
+        _write(_geocode(node), 'pol')
+
+    # backscatter
+    product_type = ard['product type']
+    if product_type not in ['RTC', 'GTCgamma', 'GTCsigma']:
+        print(' ERROR: Wrong product type selected.')
+        sys.exit(121)
 
-        if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+    node = graph.add('ThermalNoiseRemoval', master, removeThermalNoise=True,
+                     reIntroduceThermalNoise=False)
+    node = graph.add('Calibration', node,
+                     outputImageInComplex=False, outputImageScaleInDb=False,
+                     outputSigmaBand=product_type == 'GTCsigma',
+                     outputGammaBand=product_type == 'GTCgamma',
+                     outputBetaBand=product_type == 'RTC')
+    node = graph.add('TOPSAR-Deburst', node)
 
-        # geo code HAalpha
-        out_htc = opj(temp_dir, '{}_pol'.format(master_burst_id))
-        haa_tc_log = opj(out_dir, '{}_haa_tc.err_log'.format(
-            master_burst_id))
-        return_code = _terrain_correction(
-            '{}.dim'.format(out_haa), out_htc, haa_tc_log, 
-            ard['resolution'], ard['dem'])
+    if ard['remove speckle']:
+        node = graph.add('Speckle-Filter', node, estimateENL=True)
+
+    if product_type == 'RTC':
+        node = graph.add('Terrain-Flattening', node,
+                         additionalOverlap=0.15, oversamplingMultiple=1.5,
+                         **snap_graph.dem_parameters(ard['dem']))
+
+    # not needed if the mask of the burst id is re-used
+    shared_ls = _burst_ls_mask(burst['out_dir'], ard)
+    if ard['create ls mask'] and not (
+            shared_ls and os.path.isfile('{}.dim'.format(shared_ls))):
+        ls_node = graph.add('SAR-Simulation', node,
+                            externalDEMApplyEGM=True,
+                            saveLayoverShadowMask=True,
+                            **snap_graph.dem_parameters(ard['dem']))
+        _write(_geocode(ls_node, 'layover_shadow_mask'), 'LS', False)
+
+    if ard['to db']:
+        node = graph.add('LinearToFromdB', node)
+
+    _write(_geocode(node), 'bs')
+
+    # coherence
+    if burst.get('coherence'):
+        slave = _fused_import(
+            graph, reads, burst['slave_file'], burst['swath'],
+            burst['slave_burst_nr'], polars,
+            opj(burst['import_dir'], '{}_import'.format(
+                burst['slave_burst_id']))
+            if burst.get('import_dir') else None)
+
+        master_deramp = graph.add('TOPSAR-DerampDemod', master,
+                                  outputDerampDemodPhase=False)
+        slave_deramp = graph.add('TOPSAR-DerampDemod', slave,
+                                 outputDerampDemodPhase=False)
+        node = graph.add('DEM-Assisted-Coregistration',
+                         [slave_deramp, master_deramp],
+                         resamplingType='BISINC_5_POINT_INTERPOLATION',
+                         tileExtensionPercent=50,
+                         maskOutAreaWithoutElevation=False,
+                         outputRangeAzimuthOffset=False,
+                         **snap_graph.dem_parameters(ard['dem']))
+        node = graph.add('Coherence', node, cohWinAz=4, cohWinRg=15,
+                         subtractFlatEarthPhase=True, srpPolynomialDegree=5,
+                         srpNumberPoints=501, orbitDegree=3,
+                         squarePixel=True)
+        node = graph.add('TOPSAR-Deburst', node,
+                         selectedPolarisations=ard['coherence bands']
+                         .replace(' ', ''))
+        _write(_geocode(node), 'coh')
+
+    return products
+
+
+def bursts_to_ard_fused(bursts, proc_file, temp_dir, ncores=os.cpu_count()):
+    '''Processes one or more bursts with a single SNAP graph
+
+    Instead of one gpt call per processing step and burst, the whole ARD
+    processing of all given bursts runs within one gpt call and only the
+    final products are written. Since bursts are small, this saves most of
+    the time spent on starting the JVM and on intermediate products.
+    Bursts of the same scene share the reading of the scene.
+
+    Args:
+        bursts (list): the keyword arguments of burst_to_ard per burst
+                       (master_file, swath, master_burst_nr,
+                       master_burst_id, out_dir, and for the coherence
+                       slave_file, slave_burst_nr, slave_burst_id and
+                       coherence, optionally import_dir)
+        proc_file (str): the OST processing parameter json file
+        temp_dir (str): directory for the graph and the products
+        ncores (int): number of threads used by SNAP's gpt
+
+    Returns:
+        return_code (int): 0 if the ARD products of all bursts have been
+                           created
+    '''
+
+    # load ards
+    with open(proc_file, 'r') as ard_file:
+        ard = json.load(ard_file)['processing parameters']['single ARD']
+
+    # e.g. processed by a former attempt of the same batch
+    bursts = [burst for burst in bursts
+              if not os.path.isfile(opj(burst['out_dir'], '.processed'))]
+    if not bursts:
+        return 0
+
+    graph, reads, products = snap_graph.Graph(), {}, {}
+    for burst in bursts:
+        products[burst['master_burst_id']] = _fused_burst_nodes(
+            graph, reads, burst, ard, temp_dir)
+
+    first_id = bursts[0]['master_burst_id']
+    print(' INFO: Processing {} with a single SNAP graph'.format(
+        first_id if len(bursts) == 1 else
+        '{} bursts of scene {}'.format(
+            len(bursts), os.path.basename(bursts[0]['master_file']))))
+
+    logfile = opj(bursts[0]['out_dir'], '{}_ard.err_log'.format(first_id))
+    return_code = graph.run(opj(temp_dir, '{}_ard.xml'.format(first_id)),
+                            logfile, ncores)
+    if return_code != 0:
+        print(' ERROR: ARD processing exited with an error. \
+                See {} for Snap Error output'.format(logfile))
+        h.remove_folder_content(temp_dir)
+        return return_code
+
+    for burst in bursts:
 
         # last check on the output files
-        return_code = h.check_out_dimap(out_htc)
-        if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+        for prefix, test_stats in products[burst['master_burst_id']]:
+            return_code = h.check_out_dimap(prefix, test_stats=test_stats)
+            if return_code != 0:
+                h.remove_folder_content(temp_dir)
+                return return_code
+
+        # share the Layover/Shadow mask with the other dates, or re-use it
+        ls_prefix = opj(temp_dir, '{}_LS'.format(burst['master_burst_id']))
+        if ard['create ls mask']:
+            shared_ls = _burst_ls_mask(burst['out_dir'], ard)
+            if os.path.isfile('{}.dim'.format(ls_prefix)):
+                cache.store_shared(shared_ls, ls_prefix)
+            elif cache.fetch_shared(shared_ls, ls_prefix):
+                products[burst['master_burst_id']].append((ls_prefix, False))
 
         # move to final destination
-        h.move_dimap(
-            out_htc, opj(out_dir, '{}_pol'.format(master_burst_id)))
+        for prefix, _ in products[burst['master_burst_id']]:
+            h.move_dimap(prefix, opj(burst['out_dir'],
+                                     os.path.basename(prefix)))
 
-        # remove HAalpha tmp files
-        h.delete_dimap(out_haa)
+        # write file, so we know this burst has been succesfully processed
+        with open(str(opj(burst['out_dir'], '.processed')), 'w') as file:
+            file.write('passed all tests \n')
+
+    return return_code
+
+
+def _haa_branch(master_import, master_burst_id, ard, out_dir, temp_dir,
+                ncores=os.cpu_count()):
+    '''Creates the geocoded H-A-Alpha product of an imported burst
+
+    Returns:
+        return_code (int): 0 if the product has been created
+        products (list): the prefixes of the products in temp_dir
+    '''
+
+    # create HAalpha file
+    out_haa = opj(temp_dir, '{}_h'.format(master_burst_id))
+    haa_log = opj(out_dir, '{}_haa.err_log'.format(
+        master_burst_id))
+    return_code = _ha_alpha('{}.dim'.format(master_import),
+                            out_haa, haa_log, ard['remove pol speckle'],
+                            ncores)
+
+    if return_code != 0:
+        return return_code, []
+
+    # geo code HAalpha
+    out_htc = opj(temp_dir, '{}_pol'.format(master_burst_id))
+    haa_tc_log = opj(out_dir, '{}_haa_tc.err_log'.format(
+        master_burst_id))
+    return_code = _terrain_correction(
+        '{}.dim'.format(out_haa), out_htc, haa_tc_log, 
+        ard['resolution'], ard['dem'], ncores)
+
+    # remove HAalpha tmp files
+    h.delete_dimap(out_haa)
+
+    # last check on the output files
+    return_code = h.check_out_dimap(out_htc)
+    return return_code, [out_htc]
+
+
+def _backscatter_branch(master_import, master_burst_id, ard, out_dir,
+                        temp_dir, ncores=os.cpu_count()):
+    '''Creates the geocoded backscatter (and LS mask) of an imported burst
+
+    Returns:
+        return_code (int): 0 if the products have been created
+        products (list): the prefixes of the products in temp_dir
+    '''
 
     # calibrate
     out_cal = opj(temp_dir, '{}_cal'.format(master_burst_id))
     cal_log = opj(out_dir, '{}_cal.err_log'.format(master_burst_id))
     return_code = _calibration(
-        '{}.dim'.format(master_import), out_cal, cal_log, ard['product type'])
+        '{}.dim'.format(master_import), out_cal, cal_log, ard['product type'],
+        ncores)
     if return_code != 0:
-        h.remove_folder_content(temp_dir)
-        return return_code
-
-    if not coherence:
-        #  remove imports
-        h.delete_dimap(master_import)
+        return return_code, []
 
     # speckle filtering
     if ard['remove speckle']:
@@ -697,10 +936,9 @@ def burst_to_ard(master_file,
         speckle_log = opj(out_dir, '{}_speckle.err_log'.format(
             master_burst_id))
         return_code = _speckle_filter('{}.dim'.format(out_cal),
-                                      speckle_import, speckle_log)
+                                      speckle_import, speckle_log, ncores)
         if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+            return return_code, []
 
         # remove temp file
         h.delete_dimap(out_cal)
@@ -716,10 +954,9 @@ def burst_to_ard(master_file,
             master_burst_id))
         # do the TF
         return_code = _terrain_flattening('{}.dim'.format(out_cal),
-                                          out_rtc, rtc_log, ard['dem'])
+                                          out_rtc, rtc_log, ard['dem'], ncores)
         if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+            return return_code, []
 
         # remove tmp files
         h.delete_dimap(out_cal)
@@ -727,129 +964,226 @@ def burst_to_ard(master_file,
         out_cal = out_rtc
 
     if ard['to db']:
-        out_db = opj(temp_dir, '{}_cal_db'.format(master_burst_id))
         db_log = opj(out_dir, '{}_cal_db.err_log'.format(master_burst_id))
-        return_code = _linear_to_db('{}.dim'.format(out_cal), out_db, db_log)
+        return_code = _linear_to_db('{}.dim'.format(out_cal), db_log, ncores)
         if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
-
-        # remove tmp files
-        h.delete_dimap(out_cal)
-        # set out_cal to out_db for further processing
-        out_cal = out_db
+            return return_code, []
 
     # geo code backscatter products
     out_tc = opj(temp_dir, '{}_bs'.format(master_burst_id))
     tc_log = opj(out_dir, '{}_bs_tc.err_log'.format(master_burst_id))
     return_code = _terrain_correction(
-        '{}.dim'.format(out_cal), out_tc, tc_log, ard['resolution'], ard['dem'])
+        '{}.dim'.format(out_cal), out_tc, tc_log, ard['resolution'], ard['dem'],
+        ncores)
 
     # last check on backscatter data
     return_code = h.check_out_dimap(out_tc)
     if return_code != 0:
-        h.remove_folder_content(temp_dir)
-        return return_code
-
-    # we move backscatter to final destination
-    h.move_dimap(out_tc, opj(out_dir, '{}_bs'.format(master_burst_id)))
+        return return_code, []
 
+    products = [out_tc]
     if ard['create ls mask']:
         # create LS map
         out_ls = opj(temp_dir, '{}_LS'.format(master_burst_id))
         ls_log = opj(out_dir, '{}_LS.err_log'.format(master_burst_id))
-        return_code = _ls_mask('{}.dim'.format(out_cal), out_ls, ls_log,
-                               ard['resolution'], ard['dem'])
-        if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+
+        # the mask of the burst id, or a new one
+        shared_ls = _burst_ls_mask(out_dir, ard)
+        if not cache.fetch_shared(shared_ls, out_ls):
+            return_code = _ls_mask('{}.dim'.format(out_cal), out_ls, ls_log,
+                                   ard['resolution'], ard['dem'], ncores)
+            if return_code != 0:
+                return return_code, []
 
         # last check on ls data
         return_code = h.check_out_dimap(out_ls, test_stats=False)
         if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+            return return_code, []
 
-        # move ls data to final destination
-        h.move_dimap(out_ls, opj(out_dir, '{}_LS'.format(master_burst_id)))
+        cache.store_shared(shared_ls, out_ls)
+        products.append(out_ls)
 
     # remove calibrated files
     h.delete_dimap(out_cal)
 
-    if coherence:
+    return return_code, products
+
+
+def _coherence_branch(master_import, slave_file, swath, slave_burst_nr,
+                      slave_import, master_burst_id, ard, out_dir, temp_dir,
+                      ncores=os.cpu_count()):
+    '''Creates the geocoded coherence of an imported burst and its slave
 
-        # import slave
-        slave_import = opj(temp_dir, '{}_import'.format(slave_burst_id))
-        import_log = opj(out_dir, '{}_import.err_log'.format(slave_burst_id))
+    Returns:
+        return_code (int): 0 if the product has been created
+        products (list): the prefixes of the products in temp_dir
+    '''
+
+    # import slave
+    if not os.path.exists('{}.dim'.format(slave_import)):
+        import_log = opj(out_dir, '{}_import.err_log'.format(
+            os.path.basename(slave_import)[:-7]))
         polars = ard['polarisation'].replace(' ', '')
         return_code = _import(slave_file, slave_import, import_log,
-                              swath, slave_burst_nr, polars)
+                              swath, slave_burst_nr, polars, ncores)
 
         if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+            return return_code, []
+
+    # co-registration
+    #filelist = ['{}.dim'.format(master_import),
+    #            '{}.dim'.format(slave_import)]
+    #filelist = '\'{}\''.format(','.join(filelist))
+    out_coreg = opj(temp_dir, '{}_coreg'.format(master_burst_id))
+    coreg_log = opj(out_dir, '{}_coreg.err_log'.format(master_burst_id))
+    # return_code = _coreg(filelist, out_coreg, coreg_log, dem)
+    return_code = _coreg2('{}.dim'.format(master_import),
+                          '{}.dim'.format(slave_import),
+                           out_coreg,
+                           coreg_log, ard['dem'], ncores)
+    if return_code != 0:
+        return return_code, []
+
+    # calculate coherence and deburst
+    out_coh = opj(temp_dir, '{}_c'.format(master_burst_id))
+    coh_log = opj(out_dir, '{}_coh.err_log'.format(master_burst_id))
+    coh_polars = ard['coherence bands'].replace(' ', '')
+    return_code = _coherence('{}.dim'.format(out_coreg),
+                             out_coh, coh_log, coh_polars, ncores)
+    if return_code != 0:
+        return return_code, []
 
-        # co-registration
-        #filelist = ['{}.dim'.format(master_import),
-        #            '{}.dim'.format(slave_import)]
-        #filelist = '\'{}\''.format(','.join(filelist))
-        out_coreg = opj(temp_dir, '{}_coreg'.format(master_burst_id))
-        coreg_log = opj(out_dir, '{}_coreg.err_log'.format(master_burst_id))
-        # return_code = _coreg(filelist, out_coreg, coreg_log, dem)
-        return_code = _coreg2('{}.dim'.format(master_import),
-                              '{}.dim'.format(slave_import),
-                               out_coreg,
-                               coreg_log, ard['dem'])
-        if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+    # remove coreg tmp files
+    h.delete_dimap(out_coreg)
 
-        #  remove imports
-        h.delete_dimap(master_import)
+    # geocode
+    out_tc = opj(temp_dir, '{}_coh'.format(master_burst_id))
+    tc_log = opj(out_dir, '{}_coh_tc.err_log'.format(master_burst_id))
+    return_code = _terrain_correction(
+        '{}.dim'.format(out_coh), out_tc, tc_log, 
+        ard['resolution'], ard['dem'], ncores)
 
-        if remove_slave_import is True:
-            h.delete_dimap(slave_import)
+    # remove tmp files
+    h.delete_dimap(out_coh)
 
-        # calculate coherence and deburst
-        out_coh = opj(temp_dir, '{}_c'.format(master_burst_id))
-        coh_log = opj(out_dir, '{}_coh.err_log'.format(master_burst_id))
-        coh_polars = ard['coherence bands'].replace(' ', '')
-        return_code = _coherence('{}.dim'.format(out_coreg),
-                                 out_coh, coh_log, coh_polars)
-        if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+    # last check on coherence data
+    return_code = h.check_out_dimap(out_tc)
+    return return_code, [out_tc]
 
-        # remove coreg tmp files
-        h.delete_dimap(out_coreg)
 
-        # geocode
-        out_tc = opj(temp_dir, '{}_coh'.format(master_burst_id))
-        tc_log = opj(out_dir, '{}_coh_tc.err_log'.format(master_burst_id))
-        return_code = _terrain_correction(
-            '{}.dim'.format(out_coh), out_tc, tc_log, 
-            ard['resolution'], ard['dem'])
-        
-        # last check on coherence data
-        return_code = h.check_out_dimap(out_tc)
+def burst_to_ard(master_file,
+                 swath,
+                 master_burst_nr,
+                 master_burst_id,
+                 proc_file,
+                 out_dir,
+                 temp_dir,
+                 slave_file=None,
+                 slave_burst_nr=None,
+                 slave_burst_id=None,
+                 coherence=False,
+                 remove_slave_import=False,
+                 import_dir=None,
+                 keep_imports=False,
+                 ncores=os.cpu_count()):
+    '''The main routine to turn a burst into an ARD product
+
+    Args:
+        master_file (str): path to full master SLC scene
+        swath (str): subswath
+        master_burst_nr (): index number of the burst
+        master_burst_id ():
+        out_dir (str):
+        temp_dir (str):
+        slave_file (str):
+        slave_burst_nr (str):
+        slave_burst_id (str):
+        proc_file (str):
+        remove_slave_import (bool):
+        import_dir (str): directory where burst imports are looked up and
+                          written to (default: temp_dir). Existing imports
+                          of the master or slave burst are re-used.
+        keep_imports (bool): do not delete the master and slave imports,
+                             e.g. if they are shared with other dates
+        ncores (int): number of threads used by SNAP's gpt
+
+    If 'fused graph' is set in the ARD parameters, all steps run as a
+    single SNAP graph (see bursts_to_ard_fused).
+    '''
+
+    # load ards
+    with open(proc_file, 'r') as ard_file:
+        ard_params = json.load(ard_file)['processing parameters']
+        ard = ard_params['single ARD']
+
+    if ard.get('fused graph'):
+        return bursts_to_ard_fused(
+            [dict(master_file=master_file, swath=swath,
+                  master_burst_nr=master_burst_nr,
+                  master_burst_id=master_burst_id, out_dir=out_dir,
+                  slave_file=slave_file, slave_burst_nr=slave_burst_nr,
+                  slave_burst_id=slave_burst_id, coherence=coherence,
+                  import_dir=import_dir)],
+            proc_file, temp_dir, ncores)
+
+    if import_dir is None:
+        import_dir = temp_dir
+
+    # import master
+    master_import = opj(import_dir, '{}_import'.format(master_burst_id))
+
+    if not os.path.exists('{}.dim'.format(master_import)):
+        import_log = opj(out_dir, '{}_import.err_log'.format(master_burst_id))
+        polars = ard['polarisation'].replace(' ', '')
+        return_code = _import(master_file, master_import, import_log,
+                              swath, master_burst_nr, polars, ncores)
         if return_code != 0:
             h.remove_folder_content(temp_dir)
             return return_code
 
-        # move to final destination
-        h.move_dimap(out_tc, opj(out_dir, '{}_coh'.format(master_burst_id)))
+    # the H-A-Alpha, backscatter and coherence branches only share the
+    # imported master burst, so they run at once
+    branches = []
+    if ard['H-A-Alpha']:
+        branches.append((_haa_branch, (master_import, master_burst_id, ard,
+                                       out_dir, temp_dir)))
+    branches.append((_backscatter_branch, (master_import, master_burst_id,
+                                           ard, out_dir, temp_dir)))
+    if coherence:
+        slave_import = opj(import_dir, '{}_import'.format(slave_burst_id))
+        branches.append((_coherence_branch, (
+            master_import, slave_file, swath, slave_burst_nr, slave_import,
+            master_burst_id, ard, out_dir, temp_dir)))
+
+    with resources.divided_budget(len(branches)) as workers:
+        branch_cores = max(1, ncores // workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda branch: branch[0](*branch[1], ncores=branch_cores),
+                branches))
+
+    # only move the products if all branches succeeded
+    return_code = next((code for code, _ in results if code != 0), 0)
+    if return_code != 0:
+        h.remove_folder_content(temp_dir)
+        return return_code
 
-        # remove tmp files
-        h.delete_dimap(out_coh)
+    #  remove imports
+    if not keep_imports:
+        h.delete_dimap(master_import)
+
+        if coherence and remove_slave_import is True:
+            h.delete_dimap(slave_import)
+
+    # move to final destination
+    for _, products in results:
+        for product in products:
+            h.move_dimap(product, opj(out_dir, os.path.basename(product)))
 
     # write file, so we know this burst has been succesfully processed
-    if return_code == 0:
-        check_file = opj(out_dir, '.processed')
-        with open(str(check_file), 'w') as file:
-            file.write('passed all tests \n')
-    else:
-        h.remove_folder_content(temp_dir)
-        h.remove_folder_content(out_dir)
+    check_file = opj(out_dir, '.processed')
+    with open(str(check_file), 'w') as file:
+        file.write('passed all tests \n')
 
     return return_code
 
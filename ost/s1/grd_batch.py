@@ -51,6 +51,8 @@ import os
 from os.path import join as opj
 import json
 import glob
+import shutil
+import tempfile
 import itertools
 
 import gdal
@@ -59,6 +61,10 @@ import gdal
 from ost import Sentinel1_Scene
 from ost.s1 import grd_to_ard
 from ost.helpers import raster as ras
+from ost.helpers.scheduler import TaskGraph
+from ost.helpers.resources import ResourceManager
+from ost.helpers.manifest import Manifest
+from ost.helpers import state
 from ost.multitemporal import common_extent
 from ost.multitemporal import common_ls_mask
 from ost.multitemporal import ard_to_ts
@@ -105,13 +111,89 @@ def _create_processing_dict(inventory_df):
     return dict_scenes
 
 
+def _grd_to_ard_job(scene_paths, out_dir, file_id, temp_dir, proc_file,
+                    subset=None, ncores=os.cpu_count()):
+    '''Processes a single acquisition within its own scratch directory
+
+    Args:
+        scene_paths (list): paths to the consecutive frames of an acquisition
+        out_dir (str): the output directory of the acquisition
+        file_id (str): the prefix of the output files
+        temp_dir (str): directory in which the scratch directory is created
+        proc_file (str): the OST processing parameter json file
+        subset (str): a WKT Polygon to subset the scenes (optional)
+        ncores (int): number of threads used by SNAP's gpt
+
+    Returns:
+        return_code (int): 0 if the acquisition has been processed
+    '''
+
+    # e.g. processed by another worker in the meantime
+    if os.path.isfile(opj(out_dir, '.processed')):
+        return 0
+
+    # every acquisition gets its own scratch space, so that
+    # concurrent jobs and failure cleanups do not interfere
+    scratch_dir = tempfile.mkdtemp(prefix='{}_'.format(file_id), dir=temp_dir)
+
+    try:
+        return grd_to_ard.grd_to_ard(scene_paths,
+                                     out_dir,
+                                     file_id,
+                                     scratch_dir,
+                                     proc_file,
+                                     subset=subset,
+                                     ncores=ncores)
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
 def grd_to_ard_batch(inventory_df, download_dir, processing_dir,
                      temp_dir, proc_file, subset=None,
-                     data_mount='/eodata', exec_file=None):
+                     data_mount='/eodata', exec_file=None, max_workers=1,
+                     store=None, max_attempts=1, lock_dir=None):
+    '''Processes all acquisitions of an inventory to ARD
+
+    Acquisitions are processed by up to max_workers concurrent jobs, each
+    within its own scratch directory below temp_dir. Cores and memory are
+    shared between the jobs by a ResourceManager, which lowers the number
+    of concurrent jobs if their memory footprint does not fit the machine.
+
+    If an exec_file is given, nothing is processed, but one task per
+    acquisition is added to the task manifest (see ost.helpers.manifest).
+
+    With a TaskStore, acquisitions recorded as done are skipped without
+    looking at the processing directory, and failed acquisitions are
+    retried up to max_attempts times.
+
+    With a lock_dir, several machines can process the same inventory on a
+    shared processing directory, each claiming single acquisitions.
+
+    Args:
+        inventory_df (gdf): an OST compliant Sentinel-1 inventory
+        download_dir (str): the directory of the downloaded scenes
+        processing_dir (str): the directory for the ARD products
+        temp_dir (str): the directory for intermediate products
+        proc_file (str): the OST processing parameter json file
+        subset (str): a WKT Polygon to subset the scenes (optional)
+        exec_file (str): path to a task manifest to export to (optional)
+        max_workers (int): the maximum number of acquisitions processed at once
+        store (TaskStore): a persistent record of the task states (optional)
+        max_attempts (int): the maximum number of attempts per acquisition
+        lock_dir (str): the directory of the lock files (worker mode)
+    '''
+
+    os.makedirs(temp_dir, exist_ok=True)
 
     # where all frames are grouped into acquisitions
     processing_dict = _create_processing_dict(inventory_df)
 
+    manager = ResourceManager(max_workers)
+    ncores = manager.allocation()['ncores']
+
+    graph = TaskGraph()
+    manifest = Manifest(exec_file) if exec_file else None
+    done = store.ids(state.DONE, 'ard') if store is not None else set()
     for track, allScenes in processing_dict.items():
         for list_of_scenes in processing_dict[track]:
 
@@ -120,11 +202,19 @@ def grd_to_ard_batch(inventory_df, download_dir, processing_dir,
                 # create a subdirectory baed on acq. date
                 out_dir = opj(processing_dir, track, acquisition_date)
                 os.makedirs(out_dir, exist_ok=True)
+                key = ('ard', track, acquisition_date)
 
                 # check if already processed
-                if os.path.isfile(opj(out_dir, '.processed')):
+                if state.task_id(key) in done:
                     print(' INFO: Acquisition from {} of track {}'
                           ' already processed'.format(acquisition_date, track))
+                elif os.path.isfile(opj(out_dir, '.processed')):
+                    print(' INFO: Acquisition from {} of track {}'
+                          ' already processed'.format(acquisition_date, track))
+                    # take over acquisitions processed without a store
+                    if store is not None:
+                        store.finish(state.task_id(key), 0, outputs=[out_dir],
+                                     stage='ard')
                 else:
                     # get the paths to the file
                     scene_paths = ([Sentinel1_Scene(i).get_path(download_dir)
@@ -132,95 +222,141 @@ def grd_to_ard_batch(inventory_df, download_dir, processing_dir,
 
                     file_id = '{}_{}'.format(acquisition_date, track)
 
-                    # apply the grd_to_ard function
-                    grd_to_ard.grd_to_ard(scene_paths,
-                                      out_dir,
-                                      file_id,
-                                      temp_dir,
-                                      proc_file,
-                                      subset=subset)
-
-
-def ards_to_timeseries(inventory_df, processing_dir, temp_dir,
-                       proc_file, exec_file):
+                    if manifest is not None:
+                        manifest.add(
+                            state.task_id(key), 'ard', _grd_to_ard_job,
+                            dict(scene_paths=scene_paths, out_dir=out_dir,
+                                 file_id=file_id, temp_dir=temp_dir,
+                                 proc_file=proc_file, subset=subset))
+                        continue
+
+                    graph.add(key, _grd_to_ard_job,
+                              args=(scene_paths, out_dir, file_id, temp_dir,
+                                    proc_file, subset, ncores),
+                              outputs=[out_dir],
+                              lock=state.task_id(key))
+
+    if manifest is not None:
+        manifest.write()
+        return
+
+    # apply the grd_to_ard function
+    if graph.tasks:
+        graph.run(manager.workers, resources=manager, store=store,
+                  max_attempts=max_attempts, lock_dir=lock_dir)
+
+
+def _track_to_timeseries(processing_dir, temp_dir, track, proc_file):
+    '''Creates the common extent, ls mask and time-series of a track
+
+    Args:
+        processing_dir (str): the directory of the ARD products
+        temp_dir (str): the directory for intermediate products
+        track (str): the relative orbit
+        proc_file (str): the OST processing parameter json file
+
+    Returns:
+        return_code (int): 0 if all time-series have been created
+    '''
 
     # load ard parameters
     with open(proc_file, 'r') as ard_file:
         ard_params = json.load(ard_file)['processing parameters']
         ard = ard_params['single ARD']
 
-    for track in inventory_df.relativeorbit.unique():
+    # get the burst directory
+    track_dir = opj(processing_dir, track)
 
-        # get the burst directory
-        track_dir = opj(processing_dir, track)
-
-        # get common burst extent
-        list_of_scenes = glob.glob(opj(track_dir, '20*', '*data*', '*img'))
-        list_of_scenes = [x for x in list_of_scenes if 'layover' not in x]
-        extent = opj(track_dir, '{}.extent.shp'.format(track))
-
-        # placeholder for parallelisation
-        if exec_file:
-            if os.path.isfile(exec_file):
-                os.remove(exec_file)
-
-            print('create command')
-            continue
+    # get common burst extent
+    list_of_scenes = glob.glob(opj(track_dir, '20*', '*data*', '*img'))
+    list_of_scenes = [x for x in list_of_scenes if 'layover' not in x]
+    extent = opj(track_dir, '{}.extent.shp'.format(track))
 
+    if not os.path.isfile(extent):
         print(' INFO: Creating common extent mask for track {}'.format(track))
         common_extent.mt_extent(list_of_scenes, extent, temp_dir, -0.0018)
 
     if ard['create ls mask'] or ard['apply ls mask']:
 
-        for track in inventory_df.relativeorbit.unique():
-
-            # get the burst directory
-            track_dir = opj(processing_dir, track)
-
-            # get common burst extent
-            list_of_scenes = glob.glob(opj(track_dir, '20*', '*data*', '*img'))
-            list_of_layover = [x for x in list_of_scenes if 'layover' in x]
+        # get common burst extent
+        list_of_scenes = glob.glob(opj(track_dir, '20*', '*data*', '*img'))
+        list_of_layover = [x for x in list_of_scenes if 'layover' in x]
 
-            # layover/shadow mask
-            out_ls = opj(track_dir, '{}.ls_mask.tif'.format(track))
+        # layover/shadow mask
+        out_ls = opj(track_dir, '{}.ls_mask.tif'.format(track))
 
+        if not os.path.isfile(out_ls):
             print(' INFO: Creating common Layover/Shadow mask for track {}'.format(track))
             common_ls_mask.mt_layover(list_of_layover, out_ls, temp_dir,
                                       extent, ard['apply ls mask'])
 
+    return_code = 0
+    for pol in ['VV', 'VH', 'HH', 'HV']:
 
-    for track in inventory_df.relativeorbit.unique():
+        # see if there is actually any imagery in thi polarisation
+        list_of_files = sorted(glob.glob(
+            opj(track_dir, '20*', '*data*', '*ma0*{}*img'.format(pol))))
+
+        if not len(list_of_files) > 1:
+            continue
 
-        # get the burst directory
-        track_dir = opj(processing_dir, track)
+        # create list of dims if polarisation is present
+        list_of_dims = sorted(glob.glob(
+            opj(track_dir, '20*', '*bs*dim')))
 
-        for pol in ['VV', 'VH', 'HH', 'HV']:
+        return_code = ard_to_ts.ard_to_ts(
+                        list_of_dims,
+                        processing_dir,
+                        temp_dir,
+                        track,
+                        proc_file,
+                        product='bs',
+                        pol=pol
+        ) or return_code
 
-            # see if there is actually any imagery in thi polarisation
-            list_of_files = sorted(glob.glob(
-                opj(track_dir, '20*', '*data*', '*ma0*{}*img'.format(pol))))
+    return return_code
 
-            if not len(list_of_files) > 1:
-                continue
 
-            # create list of dims if polarisation is present
-            list_of_dims = sorted(glob.glob(
-                opj(track_dir, '20*', '*bs*dim')))
+def ards_to_timeseries(inventory_df, processing_dir, temp_dir,
+                       proc_file, exec_file, store=None, max_attempts=1,
+                       lock_dir=None):
 
-            ard_to_ts.ard_to_ts(
-                            list_of_dims,
-                            processing_dir,
-                            temp_dir,
-                            track,
-                            proc_file,
-                            product='bs',
-                            pol=pol
-            )
+    manifest = Manifest(exec_file) if exec_file else None
+    graph = TaskGraph()
 
+    for track in inventory_df.relativeorbit.unique():
 
-def timeseries_to_timescan(inventory_df, processing_dir, proc_file,
-                           exec_file=None):
+        if manifest is not None:
+            manifest.add('timeseries.{}'.format(track), 'timeseries',
+                         _track_to_timeseries,
+                         dict(processing_dir=processing_dir,
+                              temp_dir=temp_dir, track=track,
+                              proc_file=proc_file),
+                         depends=manifest.ids('ard.{}'.format(track)))
+            continue
 
+        graph.add(('timeseries', track), _track_to_timeseries,
+                  args=(processing_dir, temp_dir, track, proc_file),
+                  outputs=[opj(processing_dir, track, 'Timeseries')],
+                  lock='timeseries.{}'.format(track))
+
+    if manifest is not None:
+        manifest.write()
+    else:
+        graph.run(store=store, max_attempts=max_attempts, lock_dir=lock_dir)
+
+
+def _track_to_timescan(processing_dir, track, proc_file):
+    '''Creates the timescans of all polarisations of a track
+
+    Args:
+        processing_dir (str): the directory of the ARD products
+        track (str): the relative orbit
+        proc_file (str): the OST processing parameter json file
+
+    Returns:
+        return_code (int): 0 if all timescans have been created
+    '''
 
     # load ard parameters
     with open(proc_file, 'r') as ard_file:
@@ -229,7 +365,6 @@ def timeseries_to_timescan(inventory_df, processing_dir, proc_file,
         ard_mt = ard_params['time-series ARD']
         ard_tscan = ard_params['time-scan ARD']
 
-
     # get the db scaling right
     to_db = ard['to db']
     if ard['to db'] or ard_mt['to db']:
@@ -237,139 +372,191 @@ def timeseries_to_timescan(inventory_df, processing_dir, proc_file,
 
     dtype_conversion = True if ard_mt['dtype output'] != 'float32' else False
 
+    print(' INFO: Entering track {}.'.format(track))
+    # get track directory
+    track_dir = opj(processing_dir, track)
+    # define and create Timescan directory
+    timescan_dir = opj(track_dir, 'Timescan')
+    os.makedirs(timescan_dir, exist_ok=True)
+
+    # loop thorugh each polarization
+    return_code = 0
+    for polar in ['VV', 'VH', 'HH', 'HV']:
+
+        if os.path.isfile(opj(timescan_dir, '.bs.{}.processed'.format(polar))):
+            print(' INFO: Timescans for track {} already'
+                  ' processed.'.format(track))
+            continue
+
+        #get timeseries vrt
+        timeseries = opj(track_dir,
+                         'Timeseries',
+                         'Timeseries.bs.{}.vrt'.format(polar)
+        )
+
+        if not os.path.isfile(timeseries):
+            continue
+
+        print(' INFO: Processing Timescans of {} for track {}.'.format(polar, track))
+        # create a datelist for harmonics
+        scenelist = glob.glob(
+            opj(track_dir, '*bs.{}.tif'.format(polar))
+        )
+
+        # create a datelist for harmonics calculation
+        datelist = []
+        for file in sorted(scenelist):
+            datelist.append(os.path.basename(file).split('.')[1])
+
+        # define timescan prefix
+        timescan_prefix = opj(timescan_dir, 'bs.{}'.format(polar))
+
+        # run timescan
+        return_code = timescan.mt_metrics(
+            timeseries,
+            timescan_prefix,
+            ard_tscan['metrics'],
+            rescale_to_datatype=dtype_conversion,
+            to_power=to_db,
+            outlier_removal=ard_tscan['remove outliers'],
+            datelist=datelist
+        ) or return_code
+
+    # create vrt file (and rename )
+    ras.create_tscan_vrt(timescan_dir, proc_file)
+
+    return return_code
+
+
+def timeseries_to_timescan(inventory_df, processing_dir, proc_file,
+                           exec_file=None, store=None, max_attempts=1,
+                           lock_dir=None):
+
+    manifest = Manifest(exec_file) if exec_file else None
+    graph = TaskGraph()
+
     for track in inventory_df.relativeorbit.unique():
 
-        print(' INFO: Entering track {}.'.format(track))
-        # get track directory
-        track_dir = opj(processing_dir, track)
-        # define and create Timescan directory
-        timescan_dir = opj(track_dir, 'Timescan')
-        os.makedirs(timescan_dir, exist_ok=True)
-
-        # loop thorugh each polarization
-        for polar in ['VV', 'VH', 'HH', 'HV']:
-
-            if os.path.isfile(opj(timescan_dir, '.{}.processed'.format(polar))):
-                print(' INFO: Timescans for track {} already'
-                      ' processed.'.format(track))
-                continue
-
-            #get timeseries vrt
-            timeseries = opj(track_dir,
-                             'Timeseries',
-                             'Timeseries.bs.{}.vrt'.format(polar)
-            )
-
-            if not os.path.isfile(timeseries):
-                continue
-
-            print(' INFO: Processing Timescans of {} for track {}.'.format(polar, track))
-            # create a datelist for harmonics
-            scenelist = glob.glob(
-                opj(track_dir, '*bs.{}.tif'.format(polar))
-            )
-
-            # create a datelist for harmonics calculation
-            datelist = []
-            for file in sorted(scenelist):
-                datelist.append(os.path.basename(file).split('.')[1])
-
-            # define timescan prefix
-            timescan_prefix = opj(timescan_dir, 'bs.{}'.format(polar))
-
-            # placeholder for parallel execution
-            if exec_file:
-                print(' Write command to a text file')
-                continue
-
-            # run timescan
-            timescan.mt_metrics(
-                timeseries,
-                timescan_prefix,
-                ard_tscan['metrics'],
-                rescale_to_datatype=dtype_conversion,
-                to_power=to_db,
-                outlier_removal=ard_tscan['remove outliers'],
-                datelist=datelist
-            )
-
-        if not exec_file:
-            # create vrt file (and rename )
-            ras.create_tscan_vrt(timescan_dir, proc_file)
+        if manifest is not None:
+            manifest.add('timescan.{}'.format(track), 'timescan',
+                         _track_to_timescan,
+                         dict(processing_dir=processing_dir, track=track,
+                              proc_file=proc_file),
+                         depends=manifest.ids('timeseries.{}'.format(track)))
+            continue
 
+        graph.add(('timescan', track), _track_to_timescan,
+                  args=(processing_dir, track, proc_file),
+                  outputs=[opj(processing_dir, track, 'Timescan')],
+                  lock='timescan.{}'.format(track))
 
-def mosaic_timeseries(inventory_df, processing_dir, temp_dir, cut_to_aoi=False,
-                      exec_file=None):
+    if manifest is not None:
+        manifest.write()
+    else:
+        graph.run(store=store, max_attempts=max_attempts, lock_dir=lock_dir)
 
-    print(' -----------------------------------')
-    print(' INFO: Mosaicking Time-series layers')
-    print(' -----------------------------------')
 
-    # create output folder
+def _mosaic_timeseries_polarisation(processing_dir, temp_dir, track, p,
+                                    cut_to_aoi=False):
+    '''Mosaics all time-series layers of one polarisation
+
+    Args:
+        processing_dir (str): the directory of the ARD products
+        temp_dir (str): the directory for intermediate products
+        track (str): a relative orbit used to count the time-series layers
+        p (str): the polarisation
+        cut_to_aoi (str): the WKT of the AOI to cut the mosaic to (optional)
+    '''
+
     ts_dir = opj(processing_dir, 'Mosaic', 'Timeseries')
     os.makedirs(ts_dir, exist_ok=True)
 
-    # loop through polarisations
-    for p in ['VV', 'VH', 'HH', 'HV']:
+    nr_of_ts = len(glob.glob(opj(
+        processing_dir, track, 'Timeseries', '*.{}.tif'.format(p))))
 
-        tracks = inventory_df.relativeorbit.unique()
-        nr_of_ts = len(glob.glob(opj(
-            processing_dir, tracks[0], 'Timeseries', '*.{}.tif'.format(p))))
+    if not nr_of_ts >= 1:
+        return
 
-        if not nr_of_ts >= 1:
-            continue
+    outfiles = []
+    for i in range(1, nr_of_ts + 1):
+
+        filelist = glob.glob(opj(
+            processing_dir, '*', 'Timeseries',
+            '{}.*.{}.tif'.format(i, p)))
+        filelist = [file for file in filelist if 'Mosaic' not in file]
 
-        outfiles = []
-        for i in range(1, nr_of_ts + 1):
+        # create
+        datelist = []
+        for file in filelist:
+            datelist.append(os.path.basename(file).split('.')[1])
 
-            filelist = glob.glob(opj(
-                processing_dir, '*', 'Timeseries',
-                '{}.*.{}.tif'.format(i, p)))
-            filelist = [file for file in filelist if 'Mosaic' not in file]
+        filelist = ' '.join(filelist)
+        start, end = sorted(datelist)[0], sorted(datelist)[-1]
 
-            # create
-            datelist = []
-            for file in filelist:
-                datelist.append(os.path.basename(file).split('.')[1])
+        if start == end:
+            outfile = opj(ts_dir, '{}.{}.bs.{}.tif'.format(i, start, p))
+        else:
+            outfile = opj(ts_dir, '{}.{}-{}.bs.{}.tif'.format(i, start, end, p))
 
-            filelist = ' '.join(filelist)
-            start, end = sorted(datelist)[0], sorted(datelist)[-1]
+        check_file = opj(
+            os.path.dirname(outfile),
+            '.{}.processed'.format(os.path.basename(outfile)[:-4])
+        )
 
-            if start == end:
-                outfile = opj(ts_dir, '{}.{}.bs.{}.tif'.format(i, start, p))
-            else:
-                outfile = opj(ts_dir, '{}.{}-{}.bs.{}.tif'.format(i, start, end, p))
+        outfiles.append(outfile)
 
-            check_file = opj(
-                os.path.dirname(outfile),
-                '.{}.processed'.format(os.path.basename(outfile)[:-4])
-            )
-               # logfile = opj(ts_dir, '{}.{}-{}.bs.{}.errLog'.format(i, start, end, p))
+        if os.path.isfile(check_file):
+            print(' INFO: Mosaic layer {} already'
+                  ' processed.'.format(os.path.basename(outfile)))
+            continue
 
-            outfiles.append(outfile)
+        print(' INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
+        mosaic.mosaic(filelist, outfile, temp_dir, cut_to_aoi)
 
-            if os.path.isfile(check_file):
-                print(' INFO: Mosaic layer {} already'
-                      ' processed.'.format(os.path.basename(outfile)))
-                continue
+    # create vrt
+    vrt_options = gdal.BuildVRTOptions(srcNodata=0, separate=True)
+    gdal.BuildVRT(opj(ts_dir, 'Timeseries.{}.vrt'.format(p)),
+                  outfiles,
+                  options=vrt_options
+    )
 
-            print(' INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
-            mosaic.mosaic(filelist, outfile, temp_dir, cut_to_aoi)
 
-        if exec_file:
-            print(' gdalbuildvrt ....command, outfiles')
+def mosaic_timeseries(inventory_df, processing_dir, temp_dir, cut_to_aoi=False,
+                      exec_file=None):
+
+    print(' -----------------------------------')
+    print(' INFO: Mosaicking Time-series layers')
+    print(' -----------------------------------')
+
+    # create output folder
+    ts_dir = opj(processing_dir, 'Mosaic', 'Timeseries')
+    os.makedirs(ts_dir, exist_ok=True)
+
+    manifest = Manifest(exec_file) if exec_file else None
+    tracks = inventory_df.relativeorbit.unique()
+
+    # loop through polarisations
+    for p in ['VV', 'VH', 'HH', 'HV']:
+
+        if manifest is not None:
+            manifest.add('mosaic-timeseries.{}'.format(p),
+                         'mosaic-timeseries',
+                         _mosaic_timeseries_polarisation,
+                         dict(processing_dir=processing_dir,
+                              temp_dir=temp_dir, track=tracks[0], p=p,
+                              cut_to_aoi=cut_to_aoi),
+                         depends=manifest.ids('timeseries'))
             continue
 
-        # create vrt
-        vrt_options = gdal.BuildVRTOptions(srcNodata=0, separate=True)
-        gdal.BuildVRT(opj(ts_dir, 'Timeseries.{}.vrt'.format(p)),
-                      outfiles,
-                      options=vrt_options
-        )
+        _mosaic_timeseries_polarisation(processing_dir, temp_dir, tracks[0],
+                                        p, cut_to_aoi)
 
+    if manifest is not None:
+        manifest.write()
 
-def mosaic_timescan(inventory_df, processing_dir, temp_dir, proc_file,
-                    cut_to_aoi=False, exec_file=None):
+
+def _timescan_metrics(proc_file):
+    '''Returns the names of the timescan layers of the processing file'''
 
     # load ard parameters
     with open(proc_file, 'r') as ard_file:
@@ -384,42 +571,82 @@ def mosaic_timescan(inventory_df, processing_dir, temp_dir, proc_file,
             metrics.remove('percentiles')
             metrics.extend(['p95', 'p5'])
 
-    # create out directory of not existent
+    return metrics
+
+
+def _mosaic_timescan_layer(processing_dir, temp_dir, polar, metric,
+                           cut_to_aoi=False):
+    '''Mosaics one timescan layer of all tracks
+
+    Args:
+        processing_dir (str): the directory of the ARD products
+        temp_dir (str): the directory for intermediate products
+        polar (str): the polarisation
+        metric (str): the timescan metric
+        cut_to_aoi (str): the WKT of the AOI to cut the mosaic to (optional)
+    '''
+
     tscan_dir = opj(processing_dir, 'Mosaic', 'Timescan')
     os.makedirs(tscan_dir, exist_ok=True)
-    outfiles = []
 
-    # loop through all pontial proucts
-    for polar, metric in itertools.product(['VV', 'HH', 'VH', 'HV'], metrics):
+    # create a list of files based on polarisation and metric
+    filelist = glob.glob(opj(processing_dir, '*', 'Timescan',
+                             '*bs.{}.{}.tif'.format(polar, metric)
+                        )
+               )
 
-        # create a list of files based on polarisation and metric
-        filelist = glob.glob(opj(processing_dir, '*', 'Timescan',
-                                 '*bs.{}.{}.tif'.format(polar, metric)
-                            )
-                   )
+    # break loop if there are no files
+    if not len(filelist) >= 2:
+        return
 
-        # break loop if there are no files
-        if not len(filelist) >= 2:
-            continue
+    # get number
+    filelist = ' '.join(filelist)
+    outfile = opj(tscan_dir, 'bs.{}.{}.tif'.format(polar, metric))
+    check_file = opj(
+            os.path.dirname(outfile),
+            '.{}.processed'.format(os.path.basename(outfile)[:-4])
+    )
 
-        # get number
-        filelist = ' '.join(filelist)
-        outfile = opj(tscan_dir, 'bs.{}.{}.tif'.format(polar, metric))
-        check_file = opj(
-                os.path.dirname(outfile),
-                '.{}.processed'.format(os.path.basename(outfile)[:-4])
-        )
+    if os.path.isfile(check_file):
+        print(' INFO: Mosaic layer {} already '
+              ' processed.'.format(os.path.basename(outfile)))
+        return
 
-        if os.path.isfile(check_file):
-            print(' INFO: Mosaic layer {} already '
-                  ' processed.'.format(os.path.basename(outfile)))
+    print(' INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
+    mosaic.mosaic(filelist, outfile, temp_dir, cut_to_aoi)
+
+
+def mosaic_timescan(inventory_df, processing_dir, temp_dir, proc_file,
+                    cut_to_aoi=False, exec_file=None):
+
+    metrics = _timescan_metrics(proc_file)
+
+    # create out directory of not existent
+    tscan_dir = opj(processing_dir, 'Mosaic', 'Timescan')
+    os.makedirs(tscan_dir, exist_ok=True)
+
+    manifest = Manifest(exec_file) if exec_file else None
+
+    # loop through all pontial proucts
+    for polar, metric in itertools.product(['VV', 'HH', 'VH', 'HV'], metrics):
+
+        if manifest is not None:
+            manifest.add('mosaic-timescan.{}.{}'.format(polar, metric),
+                         'mosaic-timescan', _mosaic_timescan_layer,
+                         dict(processing_dir=processing_dir,
+                              temp_dir=temp_dir, polar=polar, metric=metric,
+                              cut_to_aoi=cut_to_aoi),
+                         depends=manifest.ids('timescan'))
             continue
 
-        print(' INFO: Mosaicking layer {}.'.format(os.path.basename(outfile)))
-        mosaic.mosaic(filelist, outfile, temp_dir, cut_to_aoi)
-        outfiles.append(outfile)
+        _mosaic_timescan_layer(processing_dir, temp_dir, polar, metric,
+                               cut_to_aoi)
 
-    if exec_file:
-        print(' gdalbuildvrt ....command, outfiles')
+    if manifest is not None:
+        manifest.add('mosaic-timescan-vrt', 'mosaic-timescan-vrt',
+                     ras.create_tscan_vrt,
+                     dict(timescan_dir=tscan_dir, proc_file=proc_file),
+                     depends=manifest.ids('mosaic-timescan'))
+        manifest.write()
     else:
         ras.create_tscan_vrt(tscan_dir, proc_file)
@@ -13,6 +13,8 @@ Functions:
 ----------------
     _slice_assembly:
         creates an urllib opener object for authentication on scihub server
+    _grd_import:
+        imports the frames of an acquisition and removes the border noise
     _grd_frame_import:
         gets the next page from a multi-page result from a scihub search
     _grd_remove_border:
@@ -26,6 +28,8 @@ Functions:
         writes the search result into an ESRI Shapefile
     _grd_terrain_correction:
         writes the search result into a PostGreSQL/PostGIS Database
+    _grd_to_ard_fused:
+        runs the whole workflow as a single SNAP graph
 
 ------------------
 Main function
@@ -69,12 +73,14 @@ import json
 import glob
 import shutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 import rasterio
 import numpy as np
 import gdal
 
 from os.path import join as opj
-from ost.helpers import helpers as h, raster as ras
+from ost.helpers import helpers as h, raster as ras, snap_graph, cache
+from ost.helpers import resources
 
 # script infos
 __author__ = 'Andreas Vollrath'
@@ -86,7 +92,8 @@ __email__ = ''
 __status__ = 'Production'
 
 
-def _grd_frame_import(infile, outfile, logfile, polarisation='VV,VH,HH,HV'):
+def _grd_frame_import(infile, outfile, logfile, polarisation='VV,VH,HH,HV',
+                      ncores=os.cpu_count()):
     '''A wrapper of SNAP import of a single Sentinel-1 GRD product
 
     This function takes an original Sentinel-1 scene (either zip or
@@ -104,6 +111,7 @@ def _grd_frame_import(infile, outfile, logfile, polarisation='VV,VH,HH,HV'):
         polarisation (str): a string consisiting of the polarisation (comma separated)
                      e.g. 'VV,VH',
                      default value: 'VV,VH,HH,HV'
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     print(' INFO: Importing {} by applying precise orbit file and'
@@ -119,7 +127,7 @@ def _grd_frame_import(infile, outfile, logfile, polarisation='VV,VH,HH,HV'):
     # construct command
     command = '{} {} -x -q {} -Pinput=\'{}\' -Ppolarisation={} \
                -Poutput=\'{}\''.format(
-                   gpt_file, graph, os.cpu_count(), infile, polarisation, outfile)
+                   gpt_file, graph, ncores, infile, polarisation, outfile)
 
     # run command
     return_code = h.run_command(command, logfile)
@@ -130,13 +138,13 @@ def _grd_frame_import(infile, outfile, logfile, polarisation='VV,VH,HH,HV'):
     else:
         print(' ERROR: Frame import exited with an error. \
                 See {} for Snap Error output'.format(logfile))
-        sys.exit(102)
 
     return return_code
 
 
 def _grd_frame_import_subset(infile, outfile, georegion,
-                             logfile, polarisation='VV,VH,HH,HV'):
+                             logfile, polarisation='VV,VH,HH,HV',
+                             ncores=os.cpu_count()):
     '''A wrapper of SNAP import of a subset of single Sentinel-1 GRD product
 
     This function takes an original Sentinel-1 scene (either zip or
@@ -158,6 +166,7 @@ def _grd_frame_import_subset(infile, outfile, georegion,
                      default value: 'VV,VH,HH,HV'
         georegion (str): a WKT style formatted POLYGON that bounds the
                          subset region
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     print(' INFO: Importing {} by applying precise orbit file and'
@@ -174,7 +183,7 @@ def _grd_frame_import_subset(infile, outfile, georegion,
     # construct command
     command = '{} {} -x -q {} -Pinput=\'{}\' -Pregion=\'{}\' -Ppolarisation={} \
                       -Poutput=\'{}\''.format(
-                          gpt_file, graph, 2 * os.cpu_count(),
+                          gpt_file, graph, 2 * ncores,
                           infile, georegion, polarisation, outfile)
 
     # run command and get return code
@@ -190,7 +199,8 @@ def _grd_frame_import_subset(infile, outfile, georegion,
     return return_code
 
 
-def _slice_assembly(filelist, outfile, logfile, polarisation='VV,VH,HH,HV'):
+def _slice_assembly(filelist, outfile, logfile, polarisation='VV,VH,HH,HV',
+                    ncores=os.cpu_count()):
     '''A wrapper of SNAP's slice assembly routine
 
     This function assembles consecutive frames acquired at the same date.
@@ -203,6 +213,7 @@ def _slice_assembly(filelist, outfile, logfile, polarisation='VV,VH,HH,HV'):
                  file written in BEAM-Dimap format
         logfile: string or os.path object for the file
                  where SNAP'S STDOUT/STDERR is written to
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     print(' INFO: Assembling consecutive frames:')
@@ -213,7 +224,7 @@ def _slice_assembly(filelist, outfile, logfile, polarisation='VV,VH,HH,HV'):
     # construct command
     command = '{} SliceAssembly -x -q {} -PselectedPolarisations={} \
                -t \'{}\' {}'.format(
-                   gpt_file, 2 * os.cpu_count(), polarisation, outfile, filelist)
+                   gpt_file, 2 * ncores, polarisation, outfile, filelist)
 
     # run command and get return code
     return_code = h.run_command(command, logfile)
@@ -228,7 +239,7 @@ def _slice_assembly(filelist, outfile, logfile, polarisation='VV,VH,HH,HV'):
     return return_code
 
 
-def _grd_subset(infile, outfile, logfile, region):
+def _grd_subset(infile, outfile, logfile, region, ncores=os.cpu_count()):
     '''A wrapper around SNAP's subset routine
 
     This function takes an OST imported frame and subsets it according to
@@ -242,6 +253,7 @@ def _grd_subset(infile, outfile, logfile, region):
         logfile: string or os.path object for the file
                  where SNAP'S STDOUT/STDERR is written to
         region (str): a list of image coordinates that bound the subset region
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     # get Snap's gpt file
@@ -252,7 +264,7 @@ def _grd_subset(infile, outfile, logfile, region):
 
     # construct command
     command = '{} Subset -x -q {} -Pregion={} -t \'{}\' \'{}\''.format(
-        gpt_file, os.cpu_count(), region, outfile, infile)
+        gpt_file, ncores, region, outfile, infile)
 
     # run command and get return code
     return_code = h.run_command(command, logfile)
@@ -267,7 +279,8 @@ def _grd_subset(infile, outfile, logfile, region):
     return return_code
 
 
-def _grd_subset_georegion(infile, outfile, logfile, georegion):
+def _grd_subset_georegion(infile, outfile, logfile, georegion,
+                          ncores=os.cpu_count()):
     '''A wrapper around SNAP's subset routine
 
     This function takes an OST imported frame and subsets it according to
@@ -282,6 +295,7 @@ def _grd_subset_georegion(infile, outfile, logfile, georegion):
                  where SNAP'S STDOUT/STDERR is written to
         georegion (str): a WKT style formatted POLYGON that bounds the
                    subset region
+        ncores (int): number of threads used by SNAP's gpt
     '''
     
     print(' INFO: Subsetting imported imagery.')
@@ -291,7 +305,7 @@ def _grd_subset_georegion(infile, outfile, logfile, georegion):
     # extract window from scene
     command = '{} Subset -x -q {} -Ssource=\'{}\' -t \'{}\' \
                  -PcopyMetadata=true -PgeoRegion=\'{}\''.format(
-                     gpt_file, 2 * os.cpu_count(), infile, outfile, georegion)
+                     gpt_file, 2 * ncores, infile, outfile, georegion)
 
     # run command and get return code
     return_code = h.run_command(command, logfile)
@@ -306,7 +320,7 @@ def _grd_subset_georegion(infile, outfile, logfile, georegion):
     return return_code
 
 
-def _grd_remove_border(infile):
+def _grd_remove_border(infile, strip=3000, buffer=150, block_rows=1024):
     '''An OST function to remove GRD border noise from Sentinel-1 data
 
     This is a custom routine to remove GRD border noise
@@ -322,9 +336,16 @@ def _grd_remove_border(infile):
     the value to 0. All further columns towards the inner image are
     considered valid.
 
+    The column means of both strips are accumulated over blocks of rows,
+    so that only the zeroed columns are written and neither strip is
+    held in memory as a whole.
+
     Args:
         infile: string or os.path object for a
                 gdal compatible intensity file of Sentinel-1
+        strip (int): number of outer columns checked on each side
+        buffer (int): number of columns zeroed beyond the first valid one
+        block_rows (int): number of rows read at once
 
     Notes:
         The file will be manipulated inplace, meaning,
@@ -336,81 +357,55 @@ def _grd_remove_border(infile):
 
     # read raster file and get number of columns adn rows
     raster = gdal.Open(infile, gdal.GA_Update)
+    band = raster.GetRasterBand(1)
     cols = raster.RasterXSize
     rows = raster.RasterYSize
+    strip = min(strip, cols)
+    cols_last = cols - strip
+
+    # column means of the left and right strip
+    sum_left = np.zeros(strip, dtype=np.float64)
+    sum_right = np.zeros(strip, dtype=np.float64)
+    for row in range(0, rows, block_rows):
+        nrows = min(block_rows, rows - row)
+        sum_left += band.ReadAsArray(0, row, strip, nrows).sum(
+            axis=0, dtype=np.float64)
+        sum_right += band.ReadAsArray(cols_last, row, strip, nrows).sum(
+            axis=0, dtype=np.float64)
+
+    valid_left = np.flatnonzero(sum_left / rows > 100)
+    valid_right = np.flatnonzero(sum_right[1:] / rows > 100) + 1
+
+    # the first valid column from the outside plus the buffer
+    # (the last buffer column itself is kept, as in former versions)
+    if valid_left.size:
+        cols_left = min(valid_left[0] + buffer, strip) - 1
+    else:
+        cols_left = strip
 
-    # create 3000xrows array for the left part of the image
-    array_left = np.array(raster.GetRasterBand(1).ReadAsArray(0,
-                                                              0, 3000, rows))
-
-    for x in range(3000):
-        # condition if more than 50 pixels within the line have values
-        # less than 500, delete the line
-        # if np.sum(np.where((array_left[:,x] < 200)
-        # & (array_left[:,x] > 0) , 1, 0)) <= 50:
-        if np.mean(array_left[:, x]) <= 100:
-            array_left[:, x].fill(0)
-        else:
-            z = x + 150
-            if z > 3000:
-                z = 3000
-            for y in range(x, z, 1):
-                array_left[:, y].fill(0)
-
-            cols_left = y
-            break
-
-    try:
-        cols_left
-    except NameError:
-        cols_left = 3000
-
-    # write array_left to disk
-    # print(' INFO: Total amount of columns: {}'.format(cols_left))
-    # print(' INFO: Number of colums set to 0 on the left side: '
-    #     ' {}'.format(cols_left))
-    # raster.GetRasterBand(1).WriteArray(array_left[:, :+cols_left], 0, 0, 1)
-    raster.GetRasterBand(1).WriteArray(array_left[:, :+cols_left], 0, 0)
-
-    array_left = None
-
-    # create 2d array for the right part of the image (3000 columns and rows)
-    cols_last = cols - 3000
-    array_right = np.array(raster.GetRasterBand(1).ReadAsArray(cols_last,
-                                                               0, 3000, rows))
-
-    # loop through the array_right columns in opposite direction
-    for x in range(2999, 0, -1):
-
-        if np.mean(array_right[:, x]) <= 100:
-            array_right[:, x].fill(0)
-        else:
-            z = x - 150
-            if z < 0:
-                z = 0
-            for y in range(x, z, -1):
-                array_right[:, y].fill(0)
-
-            cols_right = y
-            break
-
-    try:
-        cols_right
-    except NameError:
-        cols_right = 0
-
-    #
-    col_right_start = cols - 3000 + cols_right
-    # print(' INFO: Number of columns set to 0 on the'
-    #     ' right side: {}'.format(3000 - cols_right))
-    # print(' INFO: Amount of columns kept: {}'.format(col_right_start))
-    raster.GetRasterBand(1).WriteArray(array_right[:, cols_right:],
-                                       col_right_start, 0)
-    array_right = None
+    # the first column of the right strip is never checked
+    if valid_right.size:
+        cols_right = max(valid_right[-1] - buffer, 0) + 1
+    else:
+        cols_right = 1
+
+    # write zeros to the noisy columns only
+    for col_start, ncols in [(0, cols_left),
+                             (cols_last + cols_right, strip - cols_right)]:
+        if ncols <= 0:
+            continue
+        for row in range(0, rows, block_rows):
+            nrows = min(block_rows, rows - row)
+            band.WriteArray(np.zeros((nrows, ncols), dtype=np.float32),
+                            col_start, row)
+
+    band.FlushCache()
+    raster = None
     h.timer(currtime)
 
 
-def _grd_backscatter(infile, outfile, logfile, dem_dict, product_type='GTCgamma'):
+def _grd_backscatter(infile, outfile, logfile, dem_dict, product_type='GTCgamma',
+                     ncores=os.cpu_count()):
     '''A wrapper around SNAP's radiometric calibration
 
     This function takes OST imported Sentinel-1 product and generates
@@ -437,7 +432,7 @@ def _grd_backscatter(infile, outfile, logfile, dem_dict, product_type='GTCgamma'
                        'SRTM 3sec'
                        'ASTER 1sec GDEM'
                        'ACE30'
-
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     # get path to SNAP's command line executable gpt
@@ -468,13 +463,13 @@ def _grd_backscatter(infile, outfile, logfile, dem_dict, product_type='GTCgamma'
                                  ' -Pdem_nodata=\'{}\'' 
                                  ' -Pdem_resampling=\'{}\''
                                  ' -Poutput=\'{}\''.format(
-            gpt_file, graph, 2 * os.cpu_count(), infile, 
+            gpt_file, graph, 2 * ncores, infile, 
             dem_dict['dem name'], dem_dict['dem file'], 
             dem_dict['dem nodata'], dem_dict['dem resampling'], 
             outfile))
     else:
         command = '{} {} -x -q {} -Pinput=\'{}\' -Poutput=\'{}\''.format(
-            gpt_file, graph, 2 * os.cpu_count(), infile, outfile)
+            gpt_file, graph, 2 * ncores, infile, outfile)
 
     # run command and get return code
     return_code = h.run_command(command, logfile)
@@ -489,7 +484,7 @@ def _grd_backscatter(infile, outfile, logfile, dem_dict, product_type='GTCgamma'
     return return_code
 
 
-def _grd_speckle_filter(infile, outfile, logfile):
+def _grd_speckle_filter(infile, outfile, logfile, ncores=os.cpu_count()):
     '''A wrapper around SNAP's Lee-Sigma Speckle Filter
 
     This function takes OST imported Sentinel-1 product and applies
@@ -503,6 +498,7 @@ def _grd_speckle_filter(infile, outfile, logfile):
                  file written in BEAM-Dimap format
         logfile: string or os.path object for the file
                  where SNAP'S STDOUT/STDERR is written to
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     # get path to SNAP's command line executable gpt
@@ -511,7 +507,7 @@ def _grd_speckle_filter(infile, outfile, logfile):
     print(' INFO: Applying the Lee-Sigma Speckle Filter')
     # contrcut command string
     command = '{} Speckle-Filter -x -q {} -PestimateENL=true \
-              -t \'{}\' \'{}\''.format(gpt_file, 2 * os.cpu_count(),
+              -t \'{}\' \'{}\''.format(gpt_file, 2 * ncores,
                                        outfile, infile)
 
     # run command and get return code
@@ -527,43 +523,41 @@ def _grd_speckle_filter(infile, outfile, logfile):
     return return_code
 
 
-def _grd_to_db(infile, outfile, logfile):
-    '''A wrapper around SNAP's linear to db routine
+def _grd_to_db(infile, logfile, ncores=os.cpu_count()):
+    '''Converts an OST calibrated product to dB-scale in place
 
-    This function takes an OST calibrated Sentinel-1 product
-    and converts it to dB.
+    This function takes an OST calibrated Sentinel-1 product and
+    converts its intensity bands to dB. Instead of a gpt call of SNAP's
+    LinearToFromdB, the bands are converted block-wise by rasterio and
+    numpy, so neither a JVM is started nor a copy of the product written.
 
     Args:
         infile: string or os.path object for
-                an OST imported frame in BEAM-Dimap format (i.e. *.dim)
-        outfile: string or os.path object for the output
-                 file written in BEAM-Dimap format
+                an OST calibrated product in BEAM-Dimap format (i.e. *.dim)
         logfile: string or os.path object for the file
-                 where SNAP'S STDOUT/STDERR is written to
-    '''
+                 where the error message is written to
+        ncores (int): number of bands converted at once
 
-    # get path to SNAP's command line executable gpt
-    gpt_file = h.gpt_path()
+    Returns:
+        int: 0 on success, 1 on failure
+    '''
 
     print(' INFO: Converting the image to dB-scale.')
-    # construct command string
-    command = '{} LinearToFromdB -x -q {} -t \'{}\' {}'.format(
-        gpt_file, 2 * os.cpu_count(), outfile, infile)
-
-    # run command and get return code
-    return_code = h.run_command(command, logfile)
-
-    # handle errors and logs
-    if return_code == 0:
-        print(' INFO: Succesfully converted product to dB-scale.')
-    else:
+    try:
+        ras.linear_to_db_dimap(str(infile)[:-4], ncores)
+    except Exception as error:
+        with open(str(logfile), 'w') as file:
+            file.write('{}\n'.format(error))
         print(' ERROR: Linear to dB conversion exited with an error. \
-                See {} for Snap Error output'.format(logfile))
+                See {} for the error output'.format(logfile))
+        return 1
 
-    return return_code
+    print(' INFO: Succesfully converted product to dB-scale.')
+    return 0
 
 
-def _grd_terrain_correction(infile, outfile, logfile, resolution, dem_dict):
+def _grd_terrain_correction(infile, outfile, logfile, resolution, dem_dict,
+                            ncores=os.cpu_count()):
     '''A wrapper around SNAP's Terrain Correction routine
 
     This function takes an OST calibrated Sentinel-1 product and
@@ -583,7 +577,7 @@ def _grd_terrain_correction(infile, outfile, logfile, resolution, dem_dict):
                        'SRTM 3sec'
                        'ASTER 1sec GDEM'
                        'ACE30'
-
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     # get path to SNAP's command line executable gpt
@@ -610,7 +604,7 @@ def _grd_terrain_correction(infile, outfile, logfile, resolution, dem_dict):
                                  ' -Pdem_resampling=\'{}\''
                                  ' -Pimage_resampling=\'{}\''
                                  ' -Poutput=\'{}\''.format(
-            gpt_file, graph, 2 * os.cpu_count(), 
+            gpt_file, graph, 2 * ncores, 
             infile, resolution, multilook_factor, 
             dem_dict['dem name'], dem_dict['dem file'], dem_dict['dem nodata'], 
             dem_dict['dem resampling'], dem_dict['image resampling'],
@@ -629,7 +623,7 @@ def _grd_terrain_correction(infile, outfile, logfile, resolution, dem_dict):
 
 
 def _grd_terrain_correction_deg(infile, outfile, logfile, resolution,
-                                dem='SRTM 1Sec HGT'):
+                                dem='SRTM 1Sec HGT', ncores=os.cpu_count()):
     '''A wrapper around SNAP's Terrain Correction routine
 
     This function takes an OST calibrated Sentinel-1 product and
@@ -649,7 +643,7 @@ def _grd_terrain_correction_deg(infile, outfile, logfile, resolution,
                        'SRTM 3sec'
                        'ASTER 1sec GDEM'
                        'ACE30'
-
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     # get path to SNAP's command line executable gpt
@@ -667,7 +661,7 @@ def _grd_terrain_correction_deg(infile, outfile, logfile, resolution,
 
     # construct command string
     command = '{} {} -x -q {} -Pinput=\'{}\' -Presol={} -Pml={} -Pdem=\'{}\' \
-                 -Poutput=\'{}\''.format(gpt_file, graph, 2 * os.cpu_count(),
+                 -Poutput=\'{}\''.format(gpt_file, graph, 2 * ncores,
                                          infile, resolution, multilook_factor,
                                          dem, outfile)
 
@@ -684,7 +678,8 @@ def _grd_terrain_correction_deg(infile, outfile, logfile, resolution,
     return return_code
 
 
-def _grd_ls_mask(infile, outfile, logfile, resolution, dem_dict):
+def _grd_ls_mask(infile, outfile, logfile, resolution, dem_dict,
+                 ncores=os.cpu_count()):
     '''A wrapper around SNAP's Layover/Shadow mask routine
 
     This function takes OST imported Sentinel-1 product and calculates
@@ -704,7 +699,7 @@ def _grd_ls_mask(infile, outfile, logfile, resolution, dem_dict):
                        'SRTM 3sec'
                        'ASTER 1sec GDEM'
                        'ACE30'
-
+        ncores (int): number of threads used by SNAP's gpt
     '''
 
     # get path to SNAP's command line executable gpt
@@ -728,7 +723,7 @@ def _grd_ls_mask(infile, outfile, logfile, resolution, dem_dict):
                                  ' -Pdem_resampling=\'{}\''
                                  ' -Pimage_resampling=\'{}\''
                                  ' -Poutput=\'{}\''.format(
-            gpt_file, graph, 2 * os.cpu_count(), infile, resolution, 
+            gpt_file, graph, 2 * ncores, infile, resolution, 
             dem_dict['dem name'], dem_dict['dem file'], dem_dict['dem nodata'], 
             dem_dict['dem resampling'], dem_dict['image resampling'],
             outfile))
@@ -745,60 +740,247 @@ def _grd_ls_mask(infile, outfile, logfile, resolution, dem_dict):
     return return_code
 
 
-def grd_to_ard(filelist, 
-               output_dir, 
-               file_id, 
-               temp_dir, 
-               proc_file,
-               subset=None):
-    '''The main function for the grd to ard generation
+def _track_ls_mask(out_dir, ard, subset=None):
+    '''Returns the Layover/Shadow mask shared by a track (None if not shared)
 
-    This function represents the full workflow for the generation of an
-    Analysis-Ready-Data product. The standard parameters reflect the CEOS
-    ARD defintion for Sentinel-1 backcsatter products.
+    With 'ls mask per track' set in the ARD parameters, the mask is only
+    computed for the first acquisition of a relative orbit, since the
+    geometry of the repeat passes is nearly the same.
+    '''
 
-    By changing the parameters, taking care of all parameters
-    that can be given. The function can handle multiple inputs of the same
-    acquisition, given that there are consecutive data takes.
+    if not ard.get('ls mask per track'):
+        return None
+
+    return cache.track_product(out_dir, 'ls_mask',
+                               dict(resolution=ard['resolution'],
+                                    dem=ard['dem'], subset=subset))
+
+
+def _grd_fused_graph(filelist, outfile, ls_outfile, ard, subset=None):
+    '''Builds a single SNAP graph for the whole GRD to ARD chain
+
+    The graph imports each frame (orbit update, thermal noise and border
+    noise removal), assembles consecutive frames, subsets, filters the
+    speckle, calibrates, converts to dB and geocodes the product within
+    one gpt call. The Layover/Shadow mask is a second branch on the
+    calibrated product.
+
+    Args:
+        filelist (list): absolute paths to the GRD frame(s) of an acquisition
+        outfile (str): path of the backscatter product (without .dim)
+        ls_outfile (str): path of the Layover/Shadow mask (without .dim)
+        ard (dict): the single ARD parameters
+        subset (str): a WKT style formatted POLYGON to subset to
+
+    Returns:
+        Graph: the graph of the processing chain
+    '''
+
+    polars = ard['polarisation'].replace(' ', '')
+    graph = snap_graph.Graph()
+
+    # import of the single frames
+    frames = []
+    for idx, file in enumerate(filelist):
+        node = graph.add('Read', node_id='Read({})'.format(idx), file=file)
+        node = graph.add('Apply-Orbit-File', node,
+                         node_id='Apply-Orbit-File({})'.format(idx),
+                         orbitType='Sentinel Precise (Auto Download)',
+                         polyDegree=3, continueOnFail=True)
+        node = graph.add('ThermalNoiseRemoval', node,
+                         node_id='ThermalNoiseRemoval({})'.format(idx),
+                         selectedPolarisations=polars,
+                         removeThermalNoise=True,
+                         reIntroduceThermalNoise=False)
+
+        # SNAP's border noise removal replaces the OST routine, which
+        # would need the frame on disk
+        if ard['remove border noise']:
+            node = graph.add('Remove-GRD-Border-Noise', node,
+                             node_id='Remove-GRD-Border-Noise({})'.format(idx),
+                             selectedPolarisations=polars,
+                             borderLimit=500, trimThreshold=0.5)
+        frames.append(node)
+
+    if len(frames) > 1:
+        node = graph.add('SliceAssembly', frames,
+                         selectedPolarisations=polars)
+
+    if subset:
+        node = graph.add('Subset', node, geoRegion=subset,
+                         subSamplingX=1, subSamplingY=1, fullSwath=False,
+                         copyMetadata=True)
+
+    if ard['remove speckle']:
+        node = graph.add('Speckle-Filter', node, estimateENL=True)
+
+    # calibration
+    product_type = ard['product type']
+    if product_type not in ['RTC', 'GTCgamma', 'GTCsigma']:
+        print(' ERROR: Wrong product type selected.')
+        sys.exit(103)
+
+    node = graph.add('Calibration', node,
+                     outputImageScaleInDb=False,
+                     outputSigmaBand=product_type == 'GTCsigma',
+                     outputGammaBand=product_type == 'GTCgamma',
+                     outputBetaBand=product_type == 'RTC')
+
+    if product_type == 'RTC':
+        node = graph.add('Terrain-Flattening', node,
+                         additionalOverlap=0.15, oversamplingMultiple=1.5,
+                         outputSimulatedImage=False,
+                         **snap_graph.dem_parameters(ard['dem']))
+
+    # the Layover/Shadow mask branch
+    if ard['create ls mask'] is True and ls_outfile:
+        ls_node = graph.add('SAR-Simulation', node,
+                            externalDEMApplyEGM=True,
+                            saveLayoverShadowMask=True,
+                            **snap_graph.dem_parameters(ard['dem']))
+        ls_node = graph.add('Terrain-Correction', ls_node,
+                            node_id='Terrain-Correction(LS)',
+                            **snap_graph.terrain_correction_parameters(
+                                ard['resolution'], ard['dem'],
+                                'layover_shadow_mask'))
+        graph.add('Write', ls_node, node_id='Write(LS)',
+                  file='{}.dim'.format(ls_outfile), formatName='BEAM-DIMAP')
+
+    if ard['to db']:
+        node = graph.add('LinearToFromdB', node)
+
+    # geocoding
+    multilook_factor = int(int(ard['resolution']) / 10)
+    node = graph.add('Multilook', node, nRgLooks=multilook_factor,
+                     nAzLooks=multilook_factor, outputIntensity=False,
+                     grSquarePixel=True)
+    node = graph.add('Terrain-Correction', node,
+                     **snap_graph.terrain_correction_parameters(
+                         ard['resolution'], ard['dem']))
+    graph.add('Write', node, file='{}.dim'.format(outfile),
+              formatName='BEAM-DIMAP')
+
+    return graph
+
+
+def _grd_to_ard_fused(filelist, output_dir, file_id, temp_dir, ard,
+                      subset=None, ncores=os.cpu_count()):
+    '''Runs the whole GRD to ARD chain as a single SNAP graph
+
+    In contrast to the stepwise processing, gpt is started only once and
+    only the final backscatter product and Layover/Shadow mask are written,
+    instead of a full product per processing step.
+
+    Args:
+        filelist (list): absolute paths to the GRD frame(s) of an acquisition
+        output_dir: os.path object or string for the output folder
+        file_id (str): prefix of the final output file
+        temp_dir: os.path object or string for the temp folder
+        ard (dict): the single ARD parameters
+        subset (str): a WKT style formatted POLYGON to subset to
+        ncores (int): number of threads used by SNAP's gpt
+
+    Returns:
+        return_code (int): 0 if the ARD product has been written
+    '''
+
+    print(' INFO: Processing {} with a single SNAP graph.'.format(file_id))
+
+    outfile = opj(temp_dir, '{}.bs'.format(file_id))
+    ls_outfile = opj(temp_dir, '{}.ls_mask'.format(file_id))
+
+    # no Layover/Shadow mask branch if the one of the track is re-used
+    shared_ls = _track_ls_mask(output_dir, ard, subset)
+    ls_exists = shared_ls and os.path.isfile('{}.dim'.format(shared_ls))
+    graph = _grd_fused_graph(filelist, outfile,
+                             None if ls_exists else ls_outfile, ard, subset)
+
+    logfile = opj(output_dir, '{}.ARD.errLog'.format(file_id))
+    return_code = graph.run(opj(temp_dir, '{}.ARD.xml'.format(file_id)),
+                            logfile, ncores)
+    if return_code != 0:
+        print(' ERROR: ARD processing exited with an error. \
+                See {} for Snap Error output'.format(logfile))
+        h.remove_folder_content(temp_dir)
+        return return_code
+
+    # move to final destination
+    products = [(outfile, opj(output_dir, '{}.bs'.format(file_id)), True)]
+    if ard['create ls mask'] is True:
+        if ls_exists:
+            cache.fetch_shared(shared_ls, ls_outfile)
+        products.append(
+            (ls_outfile, opj(output_dir, '{}.LS'.format(file_id)), False))
+
+    for temp_file, out_file, test_stats in products:
+        return_code = h.check_out_dimap(temp_file, test_stats=test_stats)
+        if return_code != 0:
+            h.remove_folder_content(temp_dir)
+            return return_code
+
+        if temp_file == ls_outfile:
+            cache.store_shared(shared_ls, ls_outfile)
+
+        if os.path.exists(out_file + '.dim'):
+            h.delete_dimap(out_file)
+
+        shutil.move('{}.dim'.format(temp_file), '{}.dim'.format(out_file))
+        shutil.move('{}.data'.format(temp_file), '{}.data'.format(out_file))
+
+    h.remove_folder_content(temp_dir)
+
+    # write file, so we know this acquisition has been succesfully processed
+    with open(str(opj(output_dir, '.processed')), 'w') as file:
+        file.write('passed all tests \n')
+
+    print(' INFO: Succesfully processed {}'.format(file_id))
+    return return_code
+
+
+def _grd_import(filelist, output_dir, file_id, temp_dir, polars,
+                subset=None, remove_border=True, ncores=os.cpu_count()):
+    '''Imports the frames of an acquisition and removes the border noise
 
     Args:
         filelist (list): must be a list with one or more absolute
                   paths to GRD scene(s)
         output_dir: os.path object or string for the folder
-                    where the output file should be written#
-        file_id (str): prefix of the final output file
-        temp_dir:
-        resolution: the resolution of the output product in meters
-        ls_mask: layover/shadow mask generation (Boolean)
-        speckle_filter: speckle filtering (Boolean)
+                    where the logfiles are written to
+        file_id (str): prefix of the imported product
+        temp_dir: os.path object or string for the folder
+                  where the imported product is written to
+        polars (str): the polarisations to import, e.g. 'VV,VH'
+        subset (str): WKT of the region to subset to
+        remove_border (bool): removes the GRD border noise (OST routine)
+        ncores (int): number of threads used by SNAP's gpt
 
     Returns:
-        nothing
-
-    Notes:
-        no explicit return value, since output file is our actual return
+        return_code (int): 0 if the product has been imported
+        infile (str): path to the imported product (i.e. *.dim)
     '''
 
-    # load ard parameters
-    with open(proc_file, 'r') as ard_file:
-        ard_params = json.load(ard_file)['processing parameters']
-        ard = ard_params['single ARD']
-        polars = ard['polarisation'].replace(' ', '')
-        
     # slice assembly if more than one scene
     if len(filelist) > 1:
 
-        for file in filelist:
-
+        def _import(file):
             grd_import = opj(temp_dir, '{}_imported'.format(
                 os.path.basename(file)[:-5]))
             logfile = opj(output_dir, '{}.Import.errLog'.format(
                 os.path.basename(file)[:-5]))
             
-            return_code = _grd_frame_import(file, grd_import, logfile, polars)
-            if return_code != 0:
-                h.remove_folder_content(temp_dir)
-                return return_code
+            return _grd_frame_import(file, grd_import, logfile, polars,
+                                     import_cores)
+
+        # import the frames at once, as far as the job's resources allow
+        with resources.divided_budget(len(filelist)) as workers:
+            import_cores = max(1, ncores // workers)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return_codes = list(executor.map(_import, filelist))
+
+        return_code = next((code for code in return_codes if code != 0), 0)
+        if return_code != 0:
+            h.remove_folder_content(temp_dir)
+            return return_code, None
 
         # create list of scenes for full acquisition in
         # preparation of slice assembly
@@ -807,11 +989,11 @@ def grd_to_ard(filelist,
         # create file strings
         grd_import = opj(temp_dir, '{}_imported'.format(file_id))
         logfile = opj(output_dir, '{}._slice_assembly.errLog'.format(file_id))
-        return_code = _slice_assembly(scenelist, grd_import, logfile, 
-                                      )
+        return_code = _slice_assembly(scenelist, grd_import, logfile,
+                                      ncores=ncores)
         if return_code != 0:
             h.remove_folder_content(temp_dir)
-            return return_code
+            return return_code, None
 
         for file in filelist:
             h.delete_dimap(opj(temp_dir, '{}_imported'.format(
@@ -820,10 +1002,11 @@ def grd_to_ard(filelist,
         if subset:
             grd_subset = opj(temp_dir, '{}_imported_subset'.format(file_id))
             return_code = _grd_subset_georegion('{}.dim'.format(grd_import), 
-                                                grd_subset, logfile, subset)
+                                                grd_subset, logfile, subset,
+                                                ncores)
             if return_code != 0:
                 h.remove_folder_content(temp_dir)
-                return return_code
+                return return_code, None
             
             # delete slice assembly
             h.delete_dimap(grd_import)
@@ -835,18 +1018,19 @@ def grd_to_ard(filelist,
 
         if subset is None:
             return_code = _grd_frame_import(filelist[0], grd_import, logfile, 
-                                            polars)
+                                            polars, ncores)
         else:
             return_code = _grd_frame_import_subset(filelist[0], grd_import, 
                                                    subset, logfile, 
-                                                   polars)
+                                                   polars, ncores)
         if return_code != 0:
             h.remove_folder_content(temp_dir)
-            return return_code
+            return return_code, None
     # ---------------------------------------------------------------------
     # Remove the grd border noise from existent channels (OST routine)
 
-    if ard['remove border noise'] and not subset:
+    if remove_border and not subset:
+        infiles = []
         for polarisation in ['VV', 'VH', 'HH', 'HV']:
 
             infile = glob.glob(opj(
@@ -854,13 +1038,88 @@ def grd_to_ard(filelist,
                     'Intensity_{}.img'.format(polarisation)))
 
             if len(infile) == 1:
-                # run grd Border Remove
                 print(' INFO: Remove border noise for {} band.'.format(
                     polarisation))
-                _grd_remove_border(infile[0])
+                infiles.append(infile[0])
+
+        # run grd Border Remove on all polarisations at once
+        if infiles:
+            with ThreadPoolExecutor(max_workers=len(infiles)) as executor:
+                list(executor.map(_grd_remove_border, infiles))
+
+    return 0, glob.glob(opj(temp_dir, '{}_imported*dim'.format(file_id)))[0]
+
+
+def grd_to_ard(filelist, 
+               output_dir, 
+               file_id, 
+               temp_dir, 
+               proc_file,
+               subset=None,
+               ncores=os.cpu_count()):
+    '''The main function for the grd to ard generation
+
+    This function represents the full workflow for the generation of an
+    Analysis-Ready-Data product. The standard parameters reflect the CEOS
+    ARD defintion for Sentinel-1 backcsatter products.
+
+    By changing the parameters, taking care of all parameters
+    that can be given. The function can handle multiple inputs of the same
+    acquisition, given that there are consecutive data takes.
+
+    Args:
+        filelist (list): must be a list with one or more absolute
+                  paths to GRD scene(s)
+        output_dir: os.path object or string for the folder
+                    where the output file should be written#
+        file_id (str): prefix of the final output file
+        temp_dir:
+        resolution: the resolution of the output product in meters
+        ls_mask: layover/shadow mask generation (Boolean)
+        speckle_filter: speckle filtering (Boolean)
+        ncores (int): number of threads used by SNAP's gpt per processing
+                      step (default: all cpus)
+
+    Returns:
+        return_code (int): 0 if the ARD product has been written
+
+    Notes:
+        the output file is our actual return
+
+        If 'fused graph' is set in the ARD parameters, the whole chain
+        runs as a single SNAP graph (see _grd_to_ard_fused).
+    '''
+
+    # load ard parameters
+    with open(proc_file, 'r') as ard_file:
+        ard_params = json.load(ard_file)['processing parameters']
+        ard = ard_params['single ARD']
+        polars = ard['polarisation'].replace(' ', '')
+
+    if ard.get('fused graph'):
+        return _grd_to_ard_fused(filelist, output_dir, file_id, temp_dir,
+                                 ard, subset, ncores)
+
+    # the stages are cached by the hash of their inputs and parameters
+    rootpath = importlib.util.find_spec('ost').submodule_search_locations[0]
+    graph_dir = opj(rootpath, 'graphs', 'S1_GRD2ARD')
+    key = cache.stage_key(
+        'import', [cache.fingerprint(file) for file in filelist],
+        dict(polarisation=polars, subset=subset,
+             border=ard['remove border noise']),
+        [opj(graph_dir, '1_AO_TNR.xml')])
+
+    # import, slice assembly, subset and border noise removal
+    infile = opj(temp_dir, '{}_imported.dim'.format(file_id))
+    if not cache.fetch(key, infile[:-4]):
+        return_code, infile = _grd_import(filelist, output_dir, file_id,
+                                          temp_dir, polars, subset,
+                                          ard['remove border noise'], ncores)
+        if return_code != 0:
+            return return_code
+
+        cache.store(key, infile[:-4])
 
-    # set new infile
-    infile = glob.glob(opj(temp_dir, '{}_imported*dim'.format(file_id)))[0]
     # -------------------------------------------
     # in case we want to apply Speckle filtering
     if ard['remove speckle']:
@@ -869,10 +1128,14 @@ def grd_to_ard(filelist,
         outfile = opj(temp_dir, '{}_spk'.format(file_id))
 
         # run processing
-        return_code = _grd_speckle_filter(infile, outfile, logfile)
-        if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+        key = cache.stage_key('speckle', [key])
+        if not cache.fetch(key, outfile):
+            return_code = _grd_speckle_filter(infile, outfile, logfile, ncores)
+            if return_code != 0:
+                h.remove_folder_content(temp_dir)
+                return return_code
+
+            cache.store(key, outfile)
 
         # delete input
         h.delete_dimap(infile[:-4])
@@ -883,12 +1146,19 @@ def grd_to_ard(filelist,
     # do the calibration
     outfile = opj(temp_dir, '{}.{}'.format(file_id, ard['product type']))
     logfile = opj(output_dir, '{}.Backscatter.errLog'.format(file_id))
-    return_code = _grd_backscatter(infile, outfile, logfile,  
-                                   ard['dem'], ard['product type'])
+    key = cache.stage_key(
+        'calibration', [key], dict(product_type=ard['product type'],
+                                   dem=ard['dem']),
+        sorted(glob.glob(opj(graph_dir, '2_Cal*.xml'))))
+    if not cache.fetch(key, outfile):
+        return_code = _grd_backscatter(infile, outfile, logfile,  
+                                       ard['dem'], ard['product type'], ncores)
     
-    if return_code != 0:
-        h.remove_folder_content(temp_dir)
-        return return_code
+        if return_code != 0:
+            h.remove_folder_content(temp_dir)
+            return return_code
+
+        cache.store(key, outfile)
 
     # delete input file
     h.delete_dimap(infile[:-4])
@@ -901,17 +1171,29 @@ def grd_to_ard(filelist,
     if  ard['create ls mask'] is True:
         outfile = opj(temp_dir, '{}.ls_mask'.format(file_id))
         logfile = opj(output_dir, '{}.ls_mask.errLog'.format(file_id))
-        return_code = _grd_ls_mask(infile, outfile, logfile, ard['resolution'], 
-                                   ard['dem'])
-        if return_code != 0:
-            h.remove_folder_content(temp_dir)
-            return return_code
+        ls_key = cache.stage_key(
+            'ls_mask', [key], dict(resolution=ard['resolution'],
+                                   dem=ard['dem']),
+            [opj(graph_dir, '3_LSmap.xml')])
+
+        # the mask of the track, of a former run, or a new one
+        shared_ls = _track_ls_mask(output_dir, ard, subset)
+        if not (cache.fetch_shared(shared_ls, outfile) or
+                cache.fetch(ls_key, outfile)):
+            return_code = _grd_ls_mask(infile, outfile, logfile,
+                                       ard['resolution'], ard['dem'], ncores)
+            if return_code != 0:
+                h.remove_folder_content(temp_dir)
+                return return_code
+
+            cache.store(ls_key, outfile)
 
         # last check on ls data
         return_code = h.check_out_dimap(outfile, test_stats=False)
         if return_code != 0:
             h.remove_folder_content(temp_dir)
             return return_code
+        cache.store_shared(shared_ls, outfile)
         
         # move to final destination
         out_ls_mask = opj(output_dir, '{}.LS'.format(file_id))
@@ -927,18 +1209,10 @@ def grd_to_ard(filelist,
     # to db
     if ard['to db']:
         logfile = opj(output_dir, '{}.linToDb.errLog'.format(file_id))
-        outfile = opj(temp_dir, '{}_{}_db'.format(file_id, 
-                      ard['product type']))
-        return_code = _grd_to_db(infile, outfile, logfile)
+        return_code = _grd_to_db(infile, logfile, ncores)
         if return_code != 0:
             h.remove_folder_content(temp_dir)
             return return_code
-        
-        # delete
-        h.delete_dimap(infile[:-4])
-        # re-define infile
-        infile = opj(temp_dir, '{}_{}_db.dim'.format(file_id, 
-                     ard['product type']))
 
     # -----------------------
     # let's geocode the data
@@ -947,7 +1221,7 @@ def grd_to_ard(filelist,
     logfile = opj(output_dir, '{}.bs.errLog'.format(file_id))
     return_code = _grd_terrain_correction(infile, outfile, logfile, 
                                           ard['resolution'], 
-                                          ard['dem'])
+                                          ard['dem'], ncores)
     if return_code != 0:
         h.remove_folder_content(temp_dir)
         return return_code
@@ -978,8 +1252,9 @@ def grd_to_ard(filelist,
     else:
         h.remove_folder_content(temp_dir)
         h.remove_folder_content(output_dir)
-        
-    
+
+    return return_code
+
 
 def ard_to_rgb(infile, outfile, driver='GTiff', to_db=True):
 
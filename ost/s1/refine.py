@@ -4,17 +4,24 @@ This script allows to sort Sentinel-1 data for homogeneous large-scale mapping.
 """
 
 # import stdlib modules
+import os
+import time
+import heapq
 import itertools
+import multiprocessing
+from datetime import timedelta
 
 # some more libs for plotting and DB connection
 import fiona
 import geopandas as gpd
 
 from shapely.ops import unary_union
+from shapely.prepared import prep
+from shapely.geometry import Polygon
 
 # import internal modules
 from ost.helpers.db import pgHandler
-from ost.helpers import vector as vec
+from ost.helpers import vector as vec, helpers as h
 
 # script infos
 __author__ = 'Andreas Vollrath'
@@ -165,31 +172,29 @@ def _handle_equator_crossing(inventory_df):
         inventory_df['relativeorbit'] != inventory_df[
             'lastrelativeorbitnumber']].unique().tolist()
 
-    for track in tracks:
+    if not tracks:
+        return inventory_df
 
-        # get dates
-        dates = inventory_df.acquisitiondate[
-            (inventory_df['relativeorbit'] == track)].unique()
-        for date in dates:
+    # ----------------------------------------------------
+    # ### NEEDS TO BE ADDED THE CHECK
+    # check if consecutive orbitnumers are from the same track
+    # ----------------------------------------------------
+
+    # all (date, track) groups of those tracks with their new track id
+    groups = inventory_df.loc[
+        inventory_df['relativeorbit'].isin(tracks),
+        ['acquisitiondate', 'relativeorbit']].drop_duplicates()
+    groups['new_relativeorbit'] = [
+        str(int(track) - 1) for track in groups['relativeorbit']]
 
-            # ----------------------------------------------------
-            # ### NEEDS TO BE ADDED THE CHECK
-            # check if consecutive orbitnumers are from the same track
-            # subdf = inventory_df[(inventory_df['acquisitiondate'] == date) &
-            #                     (inventory_df['relativeorbit'] == track) |
-            #                     (inventory_df['acquisitiondate'] == date) &
-            #                     (inventory_df['relativeorbit'] ==
-            #             str(int(track) - 1))].sort_values(['beginposition'])
-            #
-            # for row in subdf.iterrows():
-            # ----------------------------------------------------
-
-            # get index of
-            idx = inventory_df[(inventory_df['acquisitiondate'] == date) &
-                               (inventory_df['relativeorbit'] == track)].index
-
-            # reset relative orbit number
-            inventory_df.set_value(idx, 'relativeorbit', str(int(track) - 1))
+    # join the new track ids and reset relative orbit number
+    new_tracks = inventory_df[['acquisitiondate', 'relativeorbit']].merge(
+        groups, how='left', on=['acquisitiondate', 'relativeorbit'])
+    new_tracks.index = inventory_df.index
+
+    inventory_df = inventory_df.copy()
+    inventory_df['relativeorbit'] = new_tracks['new_relativeorbit'].fillna(
+        inventory_df['relativeorbit'])
 
     return inventory_df
 
@@ -347,70 +352,197 @@ def _handle_non_continous_swath(inventory_df):
     return inventory_df
 
 
+class _Coverage():
+    '''Incrementally tracks the part of the AOI covered by footprints
+
+    Pieces are expected to be already clipped to the AOI. Only the part of
+    a new piece that is not yet covered adds to the covered area, and
+    pieces that lie completely within the covered part are skipped without
+    any further geometric operation.
+    '''
+
+    def __init__(self):
+        self.geometry = None
+        self.area = 0
+        self._prepared = None
+
+    def add(self, piece):
+
+        if piece.is_empty:
+            return
+
+        if self.geometry is None:
+            self.geometry, self.area = piece, piece.area
+        elif not self._prepared.contains(piece):
+            self.area += piece.difference(self.geometry).area
+            self.geometry = self.geometry.union(piece)
+        else:
+            return
+
+        self._prepared = prep(self.geometry)
+
+
+def _equal_area_footprints(aoi_gdf, inventory_df, area_reduce=0):
+    '''Projects AOI and footprints into an equal-area projection
+
+    Args:
+        aoi_gdf (gdf): the aoi as an GeoDataFrame
+        inventory_df (gdf): an OST compliant Sentinel-1 inventory GeoDataFrame
+        area_reduce (float): reduction of AOI by square degrees
+
+    Returns:
+        aoi_geom (geometry): the unified and projected AOI
+        geoms (array): the projected footprints, in the order of inventory_df
+        min_area (float): the covered area (in m²) needed for a full coverage
+
+    '''
+
+    proj4 = vec.equal_area_proj4(aoi_gdf.unary_union)
+    aoi_geom = vec.to_equal_area(aoi_gdf, proj4).unary_union
+    geoms = vec.to_equal_area(inventory_df, proj4).geometry.values
+
+    # area_reduce is given in square degrees, so we scale it by the AOI
+    aoi_area = aoi_geom.area
+    min_area = aoi_area - area_reduce * aoi_area / aoi_gdf.area.sum()
+
+    return aoi_geom, geoms, min_area
+
+
+def _footprint_unions(aoi_gdf, inventory_df, area_reduce=0):
+    '''Prepares the per-date and per-track footprints for the coverage search
+
+    All geometries are projected into an equal-area projection centred on
+    the AOI. The footprints of each date/track combination are unified and
+    clipped to the AOI once, so that the searches only need to add up
+    pre-computed pieces.
+
+    Args:
+        aoi_gdf (gdf): the aoi as an GeoDataFrame
+        inventory_df (gdf): an OST compliant Sentinel-1 inventory GeoDataFrame
+        area_reduce (float): reduction of AOI by square degrees
+
+    Returns:
+        unions (dict): (date, track) as key, and a tuple of the positional
+                       indices of the frames and their unified footprint
+                       within the AOI as value
+        min_area (float): the covered area (in m²) needed for a full coverage
+
+    '''
+
+    aoi_geom, geoms, min_area = _equal_area_footprints(
+        aoi_gdf, inventory_df, area_reduce)
+    prepared_aoi = prep(aoi_geom)
+
+    unions = {}
+    for key, positions in inventory_df.groupby(
+            ['acquisitiondate', 'relativeorbit']).indices.items():
+
+        union = unary_union([geoms[i] for i in positions])
+        if prepared_aoi.intersects(union):
+            piece = aoi_geom.intersection(union)
+        else:
+            piece = Polygon()
+
+        unions[key] = (list(positions), piece)
+
+    return unions, min_area
+
+
 def _forward_search(aoi_gdf, inventory_df, area_reduce=0):
     '''
     This functions loops through the acquisition dates and
     identifies the time interval needed to create full coverages.
     '''
 
-    # get AOI area
-    aoi_area = aoi_gdf.area.sum()
+    # get unified footprints per date and track
+    unions, min_area = _footprint_unions(aoi_gdf, inventory_df, area_reduce)
 
     # initialize some stuff for subsequent for-loop
-    intersect_area, i = 0, 0
-    datelist = []
-    gdf_union = None
-    start_date = None
-    out_frame = gpd.GeoDataFrame(columns=inventory_df.columns)
+    datelist, positions = [], []
+    coverage, start_date = _Coverage(), None
 
-    # loop through dates
-    for date in sorted(inventory_df['acquisitiondate'].unique(),
-                       reverse=False):
+    # loop through dates and the tracks of each date
+    for date, track in sorted(unions):
 
         # set starting date for curent mosaic
         if start_date is None:
             start_date = date
 
-            # ofr th emoment, just take the first mosaic
-            if i != 0:
-                break
+        # add to overall coverage and to out_frame
+        frames, piece = unions[(date, track)]
+        positions.extend(frames)
+        coverage.add(piece)
+
+        # for the datelist, we reset some stuff for next mosaic
+        if coverage.area >= min_area:
+            datelist.append([start_date, date])
+            start_date = None
+            coverage = _Coverage()
 
-        # create a list of tracks for that date (sometimes more than one)
-        tracklist = inventory_df['relativeorbit'][
-            (inventory_df['acquisitiondate'] == date)].unique()
+    return datelist, gpd.GeoDataFrame(inventory_df.iloc[positions],
+                                      geometry='geometry')
 
-        for track in tracklist:
 
-            # get all footprints for each date
-            gdf = inventory_df[(inventory_df['acquisitiondate'] == date) &
-                               (inventory_df['relativeorbit'] == track)]
+def _backward_period(unions, tracks_per_date, min_area, dates,
+                     candidates=None, coverage=None):
+    '''Selects the frames of a single mosaic period backwards in time
 
-            # get a unified geometry for date/track combination
-            union = gdf.geometry.unary_union
+    Args:
+        unions (dict): the footprints per date and track (see
+                       _footprint_unions)
+        tracks_per_date (dict): the tracks of each date
+        min_area (float): the covered area needed for a full coverage
+        dates (list): start and end date of the mosaic period
+        candidates (list): frames carried over from an incomplete period
+        coverage (_Coverage): the coverage of the carried over frames
 
-            # add to overall union and to out_frame
-            out_frame = out_frame.append(gdf)
+    Returns:
+        complete (bool): True if the AOI is fully covered
+        candidates (list): positional indices of the frames
+        coverage (_Coverage): the coverage of the frames
+    '''
 
-            # just for first loop
-            if gdf_union is None:
-                # create new overall union
-                gdf_union = union
-            else:
-                # union of unified footprints and footprints before
-                polys = [gdf_union, union]
-                gdf_union = unary_union(polys)
+    candidates = candidates if candidates is not None else []
+    coverage = coverage if coverage is not None else _Coverage()
+
+    # we fill a set with tracks used for the mosaic,
+    # so they are not used twice
+    included_tracks = set()
+
+    # loop through dates of the single mosaic backwards
+    for date in sorted(tracks_per_date, reverse=True):
+
+        if date > dates[1] or date < dates[0]:
+            continue
 
-            # get intersection with aoi and calculate area
-            inter = aoi_gdf.geometry.intersection(gdf_union)
-            intersect_area = inter.area.sum()
+        for track in tracks_per_date[date]:
 
-            # for the datelist, we reset some stuff for next mosaic
-            if intersect_area >= aoi_area - area_reduce:
-                datelist.append([start_date, date])
-                start_date = None
-                gdf_union = None
+            # we want every track just once, so we check
+            if track in included_tracks:
+                continue
 
-    return datelist, gpd.GeoDataFrame(out_frame, geometry='geometry')
+            included_tracks.add(track)
+
+            # add to overall coverage and to candidates
+            frames, piece = unions[(date, track)]
+            candidates.extend(frames)
+            coverage.add(piece)
+
+            # we stop if we found enough
+            if coverage.area >= min_area:
+                return True, candidates, coverage
+
+    return False, candidates, coverage
+
+
+def _tracks_per_date(unions):
+    '''Returns the tracks of each date of the footprint unions'''
+
+    tracks_per_date = {}
+    for date, track in sorted(unions):
+        tracks_per_date.setdefault(date, []).append(track)
+
+    return tracks_per_date
 
 
 def _backward_search(aoi_gdf, inventory_df, datelist, area_reduce=0):
@@ -423,117 +555,310 @@ def _backward_search(aoi_gdf, inventory_df, datelist, area_reduce=0):
     different swaths.
     '''
 
-    # get AOI area
-    aoi_area = aoi_gdf.area.sum()
+    # get unified footprints per date and track
+    unions, min_area = _footprint_unions(aoi_gdf, inventory_df, area_reduce)
+    tracks_per_date = _tracks_per_date(unions)
 
-    # create empty dataFrame for output
-    temp_df = gpd.GeoDataFrame(columns=inventory_df.columns)
-    out_frame = gpd.GeoDataFrame(columns=inventory_df.columns)
-    gdf_union, intersect_area = None, 0
+    # positions of the frames to keep and of the current candidate mosaic
+    positions, candidates, coverage = [], [], _Coverage()
 
     # sort the single full coverages from _forward_search
     for dates in datelist:
 
-        # extract scenes for single mosaics
-        gdf = inventory_df[(inventory_df['acquisitiondate'] <= dates[1]) &
-                           (inventory_df['acquisitiondate'] >= dates[0])]
+        # frames of an incomplete mosaic are carried over to the next one
+        complete, candidates, coverage = _backward_period(
+            unions, tracks_per_date, min_area, dates, candidates, coverage)
 
-        # we create an emtpy list and fill with tracks used for the mosaic,
-        # so they are not used twice
-        included_tracks = []
+        if complete:
+            positions.extend(candidates)
+            candidates, coverage = [], _Coverage()
 
-        # loop through dates backwards
-        for date in sorted(gdf['acquisitiondate'].unique(), reverse=True):
+    return gpd.GeoDataFrame(inventory_df.iloc[positions], geometry='geometry',
+                            crs={'init': 'epsg:4326', 'no_defs': True})
 
-            # create a list of tracks for that date (sometimes more than one)
-            tracklist = gdf['relativeorbit'][
-                (gdf['acquisitiondate'] == date)].unique()
 
-            for track in tracklist:
+def _size_in_gb(size):
+    '''Converts the size attribute of the inventory (e.g. '1.6 GB') to GB'''
 
-                # we want every track just once, so we check
-                if track not in included_tracks:
+    value, unit = str(size).split()
+    if unit.upper() == 'MB':
+        return float(value) / 1024
+    return float(value)
 
-                    included_tracks.append(track)
 
-                    # get all footprints for each date and track
-                    track_gdf = gdf[(gdf['acquisitiondate'] == date) &
-                                    (gdf['relativeorbit'] == track)]
+def _minimal_cover(aoi_gdf, inventory_df, datelist, area_reduce=0):
+    '''Selects the cheapest set of frames that covers the AOI per mosaic
 
-                    # re-initialize GDF due to groupby fucntion
-                    track_gdf = gpd.GeoDataFrame(track_gdf,
-                                                 geometry='geometry')
+    For each mosaic period of the datelist, this function solves a weighted
+    set cover problem by a lazy greedy search over the unified footprints
+    per date and track. The acquisition with the highest ratio of newly
+    covered AOI area to its size is added until the AOI is covered. As in
+    _backward_search, every track is used only once per mosaic, so that
+    the time-series of all tracks line up. Frames that have become
+    redundant by later choices are removed afterwards, starting with the
+    largest ones.
 
-                    # get a unified geometry for date/track combination
-                    union = track_gdf.geometry.unary_union
+    Since SNAP can only assemble consecutive slices, frames in between two
+    selected slices of the same acquisition are added back. Periods the
+    greedy search cannot cover keep the frames of the backward search.
 
-                    # add to overall union and to out_frame
-                    temp_df = temp_df.append(track_gdf)
+    Args:
+        aoi_gdf (gdf): the aoi as an GeoDataFrame
+        inventory_df (gdf): an OST compliant Sentinel-1 inventory GeoDataFrame
+        datelist (list): the mosaic periods as created by _forward_search
+        area_reduce (float): reduction of AOI by square degrees
 
-                    # just for first loop
-                    if gdf_union is None:
-                        # create new overall union
-                        gdf_union = union
-                    else:
-                        # union of unified footprints and footprints before
-                        polys = [gdf_union, union]
-                        gdf_union = unary_union(polys)
+    Returns:
+        inventory_df (gdf): the manipulated inventory GeodataFrame
+
+    '''
+
+    aoi_geom, geoms, min_area = _equal_area_footprints(
+        aoi_gdf, inventory_df, area_reduce)
+    prepared_aoi = prep(aoi_geom)
+    unions, _ = _footprint_unions(aoi_gdf, inventory_df, area_reduce)
+    tracks_per_date = _tracks_per_date(unions)
+
+    weights = [max(_size_in_gb(size), 0.001) for size in inventory_df['size']]
+    dates = inventory_df['acquisitiondate'].values
+    slices = inventory_df['slicenumber'].astype(int).values
+    tracks = inventory_df['relativeorbit'].values
+
+    positions = []
+    for start, end in datelist:
+
+        # the acquisitions of this mosaic period and their size
+        candidates = {key: (frames, piece, sum(weights[i] for i in frames))
+                      for key, (frames, piece) in unions.items()
+                      if start <= key[0] <= end and not piece.is_empty}
 
-                    # get intersection with aoi and calulate area
-                    inter = aoi_gdf.geometry.intersection(gdf_union)
-                    intersect_area = inter.area.sum()
+        # lazy greedy search, gain per GB can only decrease with coverage
+        coverage, selected, used_tracks = _Coverage(), [], set()
+        # the position breaks ties, tracks may be of mixed type
+        heap = [(-piece.area / weight, n, key) for n, (key, (_, piece, weight))
+                in enumerate(candidates.items())]
+        heapq.heapify(heap)
 
-                    # we break the loop if we found enough
-                    if intersect_area >= aoi_area - area_reduce:
+        while heap and coverage.area < min_area:
 
-                        # cleanup scenes
-                        out_frame = out_frame.append(temp_df)
-                        temp_df = gpd.GeoDataFrame(
-                            columns=inventory_df.columns)
-                        gdf_union = None
+            _, n, key = heapq.heappop(heap)
 
-                        # stop for loop
-                        break
+            # we want every track just once
+            if key[1] in used_tracks:
+                continue
 
-            # we break the loop if we found enough
-            if intersect_area >= aoi_area - area_reduce:
-                break
+            frames, piece, weight = candidates[key]
+            if coverage.geometry is None:
+                gain = piece.area
+            else:
+                gain = piece.difference(coverage.geometry).area
+
+            if gain <= 0:
+                continue
 
-    return gpd.GeoDataFrame(out_frame, geometry='geometry',
+            # accept if it still beats the next best candidate
+            if not heap or -gain / weight <= heap[0][0]:
+                coverage.add(piece)
+                selected.extend(frames)
+                used_tracks.add(key[1])
+            else:
+                heapq.heappush(heap, (-gain / weight, n, key))
+
+        # keep the frames of the backward search rather than losing the
+        # mosaic period
+        if coverage.area < min_area:
+            print(' INFO: No cheaper coverage found for the period {} to {},'
+                  ' using the backward search.'.format(start, end))
+            complete, frames, _ = _backward_period(
+                unions, tracks_per_date, min_area, (start, end))
+            if complete:
+                positions.extend(frames)
+            continue
+
+        # clip the selected frames to the AOI
+        pieces = {i: aoi_geom.intersection(geoms[i]) if
+                  prepared_aoi.intersects(geoms[i]) else Polygon()
+                  for i in selected}
+
+        # remove redundant frames, starting with the largest
+        for i in sorted(selected, key=lambda j: weights[j], reverse=True):
+            remaining = [pieces[j] for j in selected if j != i]
+            if remaining and unary_union(remaining).area >= min_area:
+                selected.remove(i)
+
+        # fill gaps between slices of the same acquisition
+        slice_range = {}
+        for i in selected:
+            low, high = slice_range.get((dates[i], tracks[i]),
+                                        (slices[i], slices[i]))
+            slice_range[(dates[i], tracks[i])] = (min(low, slices[i]),
+                                                  max(high, slices[i]))
+
+        for i in range(len(inventory_df)):
+            if i not in selected and (dates[i], tracks[i]) in slice_range:
+                low, high = slice_range[(dates[i], tracks[i])]
+                if low < slices[i] < high:
+                    selected.append(i)
+
+        positions.extend(sorted(selected))
+
+    return gpd.GeoDataFrame(inventory_df.iloc[positions], geometry='geometry',
                             crs={'init': 'epsg:4326', 'no_defs': True})
 
 
+def _refine_combination(argument_list):
+    '''Applies the refinement steps to a single polarisation/orbit combination
+
+    This is the worker function of search_refinement. It takes a single
+    list of arguments, so that it can be mapped over a process pool.
+
+    Args:
+        argument_list (list): aoi_gdf, the inventory subset, inventory_dir,
+                              polarisation, orbit direction, exclude_marginal,
+                              full_aoi_crossing, mosaic_refine,
+                              mosaic_optimise and area_reduce
+
+    Returns:
+        key (str): the mosaic key, i.e. ORBITDIRECTION_POLARISATION
+        inventory_refined (gdf): the refined inventory or None
+        nr_of_mosaics (int): the number of full coverage mosaics
+        timings (list): tuples of refinement step and time elapsed in seconds
+
+    '''
+
+    (aoi_gdf, inv_df_sorted, inventory_dir, pol, orb, exclude_marginal,
+     full_aoi_crossing, mosaic_refine, mosaic_optimise,
+     area_reduce) = argument_list
+
+    key = '{}_{}'.format(orb, ''.join(pol.split()))
+    timings, datelist = [], []
+
+    def _timed(step, function, *args):
+        start = time.time()
+        result = function(*args)
+        timings.append((step, time.time() - start))
+        return result
+
+    print(' INFO: {} frames for {} tracks in {} polarisation.'.format(
+        len(inv_df_sorted), orb, pol))
+
+    # calculate intersected area
+    inter = aoi_gdf.geometry.intersection(inv_df_sorted.unary_union)
+    intersect_area = inter.area.sum()
+
+    # we do a first check if the scenes do not fully cover the AOI
+    if intersect_area <= aoi_gdf.area.sum() - area_reduce:
+        print(' WARNING: Set of footprints for {} tracks in {} polarisation'
+              ' does not fully cover AOI. '.format(orb, pol))
+        return key, None, 0, timings
+
+    # apply the different sorting steps
+    inventory_refined = _timed(
+        'double entries', _remove_double_entries, inv_df_sorted)
+
+    inventory_refined = _timed(
+        'outside AOI', _remove_outside_aoi, aoi_gdf, inventory_refined)
+
+    if orb == 'ASCENDING':
+        inventory_refined = _timed(
+            'equator crossing', _handle_equator_crossing, inventory_refined)
+
+    # get number of tracks
+    nr_of_tracks = len(inventory_refined.relativeorbit.unique())
+    if exclude_marginal is True and nr_of_tracks > 1:
+        inventory_refined = _timed(
+            'marginal tracks', _exclude_marginal_tracks,
+            aoi_gdf, inventory_refined, area_reduce)
+
+    if full_aoi_crossing is True:
+        inventory_refined = _timed(
+            'incomplete tracks', _remove_incomplete_tracks,
+            aoi_gdf, inventory_refined)
+
+    inventory_refined = _timed(
+        'non-continous swath', _handle_non_continous_swath, inventory_refined)
+
+    if mosaic_refine is True:
+        datelist, inventory_refined = _timed(
+            'forward search', _forward_search,
+            aoi_gdf, inventory_refined, area_reduce)
+        inventory_greedy = _timed(
+            'backward search', _backward_search,
+            aoi_gdf, inventory_refined, datelist, area_reduce)
+
+        if mosaic_optimise is True:
+            inventory_optimised = _timed(
+                'set cover', _minimal_cover,
+                aoi_gdf, inventory_refined, datelist, area_reduce)
+
+            greedy_size = sum(_size_in_gb(x) for x in inventory_greedy['size'])
+            optimised_size = sum(
+                _size_in_gb(x) for x in inventory_optimised['size'])
+
+            if len(inventory_optimised) and optimised_size < greedy_size:
+                print(' INFO: The set cover optimisation for {} saves {:.1f}'
+                      ' GB ({} instead of {} scenes).'.format(
+                          key, greedy_size - optimised_size,
+                          len(inventory_optimised), len(inventory_greedy)))
+                inventory_greedy = inventory_optimised
+            else:
+                print(' INFO: The set cover optimisation for {} saves no'
+                      ' data.'.format(key))
+
+        inventory_refined = inventory_greedy
+
+    if len(inventory_refined) == 0:
+        return key, None, len(datelist), timings
+
+    vec.inventory_to_shp(
+        inventory_refined, '{}/{}_{}_{}.shp'.format(
+            inventory_dir, len(datelist), orb, ''.join(pol.split())
+            )
+        )
+
+    return key, inventory_refined, len(datelist), timings
+
+
 def search_refinement(aoi, inventory_df, inventory_dir,
                       exclude_marginal=True,
                       full_aoi_crossing=True,
                       mosaic_refine=True,
-                      area_reduce=0.05):
+                      area_reduce=0.05,
+                      concurrent=None,
+                      mosaic_optimise=False):
     '''A function to refine the Sentinel-1 search by certain criteria
 
+    The combinations of polarisation and orbit direction are independent
+    from each other and refined in parallel.
+
     Args:
         aoi (WKT str):
         inventory_df (GeoDataFrame):
         inventory_dir (str or path):
+        concurrent (int): number of combinations refined in parallel
+                          (default: one process per combination,
+                           at most one per CPU)
+        mosaic_optimise (bool): select the frames of each mosaic by a
+                                size-weighted set cover instead of the
+                                date-ordered backward search, if this
+                                needs less data
 
     Returns:
         refined inventory (dictionary):
         coverages (dictionary):
 
     '''
-    # creat AOI GeoDataframe and calulate area
+    # creat AOI GeoDataframe
     aoi_gdf = vec.wkt_to_gdf(aoi)
-    aoi_area = aoi_gdf.area.sum()
+
     # get all polarisations apparent in the inventory
     pols = inventory_df['polarisationmode'].unique()
 
     # get orbit directions apparent in the inventory
     orbit_directions = inventory_df['orbitdirection'].unique()
 
-    # create inventoryDict
-    inventory_dict = {}
-    coverage_dict = {}
-
-    # loop through all possible combinations
+    # create the argument lists for all possible combinations
+    refine_list = []
     for pol, orb in itertools.product(pols, orbit_directions):
 
         print(' INFO: Coverage analysis for {} tracks in {} polarisation.'
@@ -544,59 +869,37 @@ def search_refinement(aoi, inventory_df, inventory_dir,
             (inventory_df['polarisationmode'] == pol) &
             (inventory_df['orbitdirection'] == orb)]
 
-        print(' INFO: {} frames for {} tracks in {} polarisation.'.format(
-            len(inv_df_sorted), orb, pol))
-
-        # calculate intersected area
-        inter = aoi_gdf.geometry.intersection(inv_df_sorted.unary_union)
-        intersect_area = inter.area.sum()
-
-        # we do a first check if the scenes do not fully cover the AOI
-        if intersect_area <= aoi_area - area_reduce:
-            print(' WARNING: Set of footprints does not fully cover AOI. ')
-
-        # otherwise we go on
-        else:
-
-            # apply the different sorting steps
-            inventory_refined = _remove_double_entries(inv_df_sorted)
+        refine_list.append([aoi_gdf, inv_df_sorted, inventory_dir, pol, orb,
+                            exclude_marginal, full_aoi_crossing,
+                            mosaic_refine, mosaic_optimise, area_reduce])
 
-            inventory_refined = _remove_outside_aoi(aoi_gdf, inventory_refined)
+    if not concurrent:
+        concurrent = min(len(refine_list), os.cpu_count())
 
-            if orb == 'ASCENDING':
-                inventory_refined = _handle_equator_crossing(inventory_refined)
-
-            # get number of tracks
-            nr_of_tracks = len(inventory_refined.relativeorbit.unique())
-            print(nr_of_tracks)
-            if exclude_marginal is True and nr_of_tracks > 1:
-                inventory_refined = _exclude_marginal_tracks(
-                    aoi_gdf, inventory_refined, area_reduce)
+    start = time.time()
+    if concurrent > 1:
+        # the context terminates the workers if one of them fails
+        with multiprocessing.Pool(processes=concurrent) as pool:
+            results = pool.map(_refine_combination, refine_list)
+    else:
+        results = [_refine_combination(args) for args in refine_list]
 
-            if full_aoi_crossing is True:
-                inventory_refined = _remove_incomplete_tracks(
-                    aoi_gdf, inventory_refined)
+    # create inventoryDict
+    inventory_dict = {}
+    coverage_dict = {}
 
-            inventory_refined = _handle_non_continous_swath(inventory_refined)
+    for key, inventory_refined, nr_of_mosaics, timings in results:
 
-            if mosaic_refine is True:
-                datelist, inventory_refined = _forward_search(
-                    aoi_gdf, inventory_refined, area_reduce)
-                inventory_refined = _backward_search(
-                    aoi_gdf, inventory_refined, datelist, area_reduce)
+        for step, elapsed in timings:
+            print(' INFO: {}: {} took {}'.format(
+                key, step, timedelta(seconds=elapsed)))
 
-            if len(inventory_refined) != 0:
-                vec.inventory_to_shp(
-                    inventory_refined, '{}/{}_{}_{}.shp'.format(
-                        inventory_dir, len(datelist), orb, ''.join(pol.split())
-                        )
-                    )
-                inventory_dict['{}_{}'.format(
-                    orb, ''.join(pol.split()))] = inventory_refined
-                coverage_dict['{}_{}'.format(
-                    orb, ''.join(pol.split()))] = len(datelist)
+        if inventory_refined is not None:
+            inventory_dict[key] = inventory_refined
+            coverage_dict[key] = nr_of_mosaics
 
-            print(' INFO: Found {} full coverage mosaics.'
-                  .format(len(datelist)))
+        print(' INFO: Found {} full coverage mosaics for {}.'
+              .format(nr_of_mosaics, key))
 
+    h.timer(start)
     return inventory_dict, coverage_dict
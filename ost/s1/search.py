@@ -66,7 +66,7 @@ from shapely.wkt import dumps, loads
 
 # internal libs
 from ost.helpers.db import pgHandler
-from ost.helpers import scihub
+from ost.helpers import scihub, trace
 
 
 def _query_scihub(apihub, opener, query):
@@ -316,6 +316,7 @@ def check_availability(inventory_gdf, download_dir, data_mount):
     return inventory_gdf
 
 
+@trace.traced('search', 'search')
 def scihub_catalogue(query_string, output, append=False,
                      uname=None, pword=None):
     '''This is the main search function on scihub
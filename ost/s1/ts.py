@@ -96,12 +96,14 @@ def create_ts_animation(ts_dir, temp_dir, outfile, shrink_factor):
               -size {}x{} caption:\"{}\" {} +swap -gravity north \
               -composite {}'.format(out_meta['width'], label_height,
                                     date, out_temp, out_temp)
-        os.system(cmd)
+        h.run_command(cmd, '{}.log'.format(out_temp), elapsed=False,
+                      tags=dict(stage='label'))
 
     # create gif
     lst_of_files = ' '.join(sorted(glob.glob(opj(temp_dir, '*jpg'))))
     cmd = 'convert -delay 200 -loop 20 {} {}'.format(lst_of_files, outfile)
-    os.system(cmd)
+    h.run_command(cmd, '{}.log'.format(outfile), elapsed=False,
+                  tags=dict(stage='animation'))
 
     for file in glob.glob(opj(temp_dir, '*jpg')):
         os.remove(file)
@@ -21,4 +21,10 @@ setup(name='ost',
       keywords=['Sentinel-1', 'ESA', 'SAR', 'Radar',
                 'Earth Observation', 'Remote Sensing',
                 'Synthetic Aperture Radar'],
+      entry_points={
+          'console_scripts': [
+              'ost-run-task=ost.helpers.manifest:main',
+              'ost-snap-engine=ost.helpers.snap_engine:main'
+          ]
+      },
       zip_safe=False)